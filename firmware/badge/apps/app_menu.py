@@ -10,23 +10,44 @@ from apps.base_app import BaseApp
 # For logo random
 import random
 
+# Apps per page of a secondary menu with more than 4, F4 goes to the next page
+PAGE_APPS = 3
+
+
 class AppMenu(BaseApp):
     def __init__(self, name: str, badge, apps: list[BaseApp | None], main: bool):
         super().__init__(name, badge)
-        self.apps = apps
+        self.all_menu_apps = apps
         self.background_sleep_ms = 200
         self.heartbeat_print_counter = 0
         self.main: bool = main
         print("Preparing AppMenu Splashscreen")
+        self.page_number = 0
+        self.paged = not self.main and len(apps) > 4
+        self.page = None
+        self.show_page(0)
+
+    def show_page(self, page_number: int):
+        """Set the apps on the function keys, for a page of a paged menu."""
+        if self.paged:
+            self.page_number = page_number % ((len(self.all_menu_apps) + PAGE_APPS - 1) // PAGE_APPS)
+            first = self.page_number * PAGE_APPS
+            self.apps = self.all_menu_apps[first : first + PAGE_APPS]
+            self.apps += [None] * (PAGE_APPS - len(self.apps))
+        else:
+            self.apps = list(self.all_menu_apps)
+            if not self.main:  # Fewer than 4 apps, the rest of F1 to F4 do nothing
+                self.apps += [None] * (4 - len(self.apps))
         self.name_list = []
         for app in self.apps:
             if app:
                 self.name_list.append(app.name)
             else:
                 self.name_list.append("")
+        if self.paged:
+            self.name_list.append("More")
         if not self.main:  # For secondary menu
             self.name_list.append("Home")
-        self.page = None
 
     def add_logo(self, logo_filename):
         self.logo = graphics.create_image(logo_filename, self.page.content)
@@ -66,7 +87,11 @@ class AppMenu(BaseApp):
         if self.badge.keyboard.f3():
             app_to_run = self.apps[2]
         if self.badge.keyboard.f4():
-            app_to_run = self.apps[3]
+            if self.paged:
+                self.show_page(self.page_number + 1)
+                self.switch_to_foreground()
+            else:
+                app_to_run = self.apps[3]
         if self.badge.keyboard.f5():
             if self.main:
                 app_to_run = self.apps[4]
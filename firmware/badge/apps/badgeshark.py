@@ -45,6 +45,9 @@ class BadgeShark(BaseApp):
             if len(self.display_list) > self.display_list_max_len:
                 self.display_list.pop(0)
         self.capture_list = []
+        throttled = badgenet.rate_limiter.throttled_sources()
+        if throttled:
+            print("Relays throttled: " + ", ".join(f"{source:x} x{count}" for source, count in throttled))
         for idx, message in enumerate(self.display_list):
             if isinstance(message, NetworkFrame):
                 if message.fields_set:
@@ -1,12 +1,27 @@
 """IRC-like chat app"""
 
+import asyncio as aio  # type: ignore
 from collections import deque, namedtuple
+import random
+import struct
+import time
 
 from apps.base_app import BaseApp
-from net.net import BROADCAST_ADDRESS, MY_ADDRESS, register_receiver, send
-from net.protocols import NetworkFrame, Protocol
+from net.catchup import BLOOM_BYTES, BloomFilter, pack_entries, unpack_entries
+from net.directory import directory
+from net.group_mac import TAG_LEN
+from net.group_manager import group
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, SEND_DROPPED, register_receiver, send
+from net.protocols import HEADER_LEN, MAX_FRAME_LEN, NetworkFrame, Protocol, crc_calculator
+from net.verifier import REJECTED, UNVERIFIED, VERIFIED, verifier
 from ui.chat import Chat
 
+# Read by apps/registry.py without importing this module
+APP_NAME = "Chat"
+APP_CLASS = "ChatApp"
+APP_PORTS = (6, 7, 8, 9, 10, 11, 12)  # Of the chat protocols below
+APP_BACKGROUND = True  # Loaded at boot, so it catches up on the history it missed while off
+
 MAX_MESSAGE_LEN = 100
 TEXT_CHAT = Protocol(
     port=6, name="TEXT_CHAT", structdef=f"!H10s{MAX_MESSAGE_LEN}s"
@@ -14,12 +29,47 @@ TEXT_CHAT = Protocol(
 SIGNED_TEXT_CHAT = Protocol(
     port=7, name="SIGNED_TEXT_CHAT", structdef=f"!H10s128s90s"
 )  # Text (ASCII) message to a chat channel with a signature to verify authenticity
-
-
+LEAN_TEXT_CHAT = Protocol(
+    port=8, name="LEAN_TEXT_CHAT", structdef=f"!H{MAX_MESSAGE_LEN}s"
+)  # Text (ASCII) message to a chat channel, without the alias. Receivers look it up in the node directory
+CHAT_SYNC_REQUEST = Protocol(
+    port=9, name="CHAT_SYNC_REQUEST", structdef=f"!H{BLOOM_BYTES}s"
+)  # Channel, and a Bloom filter of the messages the sender has, see net/catchup.py
+SYNC_REPLY_HEADER = "!IBH"  # Requester, request seq num, channel
+SYNC_REPLY_HEADER_LEN = struct.calcsize(SYNC_REPLY_HEADER)
+SYNC_ENTRIES_LEN = MAX_FRAME_LEN - HEADER_LEN - SYNC_REPLY_HEADER_LEN
+CHAT_SYNC_REPLY = Protocol(
+    port=10, name="CHAT_SYNC_REPLY", structdef=SYNC_REPLY_HEADER
+)  # Followed by the messages missing from a CHAT_SYNC_REQUEST, packed. Variable length
+SHORT_SIGNED_TEXT_CHAT = Protocol(
+    port=11, name="SHORT_SIGNED_TEXT_CHAT", structdef=f"!H65s{MAX_MESSAGE_LEN}s"
+)  # Text (ASCII) message to a chat channel with a key ID byte and Ed25519 signature, see net/crypto.py. No alias
+MAC_TEXT_CHAT = Protocol(
+    port=12, name="MAC_TEXT_CHAT", structdef=f"!HBI{TAG_LEN}s{MAX_MESSAGE_LEN}s"
+)  # Text (ASCII) message to a chat channel with a group key ID, counter and tag, see net/group_mac.py. No alias
+
+SYNC_SETTLE_MS = 2000  # Only ask for history once a channel has been open this long
+SYNC_REQUEST_INTERVAL_MS = 60000
+SYNC_BACKOFF_MIN_MS = 100
+SYNC_BACKOFF_MAX_MS = 1500
+SYNC_HISTORY = 50  # Most recent messages offered in a reply
+MAX_SYNC_FRAMES = 3
+
+
+# Aliases aren't kept per message, they're looked up in the node directory.
+# message_id tells messages from the same source apart, see message_id().
+# signed is None for unsigned messages, or PENDING, VERIFIED or UNVERIFIED from net/verifier.py.
+# History from a sync reply is UNVERIFIED, since anyone could have sent it.
+# time_s is time.time() when received, or when sent for a sync reply's age.
 ChatMessage = namedtuple(
-    "ChatMessage", ["source_addr", "source_alias", "text", "signed"]
+    "ChatMessage", ["source_addr", "message_id", "text", "signed", "time_s"]
 )
 
+
+def message_id(source: int, seq_num: int, channel_num: int, text: bytes) -> int:
+    """16 bit ID of a chat message. The frame sequence number alone wraps every few minutes."""
+    return crc_calculator.checksum(struct.pack("!IBH", source, seq_num & 0xFF, channel_num) + text)
+
 # Modes
 MODE_CHANNEL_LIST = 0
 MODE_CHANNEL = 1
@@ -54,6 +104,15 @@ class ChatApp(BaseApp):
             self.chat_ttl = int(self.badge.config.get("chat_ttl", b"3"))
         except ValueError:
             self.chat_ttl = 2
+        # Older badges only understand TEXT_CHAT
+        self.lean = self.badge.config.get("chat_lean", b"false") == b"true"
+        # Tag messages with the group key once there is one, see net/group_manager.py
+        self.group_mac = self.badge.config.get("chat_group_mac", b"false") == b"true"
+        # History catch-up
+        self.sync_channel = None
+        self.sync_due_ms: int | None = None
+        self.sync_requested: dict[int, int] = {}  # channel: ticks_ms() of the last request
+        self.sync_answered: set[tuple[int, int]] = set()  # (requester, request seq num) already replied to
 
     def _update_channel_messages(self, seek = None):
         if not self.channel_messages_updated:
@@ -71,38 +130,83 @@ class ChatApp(BaseApp):
             return
         display_messages = []
         for message in messages:
-            if(message.source_alias and message.source_alias != ''):
-                source = f"{message.source_alias}"
-            else:
-                source = f"{message.source_addr:x}"
-            display_messages.append((source, message.text))
+            name = directory.display_name(message.source_addr)
+            if message.signed == UNVERIFIED:
+                name += "?"  # Signature couldn't be checked, or history from a sync reply
+            display_messages.append((name, message.text))
         self.page.populate_message_rows(display_messages)
         self.channel_messages_updated = False
 
     def receive_message(self, message: NetworkFrame):
         if message.port == TEXT_CHAT.port:
             channel_num, source_alias, text = message.payload
-            signed = False
+            signed = None
             # print(
             #     f"Chat rx: {message.source:x} {source_alias}: {channel_num}: {text[:16]}"
             # )
         elif message.port == SIGNED_TEXT_CHAT.port:
             channel_num, source_alias, signature, text = message.payload
             # Only verifying the message, not packet headers. Risky?
-            signed = self.badge.crypto.verify(text, signature)
+            source = message.source
+            chat_id = message_id(source, message.seq_num, channel_num, text.strip(b"\0"))
+            signed = verifier.verify(
+                text, signature, lambda status: self._signature_checked(channel_num, source, chat_id, status)
+            )
             # print(
             #     f"Signed Chat rx: {message.source:x} {source_alias}: {channel_num}: {text[:16]} verified: {signed}"
             # )
-            if not signed:
+            if signed == REJECTED:
                 return
+        elif message.port == SHORT_SIGNED_TEXT_CHAT.port:
+            channel_num, signature, text = message.payload
+            source_alias = b""
+            source = message.source
+            chat_id = message_id(source, message.seq_num, channel_num, text.strip(b"\0"))
+            signed = verifier.verify(
+                text, signature, lambda status: self._signature_checked(channel_num, source, chat_id, status)
+            )
+            if signed == REJECTED:
+                return
+        elif message.port == MAC_TEXT_CHAT.port:
+            channel_num, key_id, counter, tag, text = message.payload
+            source_alias = b""
+            body = struct.pack(f"!H{MAX_MESSAGE_LEN}s", channel_num, text)
+            if not group.open(message.source, MAC_TEXT_CHAT.port, key_id, counter, tag, body):
+                return
+            signed = VERIFIED
+        elif message.port == LEAN_TEXT_CHAT.port:
+            channel_num, text = message.payload
+            source_alias = b""
+            signed = None
+        source_alias = source_alias.strip(b"\0").decode()
+        if source_alias:
+            directory.learn(message.source, source_alias)
+        text = text.strip(b"\0")
         new_message = ChatMessage(
             message.source,
-            source_alias.strip(b"\0").decode(),
-            text.strip(b"\0").decode(),
+            message_id(message.source, message.seq_num, channel_num, text),
+            text.decode(),
             signed,
+            time.time(),
         )
-        if channel_num in self.channels:
-            self.channels[channel_num].append(new_message)
+        messages = self.channels.get(channel_num)
+        if messages is not None and any(
+            chat_message.source_addr == new_message.source_addr and chat_message.message_id == new_message.message_id
+            for chat_message in messages
+        ):
+            # Had it from a sync reply already, keep its place but take what was heard first hand
+            self.channels[channel_num] = deque(
+                [
+                    new_message
+                    if chat_message.source_addr == new_message.source_addr
+                    and chat_message.message_id == new_message.message_id
+                    else chat_message
+                    for chat_message in messages
+                ],
+                self.channel_buffer_len,
+            )
+        elif messages is not None:
+            messages.append(new_message)
         else:
             self.channels[channel_num] = deque(
                 [new_message],
@@ -110,10 +214,132 @@ class ChatApp(BaseApp):
             )
         self.channel_messages_updated = channel_num == self.active_channel
 
+    def _signature_checked(self, channel_num: int, source: int, chat_id: int, status: int):
+        """Mark a signed message verified once checked, or take it out again if its signature is bad."""
+        messages = self.channels.get(channel_num)
+        if not messages:
+            return
+        self.channels[channel_num] = deque(
+            [
+                ChatMessage(source, chat_id, chat_message.text, status, chat_message.time_s)
+                if chat_message.source_addr == source and chat_message.message_id == chat_id
+                else chat_message
+                for chat_message in messages
+                if chat_message.source_addr != source or chat_message.message_id != chat_id or status != REJECTED
+            ],
+            self.channel_buffer_len,
+        )
+        self.channel_messages_updated = self.channel_messages_updated or channel_num == self.active_channel
+
     def start(self):
         super().start()
         register_receiver(TEXT_CHAT, self.receive_message)
         register_receiver(SIGNED_TEXT_CHAT, self.receive_message)
+        register_receiver(SHORT_SIGNED_TEXT_CHAT, self.receive_message)
+        register_receiver(LEAN_TEXT_CHAT, self.receive_message)
+        register_receiver(MAC_TEXT_CHAT, self.receive_message)
+        register_receiver(CHAT_SYNC_REQUEST, self.receive_sync_request)
+        register_receiver(CHAT_SYNC_REPLY, self.receive_sync_reply, variable_length=True)
+
+    def _catch_up(self):
+        """Ask nearby badges for the history of the active channel, once it's been open for a bit."""
+        now = time.ticks_ms()
+        if self.active_channel != self.sync_channel:
+            self.sync_channel = self.active_channel
+            self.sync_due_ms = time.ticks_add(now, SYNC_SETTLE_MS)
+            return
+        if self.sync_due_ms is None or time.ticks_diff(now, self.sync_due_ms) < 0:
+            return
+        self.sync_due_ms = None
+        last_request_ms = self.sync_requested.get(self.active_channel)
+        if last_request_ms is not None and time.ticks_diff(now, last_request_ms) < SYNC_REQUEST_INTERVAL_MS:
+            return
+        self.sync_requested[self.active_channel] = now
+        bloom = BloomFilter()
+        for message in self.channels.get(self.active_channel, ()):
+            bloom.add(message.source_addr, message.message_id)
+        send(
+            NetworkFrame().set_fields(
+                protocol=CHAT_SYNC_REQUEST,
+                destination=BROADCAST_ADDRESS,
+                ttl=0,
+                payload=(self.active_channel, bytes(bloom.bits)),
+            )
+        )
+
+    def receive_sync_request(self, message: NetworkFrame):
+        channel_num, bits = message.payload
+        messages = self.channels.get(channel_num)
+        if not messages:
+            return
+        bloom = BloomFilter(bits)
+        now = time.time()
+        missing = [
+            (
+                chat_message.source_addr,
+                chat_message.message_id,
+                int(now - chat_message.time_s),
+                chat_message.text.encode(),
+            )
+            for chat_message in list(messages)[-SYNC_HISTORY:]
+            if not bloom.contains(chat_message.source_addr, chat_message.message_id)
+        ]
+        if missing:
+            aio.create_task(self._reply_sync((message.source, message.seq_num), channel_num, missing))
+
+    async def _reply_sync(self, request: tuple[int, int], channel_num: int, missing: list):
+        # Whichever badge's backoff ends first replies, and the others hear it and stay quiet
+        await aio.sleep_ms(random.randrange(SYNC_BACKOFF_MIN_MS, SYNC_BACKOFF_MAX_MS))
+        if request in self.sync_answered:
+            return
+        self._mark_answered(request)
+        for _ in range(MAX_SYNC_FRAMES):
+            packed, count = pack_entries(missing, SYNC_ENTRIES_LEN)
+            if not count:
+                break
+            missing = missing[count:]
+            send(
+                NetworkFrame().set_fields(
+                    protocol=Protocol(
+                        CHAT_SYNC_REPLY.port, CHAT_SYNC_REPLY.name, f"{SYNC_REPLY_HEADER}{len(packed)}s"
+                    ),
+                    destination=BROADCAST_ADDRESS,
+                    ttl=0,
+                    payload=(request[0], request[1], channel_num, packed),
+                )
+            )
+
+    def _mark_answered(self, request: tuple[int, int]):
+        if len(self.sync_answered) > 32:
+            self.sync_answered.clear()
+        self.sync_answered.add(request)
+
+    def receive_sync_reply(self, message: NetworkFrame):
+        if not message.payload:
+            return
+        requester, request_seq, channel_num = message.payload
+        self._mark_answered((requester, request_seq))
+        # Replies are broadcast, so they also fill in the history of others that missed the same messages
+        messages = list(self.channels.get(channel_num, ()))
+        known = {(chat_message.source_addr, chat_message.message_id) for chat_message in messages}
+        now = time.time()
+        added = False
+        for source, chat_id, age_s, text in unpack_entries(message.payload_bytes[SYNC_REPLY_HEADER_LEN:]):
+            if (source, chat_id) not in known:
+                # Signatures aren't passed along, so history is shown as unverified
+                messages.append(ChatMessage(source, chat_id, text.decode(), UNVERIFIED, now - age_s))
+                known.add((source, chat_id))
+                added = True
+        if not added:
+            return
+        # In the order they were sent, oldest dropped first
+        messages.sort(key=lambda chat_message: chat_message.time_s)
+        self.channels[channel_num] = deque(messages[-self.channel_buffer_len :], self.channel_buffer_len)
+        if channel_num == self.active_channel:
+            self.channel_messages_updated = True
+
+    def run_background(self):
+        self._catch_up()
 
     def switch_to_foreground(self):
         super().switch_to_foreground()
@@ -140,6 +366,7 @@ class ChatApp(BaseApp):
         self.channels_listed.sort()
 
     def run_foreground(self):
+        self._catch_up()
         if self.refresh_counter == 0:
             self._update_channel_messages()
 
@@ -153,9 +380,11 @@ class ChatApp(BaseApp):
             if self.badge.keyboard.f1():  # Send
                 if self.page.text_box.get_text():
                     message_text = self.page.close_text_box()
-                    self.send(message_text)
                     self.compose_active = False
-                    self.page.infobar_right.set_text("Hackaday Chat")
+                    if self.send(message_text):
+                        self.page.infobar_right.set_text("Hackaday Chat")
+                    else:
+                        self.page.infobar_right.set_text("Busy, not sent")
 
 
         if self.freq_picker_active:
@@ -264,8 +493,27 @@ class ChatApp(BaseApp):
             self.refresh_counter + 1
         ) & self.refresh_counter_divider_factor
 
-    def send(self, text):
-        chat_message = ChatMessage(MY_ADDRESS, self.my_alias, text, False)
+    def send(self, text) -> bool:
+        """Send a chat message on the active channel. Returns False if the network was too busy to take it."""
+        if self.group_mac and group.ready():
+            text_bytes = text.encode()
+            body = struct.pack(f"!H{MAX_MESSAGE_LEN}s", self.active_channel, text_bytes)
+            key_id, counter, tag = group.seal(MAC_TEXT_CHAT.port, body)
+            protocol, payload = MAC_TEXT_CHAT, (self.active_channel, key_id, counter, tag, text_bytes)
+        elif self.lean:
+            protocol, payload = LEAN_TEXT_CHAT, (self.active_channel, text)
+        else:
+            protocol, payload = TEXT_CHAT, (self.active_channel, self.my_alias[:10], text)
+        tx_message = NetworkFrame().set_fields(
+            protocol=protocol,
+            destination=BROADCAST_ADDRESS,
+            ttl=self.chat_ttl,
+            payload=payload,
+        )
+        if send(tx_message).state == SEND_DROPPED:
+            return False
+        chat_id = message_id(MY_ADDRESS, tx_message.seq_num, self.active_channel, text.encode())
+        chat_message = ChatMessage(MY_ADDRESS, chat_id, text, None, time.time())
         if self.active_channel in self.channels:
             self.channels[self.active_channel].append(chat_message)
         else:
@@ -273,10 +521,4 @@ class ChatApp(BaseApp):
                 [chat_message], self.channel_buffer_len
             )
         self.channel_messages_updated = True
-        tx_message = NetworkFrame().set_fields(
-            protocol=TEXT_CHAT,
-            destination=BROADCAST_ADDRESS,
-            ttl=self.chat_ttl,
-            payload=(self.active_channel, self.my_alias[:10], text),
-        )
-        send(tx_message)
+        return True
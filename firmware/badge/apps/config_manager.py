@@ -5,8 +5,13 @@ from apps.base_app import BaseApp
 
 from net.net import register_receiver, send, BROADCAST_ADDRESS
 from net.protocols import NetworkFrame, Protocol
+from net.verifier import PENDING, VERIFIED, verifier
 from ui.page import Page
 
+APP_NAME = "Config"
+APP_CLASS = "ConfigManager"
+APP_PORTS = (4,)  # CONFIG_OVERRIDE
+
 CONFIG_OVERRIDE = Protocol(port=4, name="CONFIG_OVERRIDE", structdef="!128s20s80s")
 
 
@@ -24,10 +29,13 @@ class ConfigManager(BaseApp):
 
     def _override_config_value(self, message: NetworkFrame):
         signature, key, value = message.payload
-        kv_bytes = key + value
-        signed = self.badge.crypto.verify(kv_bytes, signature)
-        print(f"Got config override message: {key}:{value} Signed: {signed}")
-        if not signed:
+        status = verifier.verify(key + value, signature, lambda status: self._apply_override(key, value, status))
+        if status != PENDING:
+            self._apply_override(key, value, status)
+
+    def _apply_override(self, key: bytes, value: bytes, status: int):
+        print(f"Got config override message: {key}:{value} Signed: {status == VERIFIED}")
+        if status != VERIFIED:
             return
         key_stripped = key.strip(b"\0").decode()
         val_stripped = value.strip(b"\0")
@@ -4,7 +4,8 @@ from collections import deque
 import time
 
 from apps.base_app import BaseApp
-from net.net import register_receiver, send, MY_ADDRESS, BROADCAST_ADDRESS
+from net.net import register_receiver, send, MY_ADDRESS, BROADCAST_ADDRESS, SEND_QUEUED
+from net.phy_manager import phy_manager
 from net.protocols import NetworkFrame, Protocol
 
 
@@ -30,6 +31,10 @@ class NetTools(BaseApp):
         self.last_pong_snr = 0
         self.ping_counter = 0
         self.pings = {}
+        self.ping_handle = None  # Outcome of the last ping sent, so pings don't pile up in the queue
+        # Badges that answered the previous and the current ping, for link delivery statistics
+        self.previous_responders = set()
+        self.current_responders = set()
 
     def start(self):
         """Register the app with the system."""
@@ -56,13 +61,17 @@ class NetTools(BaseApp):
                         destination=message.payload[0],
                         ttl=7,
                         payload=(MY_ADDRESS, message.ttl, message.payload[1], self.last_rssi, self.last_snr),
-                    )
+                    ),
+                    expires_ms=1000,  # The pinger has moved on to the next ping by then
                 )
             elif message.port == PONG.port:
                 self.last_ping_responder, self.last_pings_ttl, self.pong_counter, self.last_pings_rssi, self.last_pings_snr = message.payload
                 self.last_pong_rssi = self.badge.lora.get_rssi()
                 self.last_pong_snr = self.badge.lora.get_snr()
                 self.pings[self.pong_counter] = True
+                if self.pong_counter == (self.ping_counter - 1) & 0xFF:
+                    self.current_responders.add(self.last_ping_responder)
+                    phy_manager.record_ack(self.last_ping_responder, True)
                 # print(f"Received PONG from {pinged_address:x} via {message.source}.")
                 # print(f"PING arrived with TTL {ping_arrival_ttl} RSSI: {ping_arrival_rssi} SNR: {ping_arrival_snr}")
                 # print(f"PONG RSSI: {self.badge.lora.get_rssi()}  SNR: {self.badge.lora.get_snr()}")
@@ -75,7 +84,10 @@ class NetTools(BaseApp):
         self.process_receive_queue()
         if self.badge.keyboard.f5():  # Go back to Main Menu
             self.switch_to_background()
-        if self.badge.keyboard.f1() or time.time() - self.last_ping_time > 1.0:
+        if self.badge.keyboard.f1() or (
+            time.time() - self.last_ping_time > 1.0
+            and (self.ping_handle is None or self.ping_handle.state != SEND_QUEUED)
+        ):
             self.send_ping()
         if self.badge.keyboard.f5():
             self.switch_to_background()
@@ -96,13 +108,18 @@ class NetTools(BaseApp):
 
     def send_ping(self):
         # print("Sending a ping...")
-        send(
+        for responder in self.previous_responders - self.current_responders:
+            phy_manager.record_ack(responder, False)
+        self.previous_responders = self.current_responders
+        self.current_responders = set()
+        self.ping_handle = send(
             NetworkFrame().set_fields(
                 protocol=PING,
                 destination=BROADCAST_ADDRESS,
                 ttl=7,
                 payload=(MY_ADDRESS, self.ping_counter),
-            )
+            ),
+            expires_ms=2000,
         )
         self.pings[self.ping_counter] = False
         self.ping_counter = (self.ping_counter + 1) & 0xFF
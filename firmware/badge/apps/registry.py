@@ -0,0 +1,160 @@
+"""Registry of the apps in /apps, imported only once they're needed.
+
+Apps describe themselves with constants at the top level of their module, one per line:
+    APP_NAME = "Chat"  # Shown in the menus. Module name if not given
+    APP_CLASS = "ChatApp"  # Class to create, App if not given
+    APP_PORTS = (6, 7, 8)  # Ports it receives, so it's loaded when a frame arrives on one
+    APP_BACKGROUND = True  # Load at boot, for apps that always have to run
+Modules without APP_NAME are still apps if they define App at the top level, like userA.py copies
+made before these constants existed. Other modules, like base_app.py, aren't listed.
+The registry reads these lines from the source, without importing the module, and keeps them in
+the app_manifest data file with the size and modification time of each module. Only modules that
+changed since are read again, so boot doesn't slow down as apps are added.
+
+Each app is a LazyApp until it's opened from a menu, or a frame comes in on one of its ports. Then
+its module is imported, the app created and started. Copy a module with APP_NAME to /apps and it
+shows up in the User menu after a reset.
+"""
+
+import os
+import sys
+
+from hardware.datafile import DataFile
+from hardware.profiler import profiler
+from net.net import register_loader
+
+APPS_DIR = "/apps"
+MANIFEST_FORMAT = b"2"  # Bump when read_metadata() changes, so every module is read again
+
+
+def _literal(text: str):
+    """Value of a constant: a string, True or False, a tuple of ints, or a name."""
+    text = text.split("#")[0].strip()
+    if text[:1] in ("'", '"'):
+        return text[1:-1]
+    if text in ("True", "False"):
+        return text == "True"
+    if text[:1] in ("(", "["):
+        return tuple(int(item) for item in text[1:-1].split(",") if item.strip())
+    return text
+
+
+def read_metadata(path: str, module: str) -> dict:
+    """APP_* constants of a module's source. APP_NAME is the module name if it defines App without one."""
+    metadata = {}
+    defines_app = False
+    with open(path) as source:
+        for line in source:
+            if line.startswith("APP_") and "=" in line:
+                key, value = line.split("=", 1)
+                try:
+                    metadata[key.strip()] = _literal(value)
+                except ValueError:
+                    print(f"Can't read {key.strip()} of {path}")
+            elif line.startswith("class App(") or line.startswith("App ="):
+                defines_app = True
+    if "APP_NAME" not in metadata and defines_app:
+        metadata["APP_NAME"] = module
+    return metadata
+
+
+class LazyApp:
+    """Stands in for an app in the menus until it's needed."""
+
+    def __init__(self, registry, module: str, name: str, class_name: str, ports: tuple, background: bool):
+        self.registry = registry
+        self.module = module
+        self.name = name
+        self.class_name = class_name
+        self.ports = ports
+        self.background = background
+        self.app = None
+
+    @property
+    def active_foreground(self) -> bool:
+        return self.app is not None and self.app.active_foreground
+
+    def load(self):
+        """Import, create and start the app, once."""
+        if self.app is None:
+            with profiler.span(f"app {self.name}"):
+                module = getattr(__import__(f"apps.{self.module}"), self.module)
+                self.app = getattr(module, self.class_name)(self.name, self.registry.badge)
+                self.app.start()
+            print(f"Loaded app {self.name}")
+        return self.app
+
+    def _load_for_port(self):
+        try:
+            self.load()
+        except Exception as ex:
+            print(f"Failed to load app {self.name}")
+            sys.print_exception(ex)
+
+    def start(self):
+        if self.background:
+            self.load()
+            return
+        for port in self.ports:
+            register_loader(port, self._load_for_port)
+
+    def switch_to_foreground(self):
+        self.load().switch_to_foreground()
+
+    def switch_to_background(self):
+        if self.app is not None:
+            self.app.switch_to_background()
+
+
+class AppRegistry:
+    def __init__(self, badge):
+        self.badge = badge
+        self.apps: dict[str, LazyApp] = {}  # module name: app
+        self.manifest = DataFile("app_manifest")
+        self._scan()
+
+    def _scan(self):
+        reread = self.manifest.get("_format") != MANIFEST_FORMAT
+        changed = reread
+        seen = set()
+        for filename, _, _, _ in os.ilistdir(APPS_DIR):
+            if not filename.endswith(".py") or filename.startswith("_"):
+                continue
+            module = filename[:-3]
+            seen.add(module)
+            stat = os.stat(f"{APPS_DIR}/{filename}")
+            size, mtime = stat[6], stat[8]
+            entry = self.manifest.get(module)
+            fields = entry.decode().split(" ", 5) if entry else None
+            if reread or fields is None or int(fields[0]) != size or int(fields[1]) != mtime:
+                metadata = read_metadata(f"{APPS_DIR}/{filename}", module)
+                ports = ",".join(str(port) for port in metadata.get("APP_PORTS", ()))
+                background = 1 if metadata.get("APP_BACKGROUND") else 0
+                fields = [str(size), str(mtime), str(background), metadata.get("APP_CLASS", "App"), ports or "-", metadata.get("APP_NAME", "")]
+                self.manifest.set(module, " ".join(fields))
+                changed = True
+            _, _, background, class_name, ports, name = fields
+            if name:
+                ports = tuple(int(port) for port in ports.split(",")) if ports != "-" else ()
+                self.apps[module] = LazyApp(self, module, name, class_name, ports, background == "1")
+        for module in list(self.manifest.db.keys()):
+            if not module.startswith(b"_") and module.decode() not in seen:
+                del self.manifest.db[module]
+                changed = True
+        if changed:
+            self.manifest.set("_format", MANIFEST_FORMAT)
+            self.manifest.flush()
+
+    def app(self, module: str) -> LazyApp | None:
+        return self.apps.get(module)
+
+    def others(self, listed: list) -> list[LazyApp]:
+        """Apps not in listed, by name."""
+        apps = [app for app in self.apps.values() if app not in listed and not app.background]
+        apps.sort(key=lambda app: app.name)
+        return apps
+
+    def start(self):
+        """Load background apps, and have the others loaded when a frame comes in on one of their ports."""
+        for app in self.apps.values():
+            app.start()
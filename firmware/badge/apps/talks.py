@@ -10,6 +10,9 @@ from ui.talk import Talk
 from ui.talk import INTEREST_LEVELS
 import gc
 
+APP_NAME = "Talks"
+APP_CLASS = "Talks"
+
 
 # Class for talk data
 class talk:
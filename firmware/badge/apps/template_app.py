@@ -14,6 +14,16 @@ https://docs.micropython.org/en/latest/library/struct.html
 """
 # NEW_PROTOCOL = Protocol(port=<PORT>, name="<NAME>", structdef="!")
 
+"""
+Apps are listed in the menus by apps/registry.py, from these constants. It reads them from the
+source without importing the module, so keep each on one line, with a plain value.
+The module is only imported when the app is opened, or when a frame arrives on one of APP_PORTS.
+"""
+# APP_NAME = "Template"  # Name in the menus, only modules with it are listed
+# APP_CLASS = "TemplateApp"  # App if not given
+# APP_PORTS = (<PORT>,)  # Ports of the protocols this app receives
+# APP_BACKGROUND = True  # Load at boot instead, for apps that always have to run
+
 
 class TemplateApp(BaseApp):
     """Define a new app to run on the badge."""
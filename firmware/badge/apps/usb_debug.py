@@ -6,6 +6,10 @@ import sys
 
 from apps.base_app import BaseApp
 
+APP_NAME = "USB Debug"
+APP_CLASS = "UsbDebug"
+APP_BACKGROUND = True  # Always listening to the host
+
 
 class UsbDebug(BaseApp):
     def __init__(self, name: str, badge):
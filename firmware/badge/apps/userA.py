@@ -17,6 +17,10 @@ https://docs.micropython.org/en/latest/library/struct.html
 """
 # NEW_PROTOCOL = Protocol(port=<PORT>, name="<NAME>", structdef="!")
 
+APP_NAME = "User A"
+APP_CLASS = "App"
+# APP_PORTS = (<PORT>,)  # See template_app.py
+
 
 class App(BaseApp):
     """Define a new app to run on the badge."""
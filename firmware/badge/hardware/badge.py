@@ -37,29 +37,94 @@ class Badge:
             self.config.set("nametag_image", b'images/headshots/wrencher.png')
         if "radio_tx_power" not in self.config.db.keys():
             self.config.set("radio_tx_power", b'9')
+        if "radio_tx_power_auto" not in self.config.db.keys():
+            self.config.set("radio_tx_power_auto", b'false')
+        if "radio_tx_power_min" not in self.config.db.keys():
+            self.config.set("radio_tx_power_min", b'-9')
+        # No radio_tx_power_max default, so auto power stays at or below radio_tx_power unless it's set
+        if "mac_tdma" not in self.config.db.keys():
+            self.config.set("mac_tdma", b'false')
+        if "net_coding" not in self.config.db.keys():
+            self.config.set("net_coding", b'false')
+        if "net_adaptive_ttl" not in self.config.db.keys():
+            self.config.set("net_adaptive_ttl", b'true')
+        if "net_relay_rate" not in self.config.db.keys():
+            self.config.set("net_relay_rate", b'2')
+        if "net_relay_burst" not in self.config.db.keys():
+            self.config.set("net_relay_burst", b'10')
+        if "net_relay_rules" not in self.config.db.keys():
+            self.config.set("net_relay_rules", b'')
+        if "net_send_quota" not in self.config.db.keys():
+            self.config.set("net_send_quota", b'4')
+        if "net_header_v2" not in self.config.db.keys():
+            self.config.set("net_header_v2", b'false')
+        if "chat_lean" not in self.config.db.keys():
+            self.config.set("chat_lean", b'false')
+        if "crdt_max_keys" not in self.config.db.keys():
+            self.config.set("crdt_max_keys", b'32')
+        if "crdt_bytes_per_min" not in self.config.db.keys():
+            self.config.set("crdt_bytes_per_min", b'2000')
+        if "net_dtn" not in self.config.db.keys():
+            self.config.set("net_dtn", b'false')
+        if "net_dtn_frames" not in self.config.db.keys():
+            self.config.set("net_dtn_frames", b'16')
+        if "fountain_accept" not in self.config.db.keys():
+            self.config.set("fountain_accept", b'false')
+        if "fountain_reseed_ms" not in self.config.db.keys():
+            self.config.set("fountain_reseed_ms", b'5000')
+        if "crypto_scheme" not in self.config.db.keys():
+            self.config.set("crypto_scheme", b'rsa')
+        if "group_rotate_s" not in self.config.db.keys():
+            self.config.set("group_rotate_s", b'0')
+        if "chat_group_mac" not in self.config.db.keys():
+            self.config.set("chat_group_mac", b'false')
         if "chat_ttl" not in self.config.db.keys():
             self.config.set("chat_ttl", b'3')
         if "send_cooldown_ms" not in self.config.db.keys():
             self.config.set("send_cooldown_ms", b'1')
+        if "bulk_accept" not in self.config.db.keys():
+            self.config.set("bulk_accept", b'false')
+        if "control_windows" not in self.config.db.keys():
+            self.config.set("control_windows", b'false')
+        if "phy_adaptive" not in self.config.db.keys():
+            self.config.set("phy_adaptive", b'false')
+        if "boot_profile" not in self.config.db.keys():
+            self.config.set("boot_profile", b'false')
 
+        try:
+            self.send_cooldown_ms = int(self.config.get("send_cooldown_ms"))
+        except ValueError:
+            self.send_cooldown_ms = 1
+
+        # Hardware comes up in boot stages from main.py, see hardware/boot.py
+        self.sao_i2c: I2C
+        self.lora: LoraRadio
+        self.display: Display
+        self.keyboard: Keyboard
+
+        # Keys are loaded on first use, see net/crypto.py
+        self.crypto = Crypto(scheme=self.config.get("crypto_scheme").decode(), config=self.config)
+
+    def init_display(self):
+        """First, so there's something on screen while the rest comes up."""
         print("Initializing badge hardware...")
+        self.display = Display()
+        self.display.backlight.duty(500)
+        self.display.splash("SUPERCON 2025\nStarting up...")
+
+    def init_sao(self):
         # Reserve controller 0 for the SAO header so it never collides with the keyboard bus.
         self.sao_i2c = I2C(0, scl=board.SAO_SCL, sda=board.SAO_SDA, freq=400000)
+
+    def init_radio(self):
         try:
             tx_power = int(self.config.get("radio_tx_power"))
         except ValueError:
             tx_power = 9
-        try:
-            self.send_cooldown_ms = int(self.config.get("send_cooldown_ms"))
-        except ValueError:
-            self.send_cooldown_ms = 1
-        self.lora: LoraRadio = LoraRadio(board.DEBUG_LED, tx_power=tx_power)
-        self.display: Display = Display()
-        self.display.backlight.duty(500)
-        self.keyboard: Keyboard = Keyboard()
-
-        self.crypto = Crypto()
+        self.lora = LoraRadio(board.DEBUG_LED, tx_power=tx_power)
 
+    def init_keyboard(self):
+        self.keyboard = Keyboard()
         # Create task to run to check hardware, and update singleton reference
         self.task = aio.create_task(self.run())
 
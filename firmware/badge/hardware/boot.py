@@ -0,0 +1,110 @@
+"""Boot stages with dependencies between them, run in dependency order as asyncio tasks.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+scripts/boot_sim.py runs it with fake stages.
+
+main.py declares what has to be up before what:
+    boot = BootSequence(time.ticks_ms)
+    boot.add("display", badge.init_display)
+    boot.add("radio", badge.init_radio)
+    boot.add("network", start_network, after=("radio",))
+    await boot.run()
+Each stage starts once the stages it's after are done, in the order added. A stage is a function,
+or a coroutine function. A function stage runs to the end before any other stage starts, so with
+the badge drivers as they are, which block in their init calls, boot is sequential: the order is
+what the dependencies give, but nothing overlaps. Only a stage that awaits, like a coroutine waiting
+on radio calibration with a non-blocking driver, lets other stages and the display run meanwhile.
+How long each took is printed once all are done.
+
+A stage that raises is reported and boot goes on without it. Stages after it are skipped.
+If span is given, each stage runs inside span(f"stage {name}"), like profiler.span() of
+hardware/profiler.py.
+"""
+
+import asyncio as aio  # type: ignore
+import sys
+
+from net.ticks import ticks_diff
+
+
+class BootStage:
+    def __init__(self, name: str, function, after: tuple):
+        self.name = name
+        self.function = function
+        self.after = after
+        self.done = aio.Event()
+        self.ok = False
+        self.start_ms = 0
+        self.duration_ms = 0
+        self.note = ""
+
+
+class BootSequence:
+    def __init__(self, clock_ms, span=None):
+        self.clock_ms = clock_ms  # time.ticks_ms on the badge
+        self.span = span
+        self.stages: dict[str, BootStage] = {}
+        self.start_ms = 0
+
+    def add(self, name: str, function, after: tuple = ()):
+        for dependency in after:
+            if dependency not in self.stages:
+                raise ValueError(f"Boot stage {name} is after unknown stage {dependency}")
+        self.stages[name] = BootStage(name, function, after)
+
+    async def _run_stage(self, stage: BootStage):
+        for dependency in stage.after:
+            await self.stages[dependency].done.wait()
+        failed = [dependency for dependency in stage.after if not self.stages[dependency].ok]
+        if failed:
+            stage.note = f"skipped, {', '.join(failed)} failed"
+            stage.done.set()
+            return
+        stage.start_ms = self.clock_ms()
+        try:
+            if self.span is None:
+                await self._call(stage)
+            else:
+                with self.span(f"stage {stage.name}"):
+                    await self._call(stage)
+            stage.ok = True
+        except Exception as ex:
+            stage.note = f"failed: {ex}"
+            print(f"Boot stage {stage.name} failed")
+            if hasattr(sys, "print_exception"):
+                sys.print_exception(ex)
+        stage.duration_ms = ticks_diff(self.clock_ms(), stage.start_ms)
+        stage.done.set()
+        # Let the display and other tasks run between stages
+        await aio.sleep(0)
+
+    async def _call(self, stage: BootStage):
+        result = stage.function()
+        if hasattr(result, "send"):  # Coroutine, or generator on MicroPython
+            await result
+
+    async def run(self):
+        self.start_ms = self.clock_ms()
+        tasks = [aio.create_task(self._run_stage(stage)) for stage in self.stages.values()]
+        for task in tasks:
+            await task
+        self.print_timings()
+
+    def timings(self) -> list[tuple[str, int, int, str]]:
+        """(name, start ms since boot began, duration ms, note) of each stage, in start order."""
+        rows = [
+            (stage.name, ticks_diff(stage.start_ms, self.start_ms) if stage.start_ms else -1, stage.duration_ms, stage.note)
+            for stage in self.stages.values()
+        ]
+        rows.sort(key=lambda row: row[1])
+        return rows
+
+    def print_timings(self):
+        total = ticks_diff(self.clock_ms(), self.start_ms)
+        print(f"Boot stages, {total} ms in all:")
+        for name, start_ms, duration_ms, note in self.timings():
+            if start_ms < 0:
+                print(f"  {name:10s}          {note}")
+            else:
+                print(f"  {name:10s} {start_ms:5d} +{duration_ms:5d} ms {note}")
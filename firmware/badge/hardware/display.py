@@ -22,6 +22,15 @@ class Display:
         self.screen.set_style_bg_color(styles.hackaday_grey, 0)
         print("Display initialized")
 
+    def splash(self, text: str):
+        """Show text right away, before the event loop gets to refresh the screen. Cleared by the first page."""
+        label = lvgl.label(self.screen)
+        label.set_text(text)
+        label.set_style_text_color(styles.hackaday_yellow, 0)
+        label.set_style_text_font(lvgl.font_montserrat_16, 0)
+        label.align(lvgl.ALIGN.CENTER, 0, 0)
+        lvgl.task_handler()
+
     @property
     def screen(self):
         return lvgl.screen_active()
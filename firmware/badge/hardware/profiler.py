@@ -0,0 +1,135 @@
+"""Opt-in profiler for where boot time goes: imports, boot stages, app setup and the first screen.
+
+main.py turns it on before its imports when /data/boot_profile exists. That marker file is made at
+the end of boot when the boot_profile config is true, and removed when it isn't, so:
+ - boot_profile true profiles every boot,
+ - creating the marker by hand (mpremote touch :/data/boot_profile) profiles the next boot only.
+
+Every import that loads new modules is timed, nested imports inside, by replacing __import__.
+Module level work, like the CRC tables of libs.crc or the styles of ui.styles, counts towards
+its import. Other parts are timed with:
+    with profiler.span("first screen"):
+        ...
+which costs nothing when the profiler is off.
+
+At the end of boot the spans are printed, longest first, and appended to /data/boot_profile.txt:
+    boot <total us>
+    <depth> <start us> <duration us> <name>
+scripts/boot_profile.py turns that file into tables and a flame summary across boots.
+"""
+
+import builtins
+import os
+import sys
+import time
+
+MARKER_PATH = "/data/boot_profile"
+REPORT_PATH = "/data/boot_profile.txt"
+MAX_REPORT_BYTES = 16384  # Older boots are dropped beyond this
+CONSOLE_SPANS = 15
+
+
+class _Span:
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.depth = 0
+        self.start_us = 0
+
+    def __enter__(self):
+        self.depth = self.profiler.depth
+        self.profiler.depth += 1
+        self.start_us = time.ticks_us()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.depth -= 1
+        self.profiler.add(self.name, self.start_us, time.ticks_diff(time.ticks_us(), self.start_us), self.depth)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class BootProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.start_us = 0
+        self.depth = 0
+        self.spans: list[tuple[int, int, int, str]] = []  # (depth, start us since enabled, duration us, name)
+        self._import = None
+
+    def enable_if_marked(self):
+        try:
+            os.stat(MARKER_PATH)
+        except OSError:
+            return
+        self.enabled = True
+        self.start_us = time.ticks_us()
+        self._import = builtins.__import__
+        builtins.__import__ = self._profiled_import
+
+    def _profiled_import(self, name, *args):
+        loaded = len(sys.modules)
+        depth = self.depth
+        self.depth += 1
+        start = time.ticks_us()
+        try:
+            return self._import(name, *args)
+        finally:
+            duration = time.ticks_diff(time.ticks_us(), start)
+            self.depth -= 1
+            if len(sys.modules) > loaded:  # Only imports that loaded something
+                fromlist = args[2] if len(args) > 2 else None
+                self.add("import " + name + (":" + ",".join(fromlist) if fromlist else ""), start, duration, depth)
+
+    def span(self, name: str):
+        """Context manager timing what's inside."""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def add(self, name: str, start_us: int, duration_us: int, depth: int):
+        if self.enabled:
+            self.spans.append((depth, time.ticks_diff(start_us, self.start_us), duration_us, name))
+
+    def finish(self, config):
+        """Stop profiling, report, and set up the marker for the next boot from the boot_profile config."""
+        try:
+            if config.get("boot_profile", b"false") == b"true":
+                open(MARKER_PATH, "wb").close()
+            else:
+                os.remove(MARKER_PATH)
+        except OSError:
+            pass
+        if not self.enabled:
+            return
+        self.enabled = False
+        builtins.__import__ = self._import
+        total_us = time.ticks_diff(time.ticks_us(), self.start_us)
+        self.spans.sort(key=lambda span: span[1])
+        try:
+            mode = "ab" if os.stat(REPORT_PATH)[6] < MAX_REPORT_BYTES else "wb"
+        except OSError:
+            mode = "wb"
+        with open(REPORT_PATH, mode) as report:
+            report.write(f"boot {total_us}\n".encode())
+            for depth, start_us, duration_us, name in self.spans:
+                report.write(f"{depth} {start_us} {duration_us} {name}\n".encode())
+        print(f"Boot profile, {total_us // 1000} ms to here, longest first:")
+        for _, start_us, duration_us, name in sorted(self.spans, key=lambda span: -span[2])[:CONSOLE_SPANS]:
+            print(f"  {duration_us // 1000:6d} ms  at {start_us // 1000:6d} ms  {name}")
+        print(f"Full report in {REPORT_PATH}")
+        self.spans = []
+
+
+# Boot profiler singleton
+profiler = BootProfiler()
@@ -2,14 +2,29 @@ import micropython
 import time
 import asyncio as aio  # type: ignore
 
+from hardware.profiler import profiler
+
+# Time the imports below too, if profiling this boot
+profiler.enable_if_marked()
+
 try:
     from hardware.badge import Badge
+    from hardware.boot import BootSequence
     from net.net import badgenet, capture_all_packets
+    from net.bulk import bulk
+    from net.control import control
+    from net.crdt_sync import shared_state
+    from net.directory import directory
+    from net.fountain_manager import fountain
+    from net.group_manager import group
+    from net.phy_manager import phy_manager
+    from net.session_manager import sessions
+    from net.tdma_manager import tdma_manager
+    from net.verifier import verifier
 
-    ## Import your app here
-    from apps import app_menu, chat, config_manager, usb_debug, nametag, talks
-    from apps import userA, userB, userC, userD  ## An invitation
-
+    from apps import app_menu
+    from apps.registry import AppRegistry
+    # Apps are found in /apps by the registry, and imported when first needed
 
 except Exception as ex:
     # If anything goes wrong at import time, wait a second and print it
@@ -22,43 +37,59 @@ except Exception as ex:
     raise
 
 
+def start_network(badge):
+    badgenet.init(badge)
+    verifier.init(badge)
+    group.init(badge)
+    bulk.init(badge)
+    control.init(badge)
+    directory.init(badge)
+    shared_state.init(badge)
+    phy_manager.init(badge)
+    tdma_manager.init(badge)
+    sessions.init(badge)
+    fountain.init(badge)
+
+
+def create_apps(badge) -> tuple[list, AppRegistry]:
+    """Menus, and the registry of every app, listed in the menus or not."""
+    registry = AppRegistry(badge)
+    # These apps are on the main screen when the badge boots, by module name
+    primary_apps = [registry.app(module) for module in ("chat", "talks", "nametag")]
+    # Every other app in /apps, like userA to userD, goes in the User menu
+    user_menu = app_menu.AppMenu("User", badge, registry.others(primary_apps), False)
+    primary_apps += [user_menu, registry.app("config_manager")]
+    main_menu = app_menu.AppMenu("Main", badge, primary_apps, True)
+    return [main_menu, user_menu], registry
+
+
+def start_apps(menus: list, registry: AppRegistry):
+    # Background apps like USB Debug load now, the rest when opened or sent a frame
+    registry.start()
+    for menu in menus:
+        menu.start()
+    main_menu = menus[0]
+    with profiler.span("first screen"):
+        main_menu.switch_to_foreground()
+    # Time to a usable screen, since reset. Crypto keys load later, on first use
+    print(f"Main screen up {time.ticks_ms()} ms after reset")
+
+
 async def main():
     print("Initializing main...")
     badge = Badge()
-    badgenet.init(badge)
-    # Link them into the menu system here, for starters
-    user_apps = [
-        userA.App("User A", badge),
-        userB.App("User B", badge),
-        userC.App("User C", badge),
-        userD.App("User D", badge),
-        # Only 4, the 5th button goes to Home
-    ]
-    user_menu = app_menu.AppMenu("User", badge, user_apps, False)
-    # These apps are on the main screen when the badge boots
-    primary_apps = [
-        chat.ChatApp("Chat", badge),
-        talks.Talks("Talks", badge),
-        nametag.App("Nametag", badge),
-        user_menu,
-        config_manager.ConfigManager("Config", badge),
-    ]
-    # These apps aren't listed in the menus, so put them here to get started below
-    backgrounded_apps = [
-        usb_debug.UsbDebug("USB Debug", badge),
-    ]
-    main_menu = app_menu.AppMenu("Main", badge, primary_apps, True)
-    for app in primary_apps:
-        if app:
-            app.start()
-    for app in user_apps:
-        if app:
-            app.start()
-    for app in backgrounded_apps:
-        app.start()
-    main_menu.start()
-    user_menu.start()
-    main_menu.switch_to_foreground()
+    created = []
+    boot = BootSequence(time.ticks_ms, profiler.span)
+    # Display first, for the splash screen
+    boot.add("display", badge.init_display)
+    boot.add("keyboard", badge.init_keyboard)
+    boot.add("sao", badge.init_sao)
+    boot.add("radio", badge.init_radio)
+    boot.add("network", lambda: start_network(badge), after=("radio",))
+    boot.add("apps", lambda: created.extend(create_apps(badge)), after=("display", "keyboard"))
+    boot.add("start", lambda: start_apps(*created), after=("apps", "network"))
+    await boot.run()
+    profiler.finish(badge.config)
 
     # To capture all network packets for debugging, set to True
     capture_all_packets(False)
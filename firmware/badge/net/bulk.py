@@ -0,0 +1,312 @@
+"""High speed bulk transfers between two nearby badges.
+
+A transfer is negotiated over the LoRa mesh with a BULK_OFFER/BULK_REPLY exchange. Both badges then
+take exclusive ownership of their radios, switch to GFSK on a side frequency slot, and stream the file
+in chunks. Each chunk carries its own CRC and is acknowledged before the next one is sent. When the
+transfer finishes or times out, both badges return to the LoRa mesh. The receiver stays on GFSK a
+little after the FIN, and acknowledges it again if the sender repeats it because the ACK got lost.
+
+GFSK at 250kbps is roughly an order of magnitude faster than LoRa SF7 at 500kHz, but has much less
+range, so this is only meant for badges sitting next to each other.
+
+Chunk frame structure (GFSK, not a BadgeNet frame):
+ 0: 1 byte: Type (DATA, ACK, FIN)
+ 1: 4 bytes: Session ID
+ 5: 2 bytes: Chunk index
+ 7: 2 bytes: CRC16 of the chunk data
+ 9: n bytes: Chunk data (DATA only)
+"""
+
+import asyncio as aio  # type: ignore
+import os
+import random
+import struct
+import time
+
+from net.lora import freq_slot_to_mhz
+from net.net import MY_ADDRESS, register_receiver, send
+from net.protocols import NetworkFrame, Protocol, crc_calculator
+
+BULK_OFFER = Protocol(
+    port=20, name="BULK_OFFER", structdef="!IIB20s"
+)  # session ID, file size, GFSK freq slot, file name
+BULK_REPLY = Protocol(port=21, name="BULK_REPLY", structdef="!IB")  # session ID, accepted
+
+CHUNK_DATA = 1
+CHUNK_ACK = 2
+CHUNK_FIN = 3
+CHUNK_HEADER = "!BIHH"
+CHUNK_HEADER_LEN = struct.calcsize(CHUNK_HEADER)
+CHUNK_DATA_LEN = 240
+
+BULK_SYNC_WORD = [0x07, 0xE9, 0xB1]
+BULK_BITRATE_KBPS = 250.0
+BULK_FREQ_DEV_KHZ = 62.5
+BULK_RX_BW_KHZ = 467.0
+BULK_DEFAULT_FREQ_SLOT = 40
+BULK_MAX_FILE_SIZE = 512 * 1024
+
+REPLY_TIMEOUT_MS = 5000
+ACK_TIMEOUT_MS = 60
+MAX_RETRIES = 12
+RECEIVE_IDLE_TIMEOUT_MS = 1500
+FIN_LINGER_MS = ACK_TIMEOUT_MS * 3  # Quiet time after the FIN before the receiver leaves GFSK
+FSK_SETTLE_MS = 20
+
+
+class BulkTransfer:
+    """Negotiates and runs GFSK bulk transfers. Only one transfer runs at a time."""
+
+    def __init__(self):
+        self.busy = False
+        self.freq_slot = BULK_DEFAULT_FREQ_SLOT
+        self.max_file_size = BULK_MAX_FILE_SIZE
+        self.pending_offer: NetworkFrame | None = None
+        self.offer_handler = self._default_offer_handler
+        self.complete_callbacks: list = []
+        self._replies: dict[int, tuple[bool, int]] = {}  # session ID: (accepted, ticks_ms received)
+        self._offer_ready = aio.Event()
+        self._reply_ready = aio.Event()
+        self.receive_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        try:
+            self.freq_slot = int(badge.config.get("bulk_freq_slot", b"%d" % BULK_DEFAULT_FREQ_SLOT))
+        except ValueError:
+            self.freq_slot = BULK_DEFAULT_FREQ_SLOT
+        register_receiver(BULK_OFFER, self._receive_offer)
+        register_receiver(BULK_REPLY, self._receive_reply)
+        self.receive_task = aio.create_task(self.run())
+
+    def _default_offer_handler(self, source: int, name: str, size: int) -> str | None:
+        """Accept files into /data/bulk/ if enabled in the config."""
+        if self.badge.config.get("bulk_accept", b"false") != b"true":
+            return None
+        if "bulk" not in os.listdir("/data"):
+            os.mkdir("/data/bulk")
+        return "/data/bulk/" + name
+
+    def _receive_offer(self, message: NetworkFrame):
+        if message.destination != MY_ADDRESS or self.busy or self.pending_offer is not None:
+            return
+        self.pending_offer = message
+        self._offer_ready.set()
+
+    def _receive_reply(self, message: NetworkFrame):
+        session_id, accepted = message.payload
+        now = time.ticks_ms()
+        # Replies nobody waited for, or to offers that timed out, are of no use anymore
+        self._replies = {
+            reply_session: accepted_time
+            for reply_session, accepted_time in self._replies.items()
+            if time.ticks_diff(now, accepted_time[1]) < REPLY_TIMEOUT_MS
+        }
+        self._replies[session_id] = (bool(accepted), now)
+        self._reply_ready.set()
+
+    async def run(self):
+        while True:
+            await self._offer_ready.wait()
+            self._offer_ready.clear()
+            offer = self.pending_offer
+            if offer is None:
+                continue
+            try:
+                await self._receive_file(offer)
+            except Exception as exc:
+                print(f"Bulk receive failed: {exc}")
+            self.pending_offer = None
+
+    def _chunk(self, kind: int, session_id: int, index: int, data: bytes = b"") -> bytes:
+        crc = crc_calculator.checksum(data) if data else 0
+        return struct.pack(CHUNK_HEADER, kind, session_id, index, crc) + data
+
+    async def _enter_fsk(self, freq_slot: int):
+        await self.badge.lora.acquire()
+        self.badge.lora.begin_fsk(
+            freq=freq_slot_to_mhz(freq_slot),
+            bitrate=BULK_BITRATE_KBPS,
+            freq_dev=BULK_FREQ_DEV_KHZ,
+            rx_bw=BULK_RX_BW_KHZ,
+            sync_word=BULK_SYNC_WORD,
+        )
+        await aio.sleep_ms(FSK_SETTLE_MS)
+
+    async def send_file(self, destination: int, path: str, name: str | None = None) -> bool:
+        """Offer a file to a nearby badge and stream it over GFSK if accepted.
+        Returns True if every chunk was acknowledged."""
+        if self.busy:
+            raise ValueError("A bulk transfer is already running.")
+        size = os.stat(path)[6]
+        if size > self.max_file_size:
+            raise ValueError(f"File too large for bulk transfer: {size} bytes")
+        name = name or path.split("/")[-1]
+        session_id = random.getrandbits(32)
+        self.busy = True
+        try:
+            # TTL 0, since the other badge needs to be in direct range anyways
+            send(
+                NetworkFrame().set_fields(
+                    protocol=BULK_OFFER,
+                    destination=destination,
+                    ttl=0,
+                    payload=(session_id, size, self.freq_slot, name.encode()[:20]),
+                )
+            )
+            start = time.ticks_ms()
+            while session_id not in self._replies:
+                remaining = REPLY_TIMEOUT_MS - time.ticks_diff(time.ticks_ms(), start)
+                if remaining <= 0:
+                    print("Bulk offer timed out")
+                    return False
+                self._reply_ready.clear()
+                try:
+                    await aio.wait_for_ms(self._reply_ready.wait(), remaining)
+                except aio.TimeoutError:
+                    pass
+            if not self._replies.pop(session_id)[0]:
+                print("Bulk offer rejected")
+                return False
+            await self._enter_fsk(self.freq_slot)
+            try:
+                return await self._stream_file(session_id, path, size)
+            finally:
+                self.badge.lora.release()
+        finally:
+            self.busy = False
+
+    async def _send_chunk(self, frame: bytes, session_id: int, index: int) -> bool:
+        lora = self.badge.lora
+        for _ in range(MAX_RETRIES):
+            await lora.send_exclusive(frame)
+            deadline = time.ticks_add(time.ticks_ms(), ACK_TIMEOUT_MS)
+            while True:
+                remaining = time.ticks_diff(deadline, time.ticks_ms())
+                if remaining <= 0:
+                    break
+                reply = await lora.recv_exclusive(remaining)
+                if reply is None or len(reply) < CHUNK_HEADER_LEN:
+                    continue
+                kind, reply_session, reply_index, _ = struct.unpack_from(CHUNK_HEADER, reply)
+                if kind == CHUNK_ACK and reply_session == session_id and reply_index == index:
+                    return True
+        return False
+
+    async def _stream_file(self, session_id: int, path: str, size: int) -> bool:
+        start = time.ticks_ms()
+        index = 0
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(CHUNK_DATA_LEN)
+                if not data:
+                    break
+                if not await self._send_chunk(self._chunk(CHUNK_DATA, session_id, index, data), session_id, index):
+                    print(f"Bulk transfer aborted at chunk {index}")
+                    return False
+                index += 1
+        if not await self._send_chunk(self._chunk(CHUNK_FIN, session_id, index), session_id, index):
+            return False
+        elapsed_ms = max(1, time.ticks_diff(time.ticks_ms(), start))
+        print(f"Bulk sent {size} bytes in {elapsed_ms}ms ({size * 8 // elapsed_ms} kbps)")
+        return True
+
+    async def _receive_file(self, offer: NetworkFrame):
+        session_id, size, freq_slot, name = offer.payload
+        name = name.strip(b"\0").decode()
+        path = None
+        if 0 < size <= self.max_file_size and name and "/" not in name:
+            path = self.offer_handler(offer.source, name, size)
+        reply = NetworkFrame().set_fields(
+            protocol=BULK_REPLY,
+            destination=offer.source,
+            source=MY_ADDRESS,
+            ttl=0,
+            payload=(session_id, path is not None),
+        )
+        reply.serialize()
+        self.busy = True
+        lora = self.badge.lora
+        await lora.acquire()
+        try:
+            # Reply directly, so the switch to GFSK happens right after it is on air
+            await lora.send_exclusive(reply.frame)
+            if path is None:
+                return
+            lora.begin_fsk(
+                freq=freq_slot_to_mhz(freq_slot),
+                bitrate=BULK_BITRATE_KBPS,
+                freq_dev=BULK_FREQ_DEV_KHZ,
+                rx_bw=BULK_RX_BW_KHZ,
+                sync_word=BULK_SYNC_WORD,
+            )
+            complete = await self._receive_chunks(session_id, path + ".part", size)
+        finally:
+            lora.release()
+            self.busy = False
+        if complete:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            os.rename(path + ".part", path)
+            print(f"Bulk received {name} ({size} bytes) from {offer.source:x}")
+            for callback in self.complete_callbacks:
+                callback(offer.source, path)
+        else:
+            os.remove(path + ".part")
+
+    async def _receive_chunks(self, session_id: int, path: str, size: int) -> bool:
+        lora = self.badge.lora
+        expected = 0
+        received = 0
+        with open(path, "wb") as file:
+            while True:
+                frame = await lora.recv_exclusive(RECEIVE_IDLE_TIMEOUT_MS)
+                if frame is None:
+                    print(f"Bulk receive timed out at chunk {expected}")
+                    return False
+                if len(frame) < CHUNK_HEADER_LEN:
+                    continue
+                kind, frame_session, index, crc = struct.unpack_from(CHUNK_HEADER, frame)
+                if frame_session != session_id:
+                    continue
+                if kind == CHUNK_DATA:
+                    data = frame[CHUNK_HEADER_LEN:]
+                    if crc_calculator.checksum(data) != crc:
+                        continue  # Corrupt, let the sender retry
+                    if index == expected:
+                        file.write(data)
+                        received += len(data)
+                        expected += 1
+                    elif index > expected:
+                        continue
+                    # Acknowledge new chunks, and re-acknowledge duplicates whose ACK was lost
+                    await lora.send_exclusive(self._chunk(CHUNK_ACK, session_id, index))
+                elif kind == CHUNK_FIN and index == expected:
+                    await lora.send_exclusive(self._chunk(CHUNK_ACK, session_id, index))
+                    await self._linger(session_id, index)
+                    return received == size
+
+    async def _linger(self, session_id: int, fin_index: int):
+        """Re-acknowledge repeated FINs, so the transfer still completes on the sender if the ACK
+        of the FIN got lost."""
+        lora = self.badge.lora
+        for _ in range(MAX_RETRIES):
+            frame = await lora.recv_exclusive(FIN_LINGER_MS)
+            if frame is None:
+                return
+            if len(frame) < CHUNK_HEADER_LEN:
+                continue
+            kind, frame_session, index, _ = struct.unpack_from(CHUNK_HEADER, frame)
+            if kind == CHUNK_FIN and frame_session == session_id and index == fin_index:
+                await lora.send_exclusive(self._chunk(CHUNK_ACK, session_id, index))
+
+
+# Bulk transfer singleton
+bulk = BulkTransfer()
+
+
+def send_file(destination: int, path: str, name: str | None = None):
+    """Offer a file to a nearby badge. Must be awaited."""
+    return bulk.send_file(destination, path, name)
@@ -0,0 +1,75 @@
+"""History catch-up by set reconciliation.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+A badge missing history, e.g. after a reboot or on joining a channel, sends a Bloom filter of the
+IDs, (source, message ID), of the messages it already has. The message ID is a 16 bit hash the app
+makes from the message, not the frame's 8 bit sequence number, which wraps within minutes. Badges that hear it wait a random backoff, and
+the first one to reply sends the messages from its history the filter doesn't have, packed several
+to a frame, each with its age so the receiver can put it in order. The others hear the reply and stay
+quiet, so history isn't flooded by everyone at once.
+
+A false positive in the filter just means a message isn't sent, so the filter can stay small.
+"""
+
+import struct
+
+BLOOM_BYTES = 64  # 512 bits, about 1% false positives for 50 messages
+BLOOM_HASHES = 4
+ENTRY_HEADER = "!IHHB"  # source, message ID, age s, text length
+MAX_AGE_S = 0xFFFF
+ENTRY_HEADER_LEN = struct.calcsize(ENTRY_HEADER)
+
+
+class BloomFilter:
+    """Bloom filter of message IDs."""
+
+    def __init__(self, bits: bytes | None = None, size: int = BLOOM_BYTES, hashes: int = BLOOM_HASHES):
+        self.bits = bytearray(bits) if bits is not None else bytearray(size)
+        self.num_bits = len(self.bits) * 8
+        self.hashes = hashes
+
+    def _positions(self, source: int, message_id: int):
+        # Double hashing, from two cheap 32 bit mixes of the ID
+        first = ((source * 0x9E3779B1) ^ (message_id * 0x85EBCA6B)) & 0xFFFFFFFF
+        second = ((first >> 15) ^ (first * 0xC2B2AE35)) & 0xFFFFFFFF | 1
+        for i in range(self.hashes):
+            yield ((first + i * second) & 0xFFFFFFFF) % self.num_bits
+
+    def add(self, source: int, message_id: int):
+        for position in self._positions(source, message_id):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def contains(self, source: int, message_id: int) -> bool:
+        for position in self._positions(source, message_id):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def pack_entries(entries: list[tuple[int, int, int, bytes]], max_len: int) -> tuple[bytes, int]:
+    """Packs as many (source, message ID, age s, text) entries as fit in max_len bytes.
+    Returns the packed bytes and how many entries they hold."""
+    packed = bytearray()
+    count = 0
+    for source, message_id, age_s, text in entries:
+        if len(packed) + ENTRY_HEADER_LEN + len(text) > max_len:
+            break
+        packed.extend(struct.pack(ENTRY_HEADER, source, message_id, min(max(0, age_s), MAX_AGE_S), len(text)))
+        packed.extend(text)
+        count += 1
+    return bytes(packed), count
+
+
+def unpack_entries(packed: bytes) -> list[tuple[int, int, int, bytes]]:
+    entries = []
+    i = 0
+    while i + ENTRY_HEADER_LEN <= len(packed):
+        source, message_id, age_s, length = struct.unpack_from(ENTRY_HEADER, packed, i)
+        i += ENTRY_HEADER_LEN
+        if length == 0 or i + length > len(packed):
+            break  # Padding, or cut short
+        entries.append((source, message_id, age_s, bytes(packed[i : i + length])))
+        i += length
+    return entries
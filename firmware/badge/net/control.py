@@ -0,0 +1,88 @@
+"""Implicit header control windows for fixed size, high rate control protocols.
+
+Every BadgeNet frame uses an explicit LoRa header, which costs about 20 symbols of airtime, plus a
+16 byte BadgeNet header. Control protocols like PING/PONG and beacons are tiny and fixed size, so
+inside a control window they are sent as 12 byte frames in LoRa implicit header mode, on a separate
+sync word so they never get confused with mesh traffic. The window itself runs in
+net/control_window.py.
+
+A badge opens a window by broadcasting CONTROL_WINDOW (TTL 0) as a normal explicit frame, and then
+switches to implicit mode. Nearby badges that allow it switch too, until the window ends or nothing
+is heard for a while, then everyone falls back to explicit header BadgeNet traffic.
+
+A window keeps the badges in it deaf to the mesh, so it's opt-in: badges only open or join windows
+when the control_windows config is true.
+"""
+
+import asyncio as aio  # type: ignore
+from collections import deque
+import time
+
+from net.control_window import IDLE_TIMEOUT_MS, MAX_WINDOW_MS, ControlWindow
+from net.net import MY_ADDRESS, register_receiver
+from net.protocols import NetworkFrame, Protocol
+
+CONTROL_WINDOW = Protocol(port=22, name="CONTROL_WINDOW", structdef="!H")  # window duration ms
+
+MIN_JOIN_INTERVAL_MS = 10000  # Don't let other badges keep this one deaf to the mesh
+
+
+class ControlChannel(ControlWindow):
+    """Opens and joins control windows over BadgeNet."""
+
+    def __init__(self):
+        super().__init__(MY_ADDRESS, time.ticks_ms, self._open_window)
+        self.enabled = False
+        self.last_join_ms = 0
+        self._join_requests: deque = deque([], 1)
+        self._join_ready = aio.Event()
+        self.join_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        self.enabled = badge.config.get("control_windows", b"false") == b"true"
+        register_receiver(CONTROL_WINDOW, self._receive_window)
+        self.join_task = aio.create_task(self.run())
+
+    def _receive_window(self, message: NetworkFrame):
+        if not self.enabled or self.in_window:
+            return
+        if time.ticks_diff(time.ticks_ms(), self.last_join_ms) < MIN_JOIN_INTERVAL_MS:
+            return
+        self._join_requests.append(min(message.payload[0], MAX_WINDOW_MS))
+        self._join_ready.set()
+
+    async def run(self):
+        while True:
+            await self._join_ready.wait()
+            self._join_ready.clear()
+            while self._join_requests:
+                duration_ms = self._join_requests.popleft()
+                self.last_join_ms = time.ticks_ms()
+                await self._window(duration_ms, None, IDLE_TIMEOUT_MS)
+
+    async def _open_window(self, duration_ms: int):
+        """Announce a control window to nearby badges and run it. Queue frames with send() before
+        calling or from a receiver callback during the window. Does nothing unless control_windows
+        is true."""
+        if not self.enabled:
+            return
+        duration_ms = min(duration_ms, MAX_WINDOW_MS)
+        announce = NetworkFrame().set_fields(
+            protocol=CONTROL_WINDOW,
+            destination=0xFFFFFFFF,
+            source=MY_ADDRESS,
+            ttl=0,
+            payload=(duration_ms,),
+        )
+        announce.serialize()
+        await self._window(duration_ms, announce.frame, 0)
+
+    async def _window(self, duration_ms: int, announce: bytes | None, idle_timeout_ms: int):
+        lora = self.badge.lora
+        await lora.acquire()
+        await self.run_window(lora, duration_ms, announce, idle_timeout_ms)
+
+
+# Control channel singleton
+control = ControlChannel()
@@ -0,0 +1,135 @@
+"""Implicit header control windows, the part that runs on the radio.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+scripts/control_sim.py runs it against emulated radios.
+
+Inside a window, control frames are 12 bytes, sent in LoRa implicit header mode on a separate sync
+word, see net/control.py. The radio passed in is a LoraRadio held with acquire(), or anything with
+the same send_exclusive(), recv_exclusive(), set_implicit_header(), get_rssi() and release().
+Times are milliseconds on the clock_ms() passed in, time.ticks_ms on the badge. Announcing a
+window is up to the caller, which passes in open_window(duration_ms), a coroutine function that
+announces a window and runs it with run_window(). net/control.py announces it over BadgeNet.
+
+Control frame structure (implicit header, fixed length):
+ 0: 1 byte: Control port
+ 1: 1 byte: Seq num
+ 2: 4 bytes: Source Address
+ 6: 6 bytes: Payload
+"""
+
+from collections import deque
+import random
+import struct
+
+from net.ticks import ticks_add, ticks_diff
+
+CONTROL_FRAME = "!BBI6s"
+CONTROL_FRAME_LEN = struct.calcsize(CONTROL_FRAME)
+CONTROL_SYNC_WORD = 0x24
+MAX_WINDOW_MS = 2000
+IDLE_TIMEOUT_MS = 400
+RX_POLL_MS = 5
+PONG_JITTER_MS = 30
+
+# Control ports, separate from BadgeNet ports
+CTRL_PING = 1  # target address, counter
+CTRL_PONG = 2  # pinger address, counter, RSSI
+CTRL_BEACON = 3  # App defined
+
+
+class ControlWindow:
+    """Runs control windows on a radio, and the PING/PONG responder inside them."""
+
+    def __init__(self, address: int, clock_ms, open_window):
+        self.address = address
+        self.clock_ms = clock_ms
+        self.open_window = open_window  # Announces a window and runs it, awaited by ping()
+        self.receive_callbacks: dict[int, list] = {CTRL_PING: [self._answer_ping]}
+        self.transmit_queue: deque = deque([], 20)  # (not before ms, frame)
+        self.in_window = False
+        self.seq_num = 0
+        self.pongs: dict[int, tuple[int, int]] = {}  # responder: (count, rssi)
+        self.lora = None  # Radio of the current window
+
+    def register_receiver(self, port: int, callback):
+        """Call callback(source, seq_num, payload) for control frames on this control port."""
+        self.receive_callbacks.setdefault(port, []).append(callback)
+
+    def send(self, port: int, payload: bytes, delay_ms: int = 0) -> bool:
+        """Queue a control frame for the current window. Returns False if no window is open."""
+        if not self.in_window:
+            return False
+        frame = struct.pack(CONTROL_FRAME, port, self.seq_num, self.address, payload)
+        self.seq_num = (self.seq_num + 1) & 0xFF
+        self.transmit_queue.append((ticks_add(self.clock_ms(), delay_ms), frame))
+        return True
+
+    async def run_window(self, lora, duration_ms: int, announce: bytes | None, idle_timeout_ms: int):
+        """Run a window on lora, already acquired, and release it at the end. announce is sent in
+        explicit header mode first, if given. With idle_timeout_ms, the window ends early once
+        nothing has been heard for that long."""
+        self.lora = lora
+        self.in_window = True
+        try:
+            if announce is not None:
+                await lora.send_exclusive(announce)
+            lora.set_implicit_header(CONTROL_FRAME_LEN, CONTROL_SYNC_WORD)
+            start = self.clock_ms()
+            last_heard = start
+            while ticks_diff(self.clock_ms(), start) < duration_ms:
+                now = self.clock_ms()
+                if idle_timeout_ms and ticks_diff(now, last_heard) > idle_timeout_ms:
+                    break  # Nobody is using the window, fall back to the mesh early
+                if self.transmit_queue and ticks_diff(now, self.transmit_queue[0][0]) >= 0:
+                    await lora.send_exclusive(self.transmit_queue.popleft()[1])
+                    continue
+                frame = await lora.recv_exclusive(RX_POLL_MS)
+                if frame is None or len(frame) != CONTROL_FRAME_LEN:
+                    continue
+                last_heard = self.clock_ms()
+                port, seq_num, source, payload = struct.unpack(CONTROL_FRAME, frame)
+                for callback in self.receive_callbacks.get(port, ()):
+                    try:
+                        callback(source, seq_num, payload)
+                    except Exception as exc:
+                        print(f"Exception in control callback for port {port}: {exc}")
+        finally:
+            self.in_window = False
+            self.transmit_queue.clear()
+            lora.release()
+
+    def _answer_ping(self, source: int, seq_num: int, payload: bytes):
+        target, counter = struct.unpack_from("!IB", payload)
+        if target not in (self.address, 0xFFFFFFFF):
+            return
+        rssi = max(-128, int(self.lora.get_rssi()))
+        # Jitter responses so multiple responders don't all collide
+        self.send(
+            CTRL_PONG,
+            struct.pack("!IBb", source, counter, rssi),
+            random.randrange(PONG_JITTER_MS),
+        )
+
+    def _record_pong(self, source: int, seq_num: int, payload: bytes):
+        pinger, counter, rssi = struct.unpack_from("!IBb", payload)
+        if pinger != self.address:
+            return
+        count, _ = self.pongs.get(source, (0, 0))
+        self.pongs[source] = (count + 1, rssi)
+
+    async def ping(self, count: int = 10, interval_ms: int = 50, target: int = 0xFFFFFFFF):
+        """Ping nearby badges rapidly inside a control window.
+        Returns {responder: (pongs received, RSSI of the ping at the responder)}."""
+        self.pongs = {}
+        self.register_receiver(CTRL_PONG, self._record_pong)
+        try:
+            self.in_window = True  # Allow queueing before the window opens
+            for counter in range(count):
+                self.send(CTRL_PING, struct.pack("!IB", target, counter), counter * interval_ms)
+            await self.open_window(count * interval_ms + PONG_JITTER_MS * 2)
+        finally:
+            self.in_window = False
+            self.transmit_queue.clear()  # Pings left over if the window didn't open
+            self.receive_callbacks[CTRL_PONG].remove(self._record_pong)
+        return self.pongs
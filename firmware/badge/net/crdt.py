@@ -0,0 +1,297 @@
+"""Conflict-free replicated data types for state shared across the mesh.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Every badge keeps its own copy of each value, changes it locally, and merges what it hears from
+others. Merging is commutative, associative and idempotent, so badges end up agreeing no matter in
+which order, or how many times, they hear each change. Three types are supported:
+ - LWW register: a bytes value, the last write wins. Writes are ordered by a logical clock, one
+   more than the newest write seen, and then by writer address, so no synchronized time is needed.
+ - G-counter: a count per badge that only grows. The value is the sum.
+ - Top-K: the K highest (score, address, name) entries ever submitted, like a leaderboard. For
+   scores where lower is better, like times, submit them negated.
+
+Only what changed since it was last sent, the delta, is sent. A CrdtStore tracks the changed parts
+of each key, and packs as many as fit into records:
+# Record: 1 byte type, 1 byte key length, key, then by type:
+#  LWW: 4 bytes clock, 4 bytes writer address, 1 byte value length, value
+#  G-counter: 1 byte count of entries, then 4 bytes address and 4 bytes count for each
+#  Top-K: 1 byte K, 1 byte count of entries, then 4 bytes score (signed), 4 bytes address,
+#         1 byte name length and name for each
+"""
+
+import struct
+
+LWW = 1
+GCOUNTER = 2
+TOPK = 3
+
+MAX_KEY_LEN = 16
+MAX_VALUE_LEN = 64
+MAX_COUNTERS = 64  # Badges counted per G-counter. Increments from more badges than that are not kept
+MAX_K = 10
+
+
+class LwwRegister:
+    kind = LWW
+
+    def __init__(self):
+        self.value = b""
+        self.clock = 0
+        self.writer = 0
+
+    def set(self, value: bytes, writer: int):
+        self.clock += 1
+        self.writer = writer
+        self.value = value
+
+    def merge(self, clock: int, writer: int, value: bytes) -> bool:
+        if (clock, writer) <= (self.clock, self.writer):
+            return False
+        self.clock = clock
+        self.writer = writer
+        self.value = value
+        return True
+
+    def encode(self, parts, room: int):
+        body = struct.pack("!IIB", self.clock, self.writer, len(self.value)) + self.value
+        if len(body) > room:
+            return None, parts
+        return body, None
+
+
+class GCounter:
+    kind = GCOUNTER
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+
+    def value(self) -> int:
+        return sum(self.counts.values())
+
+    def merge(self, address: int, count: int) -> bool:
+        known = self.counts.get(address)
+        if known is None and len(self.counts) >= MAX_COUNTERS:
+            return False
+        if known is not None and known >= count:
+            return False
+        self.counts[address] = count
+        return True
+
+    def encode(self, addresses: set, room: int):
+        fit = min((room - 1) // 8, len(addresses), 255)
+        if fit <= 0:
+            return None, addresses
+        addresses = list(addresses)
+        body = bytearray((fit,))
+        for address in addresses[:fit]:
+            body.extend(struct.pack("!II", address, self.counts[address]))
+        return bytes(body), set(addresses[fit:]) or None
+
+
+class TopK:
+    kind = TOPK
+
+    def __init__(self, k: int):
+        self.k = max(1, min(k, MAX_K))
+        self.entries: list[tuple[int, int, bytes]] = []  # (score, address, name), best first
+
+    def merge(self, score: int, address: int, name: bytes) -> bool:
+        entry = (score, address, name)
+        if entry in self.entries:
+            return False
+        if len(self.entries) >= self.k and entry < self.entries[-1]:
+            return False
+        self.entries.append(entry)
+        self.entries.sort(reverse=True)
+        del self.entries[self.k :]
+        return entry in self.entries
+
+    def encode(self, entries: set, room: int):
+        body = bytearray((self.k, 0))
+        remaining = set()
+        for entry in entries:
+            if entry not in self.entries:
+                continue  # Pushed out since
+            packed = struct.pack("!iIB", entry[0], entry[1], len(entry[2])) + entry[2]
+            if len(body) + len(packed) > room or body[1] == 255:
+                remaining.add(entry)
+            else:
+                body.extend(packed)
+                body[1] += 1
+        if body[1] == 0 and remaining:
+            return None, remaining
+        return bytes(body), remaining or None
+
+
+class CrdtStore:
+    """Replicated values by key, within max_keys keys."""
+
+    def __init__(self, my_address: int, max_keys: int = 32):
+        self.my_address = my_address
+        self.max_keys = max_keys
+        self.values: dict[str, LwwRegister | GCounter | TopK] = {}
+        self.dirty: dict[str, object] = {}  # key: parts changed since last sent, True for all
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(key) whenever a key changes, locally or from a merge."""
+        self.listeners.append(callback)
+
+    def _value(self, key: str, kind: int, k: int = 5):
+        value = self.values.get(key)
+        if value is not None:
+            return value if value.kind == kind else None
+        if len(self.values) >= self.max_keys or len(key) > MAX_KEY_LEN:
+            return None
+        if kind == LWW:
+            value = LwwRegister()
+        elif kind == GCOUNTER:
+            value = GCounter()
+        else:
+            value = TopK(k)
+        self.values[key] = value
+        return value
+
+    def _changed(self, key: str, part=None):
+        if part is None:
+            self.dirty[key] = True
+        else:
+            parts = self.dirty.get(key)
+            if parts is True:
+                pass
+            elif parts is None:
+                self.dirty[key] = {part}
+            else:
+                parts.add(part)
+        for callback in self.listeners:
+            callback(key)
+
+    # Local changes
+
+    def set(self, key: str, value: bytes):
+        register = self._value(key, LWW)
+        if register is None or len(value) > MAX_VALUE_LEN:
+            raise ValueError(f"Can't set shared value {key}")
+        register.set(value, self.my_address)
+        self._changed(key)
+
+    def get(self, key: str, default: bytes | None = None) -> bytes | None:
+        register = self.values.get(key)
+        return register.value if register is not None and register.kind == LWW else default
+
+    def increment(self, key: str, amount: int = 1):
+        counter = self._value(key, GCOUNTER)
+        if counter is None or amount < 0:
+            raise ValueError(f"Can't increment shared counter {key}")
+        if counter.merge(self.my_address, counter.counts.get(self.my_address, 0) + amount):
+            self._changed(key, self.my_address)
+
+    def count(self, key: str) -> int:
+        counter = self.values.get(key)
+        return counter.value() if counter is not None and counter.kind == GCOUNTER else 0
+
+    def submit(self, key: str, score: int, name: bytes, k: int = 5):
+        """Submit a score to a top-K leaderboard."""
+        board = self._value(key, TOPK, k)
+        if board is None:
+            raise ValueError(f"Can't submit to shared leaderboard {key}")
+        entry = (score, self.my_address, name[:MAX_KEY_LEN])
+        if board.merge(*entry):
+            self._changed(key, entry)
+
+    def top(self, key: str) -> list[tuple[int, int, bytes]]:
+        board = self.values.get(key)
+        return list(board.entries) if board is not None and board.kind == TOPK else []
+
+    # Anti-entropy
+
+    def mark_all(self, key: str):
+        """Send all of a key again, not just the changes, for badges that missed earlier deltas."""
+        if key in self.values:
+            self.dirty[key] = True
+
+    def _all_parts(self, value):
+        if value.kind == GCOUNTER:
+            return set(value.counts)
+        if value.kind == TOPK:
+            return set(value.entries)
+        return True
+
+    def encode_deltas(self, max_len: int) -> tuple[bytes, int]:
+        """Pack changed parts into at most max_len bytes of records. What doesn't fit stays changed.
+        Returns the records and how many there are."""
+        packed = bytearray()
+        records = 0
+        for key in list(self.dirty):
+            value = self.values[key]
+            parts = self.dirty[key]
+            if parts is True:
+                parts = self._all_parts(value)
+            key_bytes = key.encode()
+            room = max_len - len(packed) - 2 - len(key_bytes)
+            body, remaining = value.encode(parts, room)
+            if body is None:
+                break
+            packed.append(value.kind)
+            packed.append(len(key_bytes))
+            packed.extend(key_bytes)
+            packed.extend(body)
+            records += 1
+            if remaining:
+                self.dirty[key] = remaining
+                break
+            del self.dirty[key]
+        return bytes(packed), records
+
+    def merge_records(self, packed: bytes, records: int) -> int:
+        """Merge received records, one at a time. Anything new is marked changed, to be passed on.
+        Returns how many records changed something."""
+        changed = 0
+        i = 0
+        try:
+            for _ in range(records):
+                kind = packed[i]
+                key = bytes(packed[i + 2 : i + 2 + packed[i + 1]]).decode()
+                i += 2 + packed[i + 1]
+                if kind == LWW:
+                    clock, writer, length = struct.unpack_from("!IIB", packed, i)
+                    i += 9
+                    value = bytes(packed[i : i + length])
+                    i += length
+                    register = self._value(key, LWW)
+                    if register is not None and length <= MAX_VALUE_LEN and register.merge(clock, writer, value):
+                        changed += 1
+                        self._changed(key)
+                elif kind == GCOUNTER:
+                    count = packed[i]
+                    i += 1
+                    counter = self._value(key, GCOUNTER)
+                    merged = False
+                    for _ in range(count):
+                        address, value = struct.unpack_from("!II", packed, i)
+                        i += 8
+                        if counter is not None and counter.merge(address, value):
+                            merged = True
+                            self._changed(key, address)
+                    changed += merged
+                elif kind == TOPK:
+                    k, count = packed[i], packed[i + 1]
+                    i += 2
+                    board = self._value(key, TOPK, k)
+                    merged = False
+                    for _ in range(count):
+                        score, address, length = struct.unpack_from("!iIB", packed, i)
+                        i += 9
+                        name = bytes(packed[i : i + length])
+                        i += length
+                        if board is not None and board.merge(score, address, name):
+                            merged = True
+                            self._changed(key, (score, address, name))
+                    changed += merged
+                else:
+                    break  # Unknown type, so the rest can't be parsed
+        except (IndexError, ValueError, UnicodeError, struct.error):
+            pass  # Cut short or corrupt, keep what was merged so far
+        return changed
@@ -0,0 +1,93 @@
+"""Mesh-wide shared state, kept in sync over the CRDT_SYNC port.
+
+Apps change shared values through the shared_state singleton, see net/crdt.py for the types:
+    shared_state.increment("snake_games")
+    shared_state.submit("snake_top", score, alias)
+    shared_state.top("snake_top")
+
+Changes go out in CRDT_SYNC frames to direct neighbors (TTL 0), packed as many to a frame as fit.
+Received records are merged as each frame arrives, and whatever was new is passed on in this badge's
+next frame, so changes spread across the mesh hop by hop and stop where nothing is new anymore.
+Every ANTI_ENTROPY_INTERVAL_MS one key is sent in full, taking turns, for badges that missed a delta.
+
+Budgets come from the config: crdt_max_keys limits memory, and crdt_bytes_per_min limits the
+airtime spent on shared state.
+"""
+
+import asyncio as aio  # type: ignore
+import time
+
+from net.crdt import CrdtStore
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, register_receiver, send
+from net.protocols import HEADER_LEN, MAX_FRAME_LEN, NetworkFrame, Protocol
+
+CRDT_SYNC = Protocol(port=27, name="CRDT_SYNC", structdef="!B")  # Count of records, followed by them. Variable length
+
+SYNC_INTERVAL_MS = 2000
+ANTI_ENTROPY_INTERVAL_MS = 30000
+MAX_RECORDS_LEN = MAX_FRAME_LEN - HEADER_LEN - 1
+MIN_FRAME_BYTES = 32  # Wait for at least this much budget, rather than sending tiny frames
+
+
+class SharedState(CrdtStore):
+    """CrdtStore synchronized with other badges."""
+
+    def __init__(self):
+        super().__init__(MY_ADDRESS)
+        self.bytes_per_ms = 2000 / 60000
+        self.budget = float(MAX_RECORDS_LEN)
+        self.last_budget_ms = 0
+        self.last_anti_entropy_ms = 0
+        self.anti_entropy_index = 0
+        self.sync_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        try:
+            self.max_keys = int(badge.config.get("crdt_max_keys", b"32"))
+            self.bytes_per_ms = int(badge.config.get("crdt_bytes_per_min", b"2000")) / 60000
+        except ValueError:
+            print("Invalid crdt_max_keys or crdt_bytes_per_min, using defaults")
+        self.last_budget_ms = self.last_anti_entropy_ms = time.ticks_ms()
+        register_receiver(CRDT_SYNC, self._receive, variable_length=True)
+        self.sync_task = aio.create_task(self.run())
+
+    def _receive(self, message: NetworkFrame):
+        if message.source == MY_ADDRESS or not message.payload:
+            return
+        self.merge_records(message.payload_bytes[1:], message.payload[0])
+
+    def _send_deltas(self):
+        if not self.dirty or self.budget < MIN_FRAME_BYTES:
+            return
+        records, count = self.encode_deltas(min(MAX_RECORDS_LEN, int(self.budget)))
+        if not count:
+            return
+        self.budget -= HEADER_LEN + 1 + len(records)
+        send(
+            NetworkFrame().set_fields(
+                protocol=Protocol(CRDT_SYNC.port, CRDT_SYNC.name, f"!B{len(records)}s"),
+                destination=BROADCAST_ADDRESS,
+                ttl=0,
+                payload=(count, records),
+            )
+        )
+
+    async def run(self):
+        while True:
+            await aio.sleep_ms(SYNC_INTERVAL_MS)
+            now = time.ticks_ms()
+            self.budget = min(
+                float(MAX_RECORDS_LEN), self.budget + time.ticks_diff(now, self.last_budget_ms) * self.bytes_per_ms
+            )
+            self.last_budget_ms = now
+            if self.values and time.ticks_diff(now, self.last_anti_entropy_ms) > ANTI_ENTROPY_INTERVAL_MS:
+                self.last_anti_entropy_ms = now
+                keys = list(self.values)
+                self.anti_entropy_index = (self.anti_entropy_index + 1) % len(keys)
+                self.mark_all(keys[self.anti_entropy_index])
+            self._send_deltas()
+
+
+# Shared state singleton
+shared_state = SharedState()
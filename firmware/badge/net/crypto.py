@@ -1,42 +1,185 @@
-"""Helper logic for dealing with signed messages"""
+"""Helper logic for dealing with signed messages
 
-from cryptography import hashes, padding, serialization
+Two signature schemes, told apart by a key ID byte so badges can accept both while moving from one to
+the other:
+    RSA_PSS  RSA-PSS with SHA256 and a 1024 bit key, 128 byte signatures. The original scheme, its
+             signatures are sent as they are, without the key ID byte.
+    ED25519  Ed25519, 64 byte signatures, sent after the key ID byte (65 bytes).
+A badge loads every scheme it finds a public key for in /data, and verifies signatures of any of them.
+It signs with the crypto_scheme config (rsa or ed25519), if it has that private key.
 
-class Crypto:
+Signatures may be padded with zeros to fill fields sized for RSA, like the one of SIGNED_TEXT_CHAT.
+An RSA signature starting with a key ID byte and ending in 63 zero bytes is too unlikely to matter.
+Keys are made with scripts/generate_rsa_keys.py and scripts/generate_signing_keys.py.
+
+Nothing is loaded until the first sign() or verify(), or until private_key is looked at, so boot
+doesn't wait on it. Signing keys get a self check, a sign and verify, the first time they're used.
+It's only done once per key: a fingerprint of the key, and how long the check took, are kept in
+the crypto_checked config, and the check is skipped when the fingerprint matches.
+"""
+
+import hashlib
+import time
+
+from cryptography import ed25519, hashes, padding, serialization
+
+RSA_PSS = 1
+ED25519 = 2
 
-    def __init__(self, key_name=None):
-        key_name = key_name or "supercon"
+
+def _fingerprint(private_key_bytes):
+    return hashlib.sha256(private_key_bytes).digest()[:8]
+
+
+class RsaPss:
+    key_id = RSA_PSS
+    name = "rsa"
+    signature_len = 128
+    tagged = False
+
+    def __init__(self, key_name):
         with open(f"/data/{key_name}_public.der", "rb") as public_key_file:
             self.public_key = serialization.load_der_public_key(public_key_file.read())
         try:
             with open(f"/data/{key_name}_private.der", "rb") as private_key_file:
-                self.private_key = serialization.load_der_private_key(private_key_file.read(), None)
-            if not self.verify("key self check", self.sign("key self check")):
-                self.private_key = None
+                private_der = private_key_file.read()
+            self.private_key = serialization.load_der_private_key(private_der, None)
+            self.fingerprint = _fingerprint(private_der)
         except OSError:
-            # print("No private key on this badge, unable to cryptographically sign")
             self.private_key = None
 
     def sign(self, message):
-        if self.private_key is None:
-            raise ValueError("No private key on this badge, unable to cryptographically sign.")
-        signature = self.private_key.sign(
+        return self.private_key.sign(
             message,
-            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), 
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
                         salt_length=hashes.SHA256().digest_size),
             hashes.SHA256()
         )
-        return signature
 
     def verify(self, message, signature):
         try:
             self.public_key.verify(
                 signature,
                 message,
-                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), 
+                padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
                             salt_length=hashes.SHA256().digest_size),
                 hashes.SHA256()
             )
             return True
         except:
             return False
+
+
+class Ed25519:
+    key_id = ED25519
+    name = "ed25519"
+    signature_len = 64
+    tagged = True
+
+    def __init__(self, key_name):
+        # Raw 32 byte keys, DER adds nothing here
+        with open(f"/data/{key_name}_ed25519_public.bin", "rb") as public_key_file:
+            self.public_key = ed25519.Ed25519PublicKey.from_public_bytes(public_key_file.read())
+        try:
+            with open(f"/data/{key_name}_ed25519_private.bin", "rb") as private_key_file:
+                private_raw = private_key_file.read()
+            self.private_key = ed25519.Ed25519PrivateKey.from_private_bytes(private_raw)
+            self.fingerprint = _fingerprint(private_raw)
+        except OSError:
+            self.private_key = None
+
+    def sign(self, message):
+        return self.private_key.sign(message)
+
+    def verify(self, message, signature):
+        try:
+            self.public_key.verify(signature, message)
+            return True
+        except:
+            return False
+
+
+SCHEMES = (RsaPss, Ed25519)
+
+
+class Crypto:
+
+    def __init__(self, key_name=None, scheme=None, config=None):
+        self.key_name = key_name or "supercon"
+        self.scheme = scheme or "rsa"
+        self.config = config  # Where self check results are kept, if given
+        self.loaded = False
+        self.schemes = {}  # key ID: scheme with a public key on this badge
+        self.signer = None
+        self.public_key = None
+        self._private_key = None
+
+    @property
+    def private_key(self):
+        """Private key this badge signs with, None if it can't sign."""
+        self._load()
+        return self._private_key
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        start = time.ticks_ms()
+        for scheme_class in SCHEMES:
+            try:
+                self.schemes[scheme_class.key_id] = scheme_class(self.key_name)
+            except OSError:
+                pass
+        if not self.schemes:
+            print(f"No public key for {self.key_name} in /data, unable to verify signatures")
+        for candidate in self.schemes.values():
+            if candidate.name == self.scheme and candidate.private_key is not None:
+                self.signer = candidate
+        loaded = time.ticks_ms()
+        checked = self._self_check()
+        # if self.signer is None:
+        #     print("No private key on this badge, unable to cryptographically sign")
+        rsa = self.schemes.get(RSA_PSS)
+        self.public_key = rsa.public_key if rsa is not None else None
+        self._private_key = self.signer.private_key if self.signer is not None else None
+        print(f"Crypto keys loaded in {time.ticks_diff(loaded, start)} ms, {checked}")
+
+    def _self_check(self):
+        """Sign and verify with a new signing key, once per key. Returns what was done, for the boot log."""
+        if self.signer is None:
+            return "no self check without a private key"
+        fingerprint = self.signer.fingerprint.hex()
+        saved = (self.config.get("crypto_checked", b"") if self.config is not None else b"").decode()
+        if saved.split(":")[0] == fingerprint:
+            return f"self check of {saved.split(':')[-1]} ms skipped, key checked before"
+        start = time.ticks_ms()
+        if not self.verify(b"key self check", self.sign(b"key self check")):
+            self.signer = None
+            return "self check failed, unable to cryptographically sign"
+        check_ms = time.ticks_diff(time.ticks_ms(), start)
+        if self.config is not None:
+            self.config.set("crypto_checked", f"{fingerprint}:{check_ms}")
+            self.config.flush()
+        return f"self check in {check_ms} ms"
+
+    def sign(self, message):
+        self._load()
+        if self.signer is None:
+            raise ValueError("No private key on this badge, unable to cryptographically sign.")
+        signature = self.signer.sign(message)
+        if self.signer.tagged:
+            return bytes((self.signer.key_id,)) + signature
+        return signature
+
+    def verify(self, message, signature):
+        self._load()
+        scheme = self.schemes.get(signature[0]) if signature else None
+        if (
+            scheme is not None
+            and scheme.tagged
+            and len(signature) > scheme.signature_len
+            and not any(signature[1 + scheme.signature_len:])
+        ):
+            return scheme.verify(message, bytes(signature[1 : 1 + scheme.signature_len]))
+        scheme = self.schemes.get(RSA_PSS)
+        return scheme is not None and scheme.verify(message, signature)
@@ -0,0 +1,120 @@
+"""Node directory, mapping badge addresses to their aliases.
+
+Badges announce their alias in a NODE_ALIAS frame every ANNOUNCE_INTERVAL_MS, with some jitter so a
+hall of badges that booted together doesn't announce at once, and right away when it changes. The
+directory keeps the max_entries most recently heard badges, and saves them to /data/directory when
+something changed, at most every SAVE_INTERVAL_MS, so aliases are known right after a reboot.
+
+Apps look aliases up here instead of sending them in every frame, and keep just the address. Each
+alias string is then held once, not once per message.
+"""
+
+import asyncio as aio  # type: ignore
+import random
+import time
+
+from hardware.datafile import DataFile
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, register_receiver, send
+from net.protocols import NetworkFrame, Protocol
+
+MAX_ALIAS_LEN = 16  # Same as the alias config
+NODE_ALIAS = Protocol(port=26, name="NODE_ALIAS", structdef=f"!{MAX_ALIAS_LEN}s")  # alias
+
+ANNOUNCE_INTERVAL_MS = 600000
+ANNOUNCE_JITTER_MS = 120000
+ANNOUNCE_TTL = 2
+SAVE_INTERVAL_MS = 300000
+
+
+class NodeDirectory:
+    """Aliases of the most recently heard badges."""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self.aliases: dict[int, str] = {}  # address: alias, least recently heard first
+        self.file: DataFile | None = None
+        self.dirty = False
+        self.my_alias = ""
+        self.next_announce_ms = 0
+        self.last_save_ms = 0
+        self.directory_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        self.file = DataFile("directory")
+        for key, alias in self.file.db.items():
+            if len(self.aliases) >= self.max_entries:
+                break
+            self.aliases[int.from_bytes(key, "big")] = alias.decode()
+        self.my_alias = badge.config.get("alias", b"").decode()
+        self.learn(MY_ADDRESS, self.my_alias)
+        self.next_announce_ms = time.ticks_add(time.ticks_ms(), random.randrange(ANNOUNCE_JITTER_MS))
+        self.last_save_ms = time.ticks_ms()
+        register_receiver(NODE_ALIAS, self._receive_alias)
+        self.directory_task = aio.create_task(self.run())
+
+    def learn(self, address: int, alias: str):
+        """Note the alias of a badge that was just heard from."""
+        known = self.aliases.pop(address, None)
+        if known is None and len(self.aliases) >= self.max_entries:
+            # Forget the least recently heard badge
+            oldest = next(iter(self.aliases))
+            del self.aliases[oldest]
+            if self.file is not None:
+                try:
+                    del self.file.db[oldest.to_bytes(4, "big")]
+                except KeyError:
+                    pass  # Not saved yet
+        if known == alias:
+            alias = known  # Keep the string already stored, not another copy
+        else:
+            self.dirty = True
+        self.aliases[address] = alias
+
+    def alias(self, address: int) -> str | None:
+        return self.aliases.get(address) or None
+
+    def display_name(self, address: int) -> str:
+        """Alias of a badge, or its address if the alias isn't known."""
+        return self.aliases.get(address) or f"{address:x}"
+
+    def _receive_alias(self, message: NetworkFrame):
+        self.learn(message.source, message.payload[0].strip(b"\0").decode())
+
+    def announce(self):
+        send(
+            NetworkFrame().set_fields(
+                protocol=NODE_ALIAS,
+                destination=BROADCAST_ADDRESS,
+                ttl=ANNOUNCE_TTL,
+                payload=(self.my_alias.encode()[:MAX_ALIAS_LEN],),
+            )
+        )
+        self.next_announce_ms = time.ticks_add(
+            time.ticks_ms(), ANNOUNCE_INTERVAL_MS + random.randrange(ANNOUNCE_JITTER_MS)
+        )
+
+    def save(self):
+        for address, alias in self.aliases.items():
+            self.file.set(address.to_bytes(4, "big"), alias.encode())
+        self.file.flush()
+        self.dirty = False
+
+    async def run(self):
+        while True:
+            await aio.sleep_ms(5000)
+            now = time.ticks_ms()
+            alias = self.badge.config.get("alias", b"").decode()
+            if alias != self.my_alias:
+                self.my_alias = alias
+                self.learn(MY_ADDRESS, alias)
+                self.announce()
+            elif self.my_alias and time.ticks_diff(now, self.next_announce_ms) >= 0:
+                self.announce()
+            if self.dirty and time.ticks_diff(now, self.last_save_ms) > SAVE_INTERVAL_MS:
+                self.last_save_ms = now
+                self.save()
+
+
+# Node directory singleton
+directory = NodeDirectory()
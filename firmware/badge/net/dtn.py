@@ -0,0 +1,83 @@
+"""Store-and-forward cache for unicast frames to badges that can't be reached right now.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+A unicast frame to a badge that is asleep or out of range is lost once its TTL runs out. With
+net_dtn on, badges keep a copy of unicast frames they send or relay to destinations they haven't
+heard from lately. When a destination is heard directly again, its frames are sent to it once more,
+paced, as neighbor-only frames, since relays in between would drop them as already seen.
+
+Memory is bounded: at most max_frames frames, max_per_destination for any one destination, each
+kept for expiration_s. When full, the oldest frame is dropped.
+"""
+
+RECENTLY_HEARD_S = 30  # Destinations heard from this recently are probably still reachable
+
+
+class StoreForwardCache:
+    def __init__(self, max_frames: int = 16, max_per_destination: int = 4, expiration_s: int = 600):
+        self.max_frames = max_frames
+        self.max_per_destination = max_per_destination
+        self.expiration_s = expiration_s
+        self.frames: dict[int, list[tuple[float, bytes]]] = {}  # destination: [(time stored, frame)], oldest first
+        self.count = 0
+        self.stored = 0
+        self.flushed = 0
+        self.dropped = 0  # Expired, or pushed out by newer frames
+
+    def _drop_oldest(self):
+        oldest = None
+        for destination, frames in self.frames.items():
+            if oldest is None or frames[0][0] < self.frames[oldest][0][0]:
+                oldest = destination
+        self._pop(oldest, 1)
+        self.dropped += 1
+
+    def _pop(self, destination: int, count: int) -> list[tuple[float, bytes]]:
+        frames = self.frames[destination]
+        popped = frames[:count]
+        del frames[:count]
+        if not frames:
+            del self.frames[destination]
+        self.count -= len(popped)
+        return popped
+
+    def store(self, destination: int, frame: bytes, now_s: float):
+        frames = self.frames.get(destination)
+        if frames is not None:
+            for _, stored in frames:
+                if stored[2:4] == frame[2:4]:
+                    return  # Same checksum, so the same message
+            if len(frames) >= self.max_per_destination:
+                self._pop(destination, 1)
+                self.dropped += 1
+        if self.count >= self.max_frames:
+            self._drop_oldest()
+        self.frames.setdefault(destination, []).append((now_s, frame))
+        self.count += 1
+        self.stored += 1
+
+    def holds_for(self, address: int) -> bool:
+        return address in self.frames
+
+    def take(self, destination: int, now_s: float) -> list[bytes]:
+        """Frames waiting for a destination that was just heard, removing them from the cache."""
+        if destination not in self.frames:
+            return []
+        frames = [frame for stored_s, frame in self._pop(destination, self.max_per_destination) if now_s - stored_s < self.expiration_s]
+        self.flushed += len(frames)
+        return frames
+
+    def expire(self, now_s: float):
+        for destination in list(self.frames):
+            frames = self.frames[destination]
+            fresh = [entry for entry in frames if now_s - entry[0] < self.expiration_s]
+            expired = len(frames) - len(fresh)
+            if expired:
+                self.count -= expired
+                self.dropped += expired
+                if fresh:
+                    self.frames[destination] = fresh
+                else:
+                    del self.frames[destination]
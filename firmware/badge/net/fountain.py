@@ -0,0 +1,219 @@
+"""LT fountain code for broadcasting files to every badge.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+A file is split into k blocks of symbol_size bytes, the last one padded with zeros. Each encoded
+symbol is the XOR of a few blocks. Which ones, and how many, follows from the file ID and the
+symbol's 16 bit ID alone, through a small PRNG that gives the same numbers on every badge, so a
+symbol only needs its ID sent along. The number of blocks is drawn from the robust soliton
+distribution, which lets a badge rebuild the file from any k symbols and some more, from any mix
+of senders, in any order. For the 100 to 1000 blocks of files the badge deals with, that's 15 to
+25% more on average.
+
+Decoding is by peeling: a symbol that's down to one unknown block gives that block, which may in
+turn bring other symbols down to one. Blocks go straight to the output file as they're recovered,
+and symbols waiting for more blocks wait in a scratch file, so RAM only holds the bookkeeping.
+
+Manifest, signed by the seed badge: file ID, file size, k, symbol size, name and SHA256 of the file.
+"""
+
+import math
+import struct
+
+MANIFEST_STRUCT = "!IIHB20s32s"  # Followed by the signature of these bytes
+MANIFEST_LEN = struct.calcsize(MANIFEST_STRUCT)
+SYMBOL_HEADER = "!IH"  # File ID, symbol ID, followed by the symbol
+SYMBOL_HEADER_LEN = struct.calcsize(SYMBOL_HEADER)
+SYMBOL_SIZE = 200
+MAX_FILE_SIZE = 256 * 1024
+
+# Robust soliton parameters
+SOLITON_C = 0.05
+SOLITON_DELTA = 0.5
+
+_distributions: dict[int, list[float]] = {}
+
+
+class Prng:
+    """xorshift32, the same numbers in both Pythons."""
+
+    def __init__(self, seed: int):
+        self.state = seed & 0xFFFFFFFF or 0x6D2B79F5
+
+    def next(self) -> int:
+        x = self.state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.state = x
+        return x
+
+
+def degree_distribution(k: int) -> list[float]:
+    """Cumulative robust soliton distribution, entry d - 1 for degree d."""
+    cdf = _distributions.get(k)
+    if cdf is not None:
+        return cdf
+    r = SOLITON_C * math.log(k / SOLITON_DELTA) * math.sqrt(k)
+    spike = max(1, min(k, int(k / r))) if r > 0 else k
+    weights = []
+    for d in range(1, k + 1):
+        ideal = 1 / k if d == 1 else 1 / (d * (d - 1))
+        if d < spike:
+            robust = r / (d * k)
+        elif d == spike:
+            robust = r * math.log(r / SOLITON_DELTA) / k if r > SOLITON_DELTA else 0
+        else:
+            robust = 0
+        weights.append(ideal + robust)
+    total = sum(weights)
+    cdf = []
+    running = 0.0
+    for weight in weights:
+        running += weight / total
+        cdf.append(running)
+    cdf[-1] = 1.0
+    _distributions.clear()  # Only one file at a time is usual, don't keep tables around
+    _distributions[k] = cdf
+    return cdf
+
+
+def symbol_blocks(file_id: int, symbol_id: int, k: int) -> list[int]:
+    """The blocks a symbol is the XOR of."""
+    prng = Prng(file_id ^ (symbol_id * 0x9E3779B1))
+    cdf = degree_distribution(k)
+    sample = prng.next() / 0x100000000
+    low, high = 0, k - 1
+    while low < high:
+        middle = (low + high) // 2
+        if cdf[middle] < sample:
+            low = middle + 1
+        else:
+            high = middle
+    degree = low + 1
+    blocks = []
+    while len(blocks) < degree:
+        block = prng.next() % k
+        if block not in blocks:
+            blocks.append(block)
+    return blocks
+
+
+def block_count(size: int, symbol_size: int = SYMBOL_SIZE) -> int:
+    return max(1, (size + symbol_size - 1) // symbol_size)
+
+
+def pack_manifest(file_id: int, size: int, symbol_size: int, name: bytes, sha256: bytes) -> bytes:
+    return struct.pack(MANIFEST_STRUCT, file_id, size, block_count(size, symbol_size), symbol_size, name, sha256)
+
+
+def unpack_manifest(manifest: bytes) -> tuple[int, int, int, int, bytes, bytes]:
+    """(file ID, size, k, symbol size, name, SHA256)"""
+    file_id, size, k, symbol_size, name, sha256 = struct.unpack_from(MANIFEST_STRUCT, manifest)
+    return file_id, size, k, symbol_size, name.rstrip(b"\0"), sha256
+
+
+def _read_block(file, index: int, symbol_size: int) -> bytes:
+    file.seek(index * symbol_size)
+    data = file.read(symbol_size)
+    if len(data) < symbol_size:
+        data = data + bytes(symbol_size - len(data))
+    return data
+
+
+class LtEncoder:
+    """Encodes symbols of a file open for reading."""
+
+    def __init__(self, file_id: int, k: int, symbol_size: int, source):
+        self.file_id = file_id
+        self.k = k
+        self.symbol_size = symbol_size
+        self.source = source
+
+    def symbol(self, symbol_id: int) -> bytes:
+        value = 0
+        for block in symbol_blocks(self.file_id, symbol_id, self.k):
+            value ^= int.from_bytes(_read_block(self.source, block, self.symbol_size), "big")
+        return value.to_bytes(self.symbol_size, "big")
+
+
+class LtDecoder:
+    """Peeling decoder. output must be open for reading and writing, k * symbol_size bytes long.
+    scratch is a file open for reading and writing that holds up to max_pending waiting symbols."""
+
+    def __init__(self, file_id: int, k: int, symbol_size: int, output, scratch, max_pending: int | None = None):
+        self.file_id = file_id
+        self.k = k
+        self.symbol_size = symbol_size
+        self.output = output
+        self.scratch = scratch
+        self.max_pending = max_pending or k + k // 2
+        self.decoded = bytearray(k)
+        self.decoded_count = 0
+        self.received = 0
+        self.pending: dict[int, list] = {}  # symbol ID: [scratch slot, blocks not decoded yet]
+        self.waiting: dict[int, list[int]] = {}  # block: symbol IDs waiting on it
+        self.free_slots: list[int] = []
+        self.next_slot = 0
+
+    def complete(self) -> bool:
+        return self.decoded_count == self.k
+
+    def _reduce(self, symbol_id: int, data: bytes, target: int) -> bytes:
+        """The target block, from a symbol whose other blocks are all decoded."""
+        value = int.from_bytes(data, "big")
+        for block in symbol_blocks(self.file_id, symbol_id, self.k):
+            if block != target:
+                value ^= int.from_bytes(_read_block(self.output, block, self.symbol_size), "big")
+        return value.to_bytes(self.symbol_size, "big")
+
+    def add(self, symbol_id: int, data: bytes) -> bool:
+        """Add a received symbol. Returns True if it was of use."""
+        if self.complete() or symbol_id in self.pending or len(data) != self.symbol_size:
+            return False
+        self.received += 1
+        remaining = [block for block in symbol_blocks(self.file_id, symbol_id, self.k) if not self.decoded[block]]
+        if not remaining:
+            return False
+        if len(remaining) == 1:
+            self._recover(remaining[0], self._reduce(symbol_id, data, remaining[0]))
+            return True
+        if len(self.pending) >= self.max_pending:
+            return False  # There are always more symbols
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.next_slot
+            self.next_slot += 1
+        self.scratch.seek(slot * self.symbol_size)
+        self.scratch.write(data)
+        self.pending[symbol_id] = [slot, remaining]
+        for block in remaining:
+            self.waiting.setdefault(block, []).append(symbol_id)
+        return True
+
+    def _recover(self, block: int, data: bytes):
+        recovered = [(block, data)]
+        while recovered:
+            block, data = recovered.pop()
+            if self.decoded[block]:
+                continue
+            self.output.seek(block * self.symbol_size)
+            self.output.write(data)
+            self.decoded[block] = 1
+            self.decoded_count += 1
+            for symbol_id in self.waiting.pop(block, ()):
+                entry = self.pending.get(symbol_id)
+                if entry is None:
+                    continue
+                slot, remaining = entry
+                remaining.remove(block)
+                if len(remaining) > 1:
+                    continue
+                del self.pending[symbol_id]
+                self.free_slots.append(slot)
+                if remaining and not self.decoded[remaining[0]]:
+                    self.scratch.seek(slot * self.symbol_size)
+                    symbol = self.scratch.read(self.symbol_size)
+                    recovered.append((remaining[0], self._reduce(symbol_id, symbol, remaining[0])))
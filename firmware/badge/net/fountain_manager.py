@@ -0,0 +1,287 @@
+"""Broadcast files to every badge, like a new schedule.csv or app, with the fountain code in net/fountain.py.
+
+A badge with the private key seeds a file:
+    fountain.seed("/schedule.csv")
+It sends a FOUNTAIN_MANIFEST, signed, and then a stream of FOUNTAIN_SYMBOL frames, all to direct
+neighbors (TTL 0). A badge that hears the manifest checks the signature with the public key, once
+per file, and if the fountain_accept config is on, collects symbols from any badge until it can
+rebuild the file into /data/fountain/. Badges that finish send symbols and the manifest of the file
+themselves, every fountain_reseed_ms, so the file spreads hop by hop across the mesh without the
+seed having to reach everyone.
+
+Symbols are random, so badges re-seeding the same file rarely send the same one, and every symbol
+helps any badge still missing the file. Received files are checked against the SHA256 in the manifest.
+"""
+
+import asyncio as aio  # type: ignore
+import hashlib
+import os
+import random
+import struct
+import time
+
+from net.fountain import (
+    MANIFEST_LEN,
+    MANIFEST_STRUCT,
+    MAX_FILE_SIZE,
+    SYMBOL_HEADER,
+    SYMBOL_HEADER_LEN,
+    SYMBOL_SIZE,
+    LtDecoder,
+    LtEncoder,
+    block_count,
+    pack_manifest,
+    unpack_manifest,
+)
+from net.net import BROADCAST_ADDRESS, register_receiver, send
+from net.protocols import NetworkFrame, Protocol
+from net.verifier import PENDING, REJECTED, VERIFIED, verifier
+
+FOUNTAIN_MANIFEST = Protocol(
+    port=29, name="FOUNTAIN_MANIFEST", structdef=MANIFEST_STRUCT
+)  # Followed by the signature. Variable length
+FOUNTAIN_SYMBOL = Protocol(
+    port=30, name="FOUNTAIN_SYMBOL", structdef=SYMBOL_HEADER
+)  # Followed by the symbol. Variable length
+
+FOUNTAIN_DIR = "/data/fountain"
+SEED_INTERVAL_MS = 500
+SEED_SYMBOLS_PER_BLOCK = 3  # The seed sends 3k symbols, neighbors miss some
+RESEED_SYMBOLS_PER_BLOCK = 1  # Badges that finished send k symbols
+MANIFEST_EVERY = 20  # Symbols sent between manifests
+MAX_DOWNLOADS = 2
+DOWNLOAD_IDLE_MS = 600000  # Give up on a file when no symbols were heard for this long
+MAX_REJECTED = 16
+UPDATE_MS = 100
+
+
+class Stream:
+    """A file this badge sends symbols of."""
+
+    def __init__(self, manifest: bytes, encoder: LtEncoder, source, interval_ms: int, symbols: int):
+        self.manifest = manifest  # With the signature
+        self.encoder = encoder
+        self.source = source
+        self.interval_ms = interval_ms
+        self.symbols_left = symbols
+        self.sent = 0
+        self.next_ms = time.ticks_ms()
+        self.send_handle = None
+
+
+class Download:
+    """A file this badge is collecting symbols of."""
+
+    def __init__(self, manifest: bytes, signature: bytes, path: str):
+        self.manifest = manifest
+        self.signature = signature
+        self.file_id, self.size, self.k, self.symbol_size, name, self.sha256 = unpack_manifest(manifest)
+        self.name = name.decode()
+        self.path = path
+        self.output = open(path + ".part", "w+b")
+        zeros = bytes(1024)
+        remaining = self.k * self.symbol_size
+        while remaining > 0:
+            remaining -= self.output.write(zeros[: min(remaining, len(zeros))])
+        self.scratch = open(path + ".sym", "w+b")
+        self.decoder = LtDecoder(self.file_id, self.k, self.symbol_size, self.output, self.scratch)
+        self.heard_ms = time.ticks_ms()
+
+    def close(self):
+        self.output.close()
+        self.scratch.close()
+        os.remove(self.path + ".sym")
+
+
+class FileDistribution:
+    """Seeds, collects and re-seeds fountain coded files."""
+
+    def __init__(self):
+        self.accept = False
+        self.reseed_interval_ms = 5000
+        self.streams: dict[int, Stream] = {}
+        self.downloads: dict[int, Download] = {}
+        self.verified: dict[int, bytes] = {}  # file ID: manifest, checked once
+        self.checking: list[int] = []  # file IDs whose manifest signature the verifier is checking
+        self.rejected: list[int] = []  # file IDs with a bad signature or not accepted
+        self.complete_callbacks: list = []
+        self.update_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        self.accept = badge.config.get("fountain_accept", b"false") == b"true"
+        try:
+            self.reseed_interval_ms = int(badge.config.get("fountain_reseed_ms", b"5000"))
+        except ValueError:
+            print("Invalid fountain_reseed_ms, using default")
+        register_receiver(FOUNTAIN_MANIFEST, self._receive_manifest, variable_length=True)
+        register_receiver(FOUNTAIN_SYMBOL, self._receive_symbol, variable_length=True)
+        self.update_task = aio.create_task(self.run())
+
+    def seed(self, path: str, name: str | None = None) -> int:
+        """Start broadcasting a file. Needs the private key. Returns the file ID."""
+        size = os.stat(path)[6]
+        if size > MAX_FILE_SIZE:
+            raise ValueError(f"File too large to broadcast: {size} bytes")
+        name = name or path.split("/")[-1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(1024)
+                if not data:
+                    break
+                digest.update(data)
+        file_id = random.getrandbits(32)
+        manifest = pack_manifest(file_id, size, SYMBOL_SIZE, name.encode()[:20], digest.digest())
+        signature = self.badge.crypto.sign(manifest)
+        self.verified[file_id] = manifest
+        self._stream(file_id, manifest + signature, path, SEED_INTERVAL_MS, SEED_SYMBOLS_PER_BLOCK)
+        return file_id
+
+    def _stream(self, file_id: int, manifest: bytes, path: str, interval_ms: int, symbols_per_block: int):
+        k = block_count(unpack_manifest(manifest)[1])
+        source = open(path, "rb")
+        encoder = LtEncoder(file_id, k, SYMBOL_SIZE, source)
+        self.streams[file_id] = Stream(manifest, encoder, source, interval_ms, k * symbols_per_block)
+
+    def _reject(self, file_id: int):
+        self.rejected.append(file_id)
+        if len(self.rejected) > MAX_REJECTED:
+            self.rejected.pop(0)
+
+    def _receive_manifest(self, message: NetworkFrame):
+        manifest = bytes(message.payload_bytes[:MANIFEST_LEN])
+        signature = bytes(message.payload_bytes[MANIFEST_LEN:])
+        file_id, size, k, symbol_size, name, _ = unpack_manifest(manifest)
+        if (
+            file_id in self.verified
+            or file_id in self.rejected
+            or file_id in self.checking
+            or len(self.downloads) >= MAX_DOWNLOADS
+        ):
+            return
+        if (
+            not self.accept
+            or size > MAX_FILE_SIZE
+            or symbol_size != SYMBOL_SIZE
+            or k != block_count(size, symbol_size)
+            or not name
+            or b"/" in name
+            or name.startswith(b".")
+        ):
+            self._reject(file_id)
+            return
+        # Checked once per file, off the receive path since verifying is slow
+        source = message.source
+        status = verifier.verify(
+            manifest, signature, lambda status: self._manifest_checked(manifest, signature, source, status)
+        )
+        if status == PENDING:
+            self.checking.append(file_id)
+        else:
+            self._manifest_checked(manifest, signature, source, status)
+
+    def _manifest_checked(self, manifest: bytes, signature: bytes, source: int, status: int):
+        file_id, size, k, _, name, _ = unpack_manifest(manifest)
+        if file_id in self.checking:
+            self.checking.remove(file_id)
+        if status == REJECTED:
+            print(f"Fountain manifest for {name} with a bad signature from {source:x}")
+            self._reject(file_id)
+            return
+        if status != VERIFIED or file_id in self.verified or len(self.downloads) >= MAX_DOWNLOADS:
+            return  # UNVERIFIED is checked again when the manifest is repeated
+        self.verified[file_id] = manifest
+        if "fountain" not in os.listdir("/data"):
+            os.mkdir(FOUNTAIN_DIR)
+        self.downloads[file_id] = Download(manifest, signature, FOUNTAIN_DIR + "/" + name.decode())
+        print(f"Fountain receiving {name.decode()} ({size} bytes, {k} blocks)")
+
+    def _receive_symbol(self, message: NetworkFrame):
+        file_id, symbol_id = message.payload
+        download = self.downloads.get(file_id)
+        if download is None:
+            return
+        download.heard_ms = time.ticks_ms()
+        download.decoder.add(symbol_id, bytes(message.payload_bytes[SYMBOL_HEADER_LEN:]))
+        if download.decoder.complete():
+            self._finish(download)
+
+    def _finish(self, download: Download):
+        del self.downloads[download.file_id]
+        download.close()
+        digest = hashlib.sha256()
+        with open(download.path + ".part", "rb") as part:
+            with open(download.path + ".new", "wb") as new:
+                remaining = download.size
+                while remaining > 0:
+                    data = part.read(min(remaining, 1024))
+                    digest.update(data)
+                    new.write(data)
+                    remaining -= len(data)
+        os.remove(download.path + ".part")
+        if digest.digest() != download.sha256:
+            print(f"Fountain received {download.name}, but it doesn't match its manifest")
+            os.remove(download.path + ".new")
+            self._reject(download.file_id)
+            return
+        try:
+            os.remove(download.path)
+        except OSError:
+            pass
+        os.rename(download.path + ".new", download.path)
+        print(f"Fountain received {download.name} after {download.decoder.received} symbols for {download.k} blocks")
+        if self.reseed_interval_ms > 0:
+            self._stream(
+                download.file_id,
+                download.manifest + download.signature,
+                download.path,
+                self.reseed_interval_ms,
+                RESEED_SYMBOLS_PER_BLOCK,
+            )
+        for callback in self.complete_callbacks:
+            callback(download.name, download.path)
+
+    def _send_next(self, file_id: int, stream: Stream):
+        if stream.sent % MANIFEST_EVERY == 0:
+            protocol = FOUNTAIN_MANIFEST
+            payload = stream.manifest
+        else:
+            protocol = FOUNTAIN_SYMBOL
+            symbol_id = random.getrandbits(16)
+            payload = struct.pack(SYMBOL_HEADER, file_id, symbol_id) + stream.encoder.symbol(symbol_id)
+            stream.symbols_left -= 1
+        stream.send_handle = send(
+            NetworkFrame().set_fields(
+                protocol=Protocol(protocol.port, protocol.name, f"!{len(payload)}s"),
+                destination=BROADCAST_ADDRESS,
+                ttl=0,
+                payload=(payload,),
+            ),
+            expires_ms=stream.interval_ms,
+        )
+        stream.sent += 1
+
+    async def run(self):
+        while True:
+            await aio.sleep_ms(UPDATE_MS)
+            now = time.ticks_ms()
+            for file_id, stream in list(self.streams.items()):
+                if stream.symbols_left <= 0:
+                    stream.source.close()
+                    del self.streams[file_id]
+                elif time.ticks_diff(now, stream.next_ms) >= 0 and (
+                    stream.send_handle is None or stream.send_handle.done()
+                ):
+                    stream.next_ms = time.ticks_add(now, stream.interval_ms)
+                    self._send_next(file_id, stream)
+            for file_id, download in list(self.downloads.items()):
+                if time.ticks_diff(now, download.heard_ms) > DOWNLOAD_IDLE_MS:
+                    print(f"Fountain gave up on {download.name}")
+                    del self.downloads[file_id]
+                    download.close()
+                    os.remove(download.path + ".part")
+
+
+# File distribution singleton
+fountain = FileDistribution()
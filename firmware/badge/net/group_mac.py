@@ -0,0 +1,152 @@
+"""Group message authentication with a shared, rotating key.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Signing every chat message is too slow and too large: tens of milliseconds to verify and 65 to 128
+bytes per frame. Instead, badges holding the group key add a tag to frames: the first TAG_LEN bytes
+of HMAC-SHA256 over the sender address, a counter, the port, the key ID and the payload. Checking
+one is a couple of SHA256 runs, well under a millisecond.
+
+The group key is 16 random bytes, handed out by a badge with the private key in a GROUP_KEY frame:
+issued (increasing with every new key, its low byte is the key ID) and the key, XORed with a
+keystream derived from the group secret all badges are flashed with, followed by a signature of
+both. The signature makes sure only the organizers can rotate keys, the secret keeps the key from
+badges that don't have it. Badges keep the current and the previous key, so frames tagged just
+before a rotation still check out.
+
+Every sender counts up its frames per key. Receivers keep, per source and key, the highest counter
+seen and which of the WINDOW counters below it were seen, and reject frames with a counter seen
+before or older than that, so recorded frames can't be sent again.
+"""
+
+import hashlib
+import struct
+
+KEY_LEN = 16
+TAG_LEN = 8
+WINDOW = 32
+KEY_UPDATE_STRUCT = f"!I{KEY_LEN}s"  # issued, wrapped key. Followed by the signature of these bytes
+KEY_UPDATE_LEN = struct.calcsize(KEY_UPDATE_STRUCT)
+TAG_HEADER = "!IIBB"  # source, counter, port, key ID, followed by the payload
+
+
+def _pads(key: bytes) -> tuple[bytes, bytes]:
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key + bytes(64 - len(key))
+    return bytes(b ^ 0x36 for b in key), bytes(b ^ 0x5C for b in key)
+
+
+def hmac_sha256(key: bytes, message: bytes, pads: tuple[bytes, bytes] | None = None) -> bytes:
+    """HMAC-SHA256, there's no hmac module on the badge. pads are from _pads(key), to skip making them."""
+    inner_pad, outer_pad = pads or _pads(key)
+    inner = hashlib.sha256(inner_pad)
+    inner.update(message)
+    outer = hashlib.sha256(outer_pad)
+    outer.update(inner.digest())
+    return outer.digest()
+
+
+def wrap_key(secret: bytes, issued: int, key: bytes) -> bytes:
+    """XOR a group key with a keystream from the group secret. Unwraps as well."""
+    stream = hmac_sha256(secret, b"group key" + struct.pack("!I", issued))
+    return bytes(a ^ b for a, b in zip(key, stream[:KEY_LEN]))
+
+
+def pack_key_update(secret: bytes, issued: int, key: bytes) -> bytes:
+    return struct.pack(KEY_UPDATE_STRUCT, issued, wrap_key(secret, issued, key))
+
+
+def unpack_key_update(secret: bytes, update: bytes) -> tuple[int, bytes]:
+    """(issued, key)"""
+    issued, wrapped = struct.unpack_from(KEY_UPDATE_STRUCT, update)
+    return issued, wrap_key(secret, issued, wrapped)
+
+
+class ReplayWindow:
+    """Counters seen per source, for the max_sources most recently heard ones."""
+
+    def __init__(self, max_sources: int = 64):
+        self.max_sources = max_sources
+        self.sources: dict[int, list[int]] = {}  # source: [highest counter, bitmap of the WINDOW below], least recent first
+
+    def accept(self, source: int, counter: int) -> bool:
+        """Note a counter from a source, False if it was seen before or is too old to tell."""
+        entry = self.sources.pop(source, None)
+        if entry is None:
+            if len(self.sources) >= self.max_sources:
+                del self.sources[next(iter(self.sources))]
+            self.sources[source] = [counter, 0]
+            return True
+        self.sources[source] = entry  # Most recently heard again
+        highest, seen = entry
+        if counter > highest:
+            shift = counter - highest
+            entry[0] = counter
+            entry[1] = ((seen << shift) | (1 << (shift - 1))) & ((1 << WINDOW) - 1) if shift <= WINDOW else 0
+            return True
+        age = highest - counter
+        if age == 0 or age > WINDOW or seen & (1 << (age - 1)):
+            return False
+        entry[1] = seen | (1 << (age - 1))
+        return True
+
+
+class GroupKey:
+    def __init__(self, issued: int, key: bytes, max_sources: int = 64):
+        self.issued = issued
+        self.key_id = issued & 0xFF
+        self.pads = _pads(key)
+        self.replay = ReplayWindow(max_sources)
+
+    def tag(self, source: int, counter: int, port: int, payload: bytes) -> bytes:
+        message = struct.pack(TAG_HEADER, source, counter, port, self.key_id) + payload
+        return hmac_sha256(b"", message, self.pads)[:TAG_LEN]
+
+
+class GroupKeyring:
+    """The current and previous group key, tagging and checking frames with them."""
+
+    def __init__(self, max_sources: int = 64):
+        self.max_sources = max_sources
+        self.current: GroupKey | None = None
+        self.previous: GroupKey | None = None
+        self.counter = 0  # Next counter to send with the current key
+        self.rejected = 0
+        self.replayed = 0
+
+    def set_key(self, issued: int, key: bytes) -> bool:
+        """Start using a new key. False if it's not newer than the current one."""
+        if self.current is not None and issued <= self.current.issued:
+            return False
+        self.previous = self.current
+        self.current = GroupKey(issued, key, self.max_sources)
+        self.counter = 0
+        return True
+
+    def seal(self, source: int, port: int, payload: bytes) -> tuple[int, int, bytes]:
+        """(key ID, counter, tag) to send with a payload."""
+        key = self.current
+        if key is None:
+            raise ValueError("No group key yet")
+        counter = self.counter
+        self.counter += 1
+        return key.key_id, counter, key.tag(source, counter, port, payload)
+
+    def open(self, source: int, port: int, key_id: int, counter: int, tag: bytes, payload: bytes) -> bool:
+        """Whether a frame's tag checks out and it wasn't seen before."""
+        for key in (self.current, self.previous):
+            if key is not None and key.key_id == key_id:
+                break
+        else:
+            self.rejected += 1
+            return False
+        if key.tag(source, counter, port, payload) != tag:
+            self.rejected += 1
+            return False
+        # Only counters of frames with a good tag are noted, forged ones can't push the window ahead
+        if not key.replay.accept(source, counter):
+            self.replayed += 1
+            return False
+        return True
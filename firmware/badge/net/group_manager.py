@@ -0,0 +1,152 @@
+"""Hands out the rotating group key, and tags and checks frames with it, see net/group_mac.py.
+
+Badges flashed with the group secret, /data/supercon_group.bin, take part:
+    key_id, counter, tag = group.seal(port, payload)
+    if group.open(message.source, port, key_id, counter, tag, payload): ...
+A badge with the private key and group_rotate_s set makes a new key that often, and sends the
+signed GROUP_KEY frame again every KEY_REPEAT_MS for badges that missed it. Other badges check
+the signature once, with the verifier, and switch to the new key. The last key is saved to /data,
+so it's known right after a reboot, and so is how far the send counter went, in steps of
+COUNTER_RESERVE, so a rebooted badge doesn't reuse counters receivers have already seen.
+"""
+
+import asyncio as aio  # type: ignore
+import os
+import struct
+import time
+
+from net.group_mac import KEY_LEN, KEY_UPDATE_LEN, KEY_UPDATE_STRUCT, GroupKeyring, pack_key_update, unpack_key_update
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, register_receiver, send
+from net.protocols import NetworkFrame, Protocol
+from net.verifier import VERIFIED, verifier
+
+GROUP_KEY = Protocol(
+    port=31, name="GROUP_KEY", structdef=KEY_UPDATE_STRUCT
+)  # Followed by the signature. Variable length
+
+SECRET_PATH = "/data/supercon_group.bin"
+KEY_PATH = "/data/group_key"
+COUNTER_PATH = "/data/group_counter"
+COUNTER_STRUCT = "!II"  # issued, counter reserved up to
+COUNTER_RESERVE = 256
+KEY_REPEAT_MS = 300000
+KEY_TTL = 7
+UPDATE_MS = 1000
+
+
+class GroupAuth:
+    """The group key of this badge, and rotating it on the badge that hands it out."""
+
+    def __init__(self):
+        self.secret: bytes | None = None
+        self.keyring = GroupKeyring()
+        self.update: bytes | None = None  # Current key update with its signature, as sent
+        self.reserved = 0  # Counters up to here are saved as used
+        self.rotate_ms = 0
+        self.next_rotate_ms = 0
+        self.next_repeat_ms = 0
+        self.group_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        try:
+            with open(SECRET_PATH, "rb") as secret_file:
+                self.secret = secret_file.read()
+        except OSError:
+            return  # Not flashed with the group secret, group frames can't be checked
+        try:
+            self.rotate_ms = int(badge.config.get("group_rotate_s", b"0")) * 1000
+        except ValueError:
+            print("Invalid group_rotate_s, not rotating")
+        register_receiver(GROUP_KEY, self._receive_key, variable_length=True)
+        try:
+            with open(KEY_PATH, "rb") as key_file:
+                self._check(key_file.read())
+        except OSError:
+            pass
+        self.next_rotate_ms = time.ticks_ms()
+        self.group_task = aio.create_task(self.run())
+
+    def ready(self) -> bool:
+        return self.keyring.current is not None
+
+    def rotate(self):
+        """Make and send a new group key. Needs the private key."""
+        current = self.keyring.current
+        issued = current.issued + 1 if current is not None else 1
+        update = pack_key_update(self.secret, issued, os.urandom(KEY_LEN))
+        self._use(update + self.badge.crypto.sign(update))
+        self._announce()
+
+    def seal(self, port: int, payload: bytes) -> tuple[int, int, bytes]:
+        """(key ID, counter, tag) to send with a payload from this badge."""
+        if self.keyring.counter >= self.reserved:
+            self.reserved = self.keyring.counter + COUNTER_RESERVE
+            with open(COUNTER_PATH, "wb") as counter_file:
+                counter_file.write(struct.pack(COUNTER_STRUCT, self.keyring.current.issued, self.reserved))
+        return self.keyring.seal(MY_ADDRESS, port, payload)
+
+    def open(self, source: int, port: int, key_id: int, counter: int, tag: bytes, payload: bytes) -> bool:
+        return self.keyring.open(source, port, key_id, counter, tag, payload)
+
+    def _receive_key(self, message: NetworkFrame):
+        self._check(bytes(message.payload_bytes))
+
+    def _check(self, update: bytes):
+        current = self.keyring.current
+        if len(update) <= KEY_UPDATE_LEN:
+            return
+        if current is not None and struct.unpack_from(KEY_UPDATE_STRUCT, update)[0] <= current.issued:
+            return  # Known already, or an old one sent again
+        status = verifier.verify(
+            update[:KEY_UPDATE_LEN], update[KEY_UPDATE_LEN:], lambda status: self._checked(update, status)
+        )
+        self._checked(update, status)
+
+    def _checked(self, update: bytes, status: int):
+        if status == VERIFIED:
+            self._use(update)
+
+    def _use(self, update: bytes):
+        issued, key = unpack_key_update(self.secret, update)
+        if not self.keyring.set_key(issued, key):
+            return
+        print(f"Group key {issued & 0xFF} in use")
+        self.update = update
+        self.reserved = 0
+        try:
+            with open(COUNTER_PATH, "rb") as counter_file:
+                saved_issued, reserved = struct.unpack(COUNTER_STRUCT, counter_file.read())
+            if saved_issued == issued:
+                self.keyring.counter = self.reserved = reserved
+        except (OSError, ValueError):
+            pass
+        with open(KEY_PATH, "wb") as key_file:
+            key_file.write(update)
+
+    def _announce(self):
+        self.next_repeat_ms = time.ticks_add(time.ticks_ms(), KEY_REPEAT_MS)
+        send(
+            NetworkFrame().set_fields(
+                protocol=Protocol(GROUP_KEY.port, GROUP_KEY.name, f"!{len(self.update)}s"),
+                destination=BROADCAST_ADDRESS,
+                ttl=KEY_TTL,
+                payload=(self.update,),
+            )
+        )
+
+    async def run(self):
+        while True:
+            await aio.sleep_ms(UPDATE_MS)
+            if self.rotate_ms <= 0 or self.badge.crypto.private_key is None:
+                continue
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self.next_rotate_ms) >= 0:
+                self.next_rotate_ms = time.ticks_add(now, self.rotate_ms)
+                self.rotate()
+            elif time.ticks_diff(now, self.next_repeat_ms) >= 0:
+                self._announce()
+
+
+# Group authentication singleton
+group = GroupAuth()
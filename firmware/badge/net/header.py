@@ -0,0 +1,244 @@
+"""Compact (v2) BadgeNet headers.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+v1 frames spend 16 bytes on their header. v2 frames leave out the destination of broadcasts,
+shorten addresses to their low 2 bytes when no other badge heard of shares them, and use a varint
+length, which takes a broadcast header down to 12 bytes, or 10 with a short source. They can also
+carry extensions, which v1 has no room for.
+
+A short address is only unique in the sender's own address book, so only frames sent with TTL 0
+use them: those go to neighbors, which heard the sender's full address, and are never relayed to
+badges further away. The checksum covers the full addresses, so a receiver that resolves a short
+address to another badge than the sender meant fails the checksum and drops the frame.
+
+v2 keeps the first syncword byte, and puts 0xA in the high nibble of the second, where v1 always
+has 0xE9, so badges that only speak v1 reject v2 frames as unknown. The low nibble has the v2 flags.
+
+Only the radio sees v2 frames: BadgeNet expands received v2 frames to v1 right away, so the rest
+of the stack, dedup checksums included, works the same for both, and compresses frames back to v2
+right before transmitting them if the net_header_v2 config is on.
+
+# Network (Big) endian
+#
+# Idx: Count: Field
+#  0: 1 byte: 0x07, first byte of the v1 syncword
+#  1: 1 byte: 0xA0 | v2 flags
+#  2: 2 bytes: Checksum (full destination and source address, then everything after TTL field)
+#  4: 1 byte: Flags and TTL, as in v1
+#  5: 1-2 bytes: Payload length, varint
+#  n: 0, 2 or 4 bytes: Destination Address, left out for broadcast
+#  n: 2 or 4 bytes: Source Address
+#  n: 1 byte: Port
+#  n: 1 byte: Seq num
+#  n: If V2_EXTENSIONS, 1 byte length of the extensions, then (type, length, value) of each
+#  n: n bytes: Payload
+"""
+
+import struct
+
+SYNC_BYTE = 0x07
+V2_MARKER = 0xA0
+V2_BROADCAST = 0x01  # No destination, sent to everyone
+V2_SHORT_SOURCE = 0x02
+V2_SHORT_DESTINATION = 0x04
+V2_EXTENSIONS = 0x08
+
+HEADER_LEN = 16  # HEADER_LEN in net/protocols.py
+MAX_FRAME_LEN = 250  # MAX_FRAME_LEN in net/protocols.py
+V1_SYNCWORD = b"\x07\xe9"
+V1_STRUCTURE = "!BBIIBB"  # FRAME_STRUCTURE in net/protocols.py
+
+# Extension types. The TTL a frame was sent with needs none, it's already in the flags and TTL byte.
+EXT_FRAGMENT = 1  # Fragment index and count
+EXT_PRIORITY = 2  # 0 is normal, higher is more urgent
+
+FULL_ADDRESS_INTERVAL_S = 60  # Send each address in full at least this often, so neighbors learn it
+COLLISION = -1
+
+
+def is_v2(frame: bytes) -> bool:
+    return len(frame) > 1 and frame[0] == SYNC_BYTE and frame[1] & 0xF0 == V2_MARKER
+
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_varint(buffer: bytes, offset: int) -> tuple[int, int]:
+    """Returns the value and the offset after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_extensions(extensions: dict[int, bytes]) -> bytes:
+    encoded = bytearray()
+    for ext_type, value in extensions.items():
+        encoded.append(ext_type)
+        encoded.append(len(value))
+        encoded.extend(value)
+    return bytes(encoded)
+
+
+def decode_extensions(encoded: bytes) -> dict[int, bytes]:
+    extensions = {}
+    i = 0
+    while i + 1 < len(encoded):
+        length = encoded[i + 1]
+        extensions[encoded[i]] = bytes(encoded[i + 2 : i + 2 + length])
+        i += 2 + length
+    return extensions
+
+
+class AddressBook:
+    """Full addresses heard recently, by their short (low 2 byte) address.
+
+    An address only gets shortened if no other known address shares its short address, and this
+    badge sent it in full within full_interval_s, so neighbors had the chance to learn it. Neighbors
+    may still know of other badges sharing it, which the checksum over full addresses catches.
+    """
+
+    def __init__(self, my_address: int, max_entries: int = 128, full_interval_s: int = FULL_ADDRESS_INTERVAL_S):
+        self.my_address = my_address
+        self.max_entries = max_entries
+        self.full_interval_s = full_interval_s
+        self.addresses: dict[int, int] = {}  # short: full address or COLLISION, oldest first
+        self.sent_full: dict[int, float] = {}  # full address: time this badge last sent it in full
+        self.learn(my_address)
+
+    def learn(self, address: int):
+        short = address & 0xFFFF
+        known = self.addresses.pop(short, None)
+        if known is None and len(self.addresses) >= self.max_entries:
+            oldest = next(iter(self.addresses))
+            self.sent_full.pop(self.addresses.pop(oldest), None)
+        self.addresses[short] = address if known in (None, address) else COLLISION
+
+    def resolve(self, short: int) -> int | None:
+        """Full address for a short address, or None if it's unknown or ambiguous."""
+        address = self.addresses.get(short)
+        if address is None or address == COLLISION:
+            return None
+        return address
+
+    def can_shorten(self, address: int, now_s: float) -> bool:
+        if self.addresses.get(address & 0xFFFF) != address:
+            return False
+        sent = self.sent_full.get(address)
+        if sent is not None and now_s - sent < self.full_interval_s:
+            return True
+        self.sent_full[address] = now_s
+        return False
+
+
+def checksum_data(destination: int, source: int, body: bytes) -> bytes:
+    """What the v2 checksum covers: the full addresses, then the frame after the TTL field."""
+    return struct.pack("!II", destination, source) + body
+
+
+class HeaderCodec:
+    """Converts frames between the v1 header and the v2 header.
+
+    checksum is the CRC16 (XModem) function that returns an int, like the one in net/protocols.py.
+    """
+
+    def __init__(self, my_address: int, checksum, broadcast_address: int = 0xFFFFFFFF):
+        self.book = AddressBook(my_address)
+        self.checksum = checksum
+        self.broadcast_address = broadcast_address
+        self.bytes_saved = 0
+        self.unresolved = 0  # v2 frames dropped because a short address was unknown or resolved wrong
+
+    def compress(self, frame: bytes, extensions: bytes = b"", now_s: float = 0) -> bytes:
+        """v2 frame for a serialized v1 frame, with encoded extensions."""
+        flags = V2_MARKER
+        destination, source = struct.unpack_from("!II", frame, 6)
+        payload = frame[HEADER_LEN : frame[5]]
+        body = bytearray(encode_varint(len(payload)))
+        neighbors_only = frame[4] & 0x0F == 0  # Not relayed, so only badges that can know us resolve it
+        if destination == self.broadcast_address:
+            flags |= V2_BROADCAST
+        elif neighbors_only and self.book.can_shorten(destination, now_s):
+            flags |= V2_SHORT_DESTINATION
+            body.extend(struct.pack("!H", destination & 0xFFFF))
+        else:
+            body.extend(frame[6:10])
+        if neighbors_only and self.book.can_shorten(source, now_s):
+            flags |= V2_SHORT_SOURCE
+            body.extend(struct.pack("!H", source & 0xFFFF))
+        else:
+            body.extend(frame[10:14])
+        body.append(frame[14])
+        body.append(frame[15])
+        if extensions and len(body) + len(payload) + len(extensions) + 6 <= MAX_FRAME_LEN:
+            flags |= V2_EXTENSIONS
+            body.append(len(extensions))
+            body.extend(extensions)
+        body.extend(payload)
+        checksum = self.checksum(checksum_data(destination, source, body))
+        compressed = bytes((SYNC_BYTE, flags)) + struct.pack("!HB", checksum, frame[4]) + body
+        self.bytes_saved += len(frame) - len(compressed)
+        return compressed
+
+    def expand(self, frame: bytes) -> tuple[bytes, bytes] | None:
+        """v1 frame and encoded extensions for a received v2 frame.
+        Returns None if it's corrupt, or an address in it can't be resolved."""
+        try:
+            flags = frame[1]
+            payload_len, i = decode_varint(frame, 5)
+            if flags & V2_BROADCAST:
+                destination = self.broadcast_address
+            elif flags & V2_SHORT_DESTINATION:
+                destination = self.book.resolve(struct.unpack_from("!H", frame, i)[0])
+                i += 2
+            else:
+                destination = struct.unpack_from("!I", frame, i)[0]
+                i += 4
+            if flags & V2_SHORT_SOURCE:
+                source = self.book.resolve(struct.unpack_from("!H", frame, i)[0])
+                i += 2
+            else:
+                source = struct.unpack_from("!I", frame, i)[0]
+                i += 4
+            port = frame[i]
+            seq_num = frame[i + 1]
+            i += 2
+            extensions = b""
+            if flags & V2_EXTENSIONS:
+                extensions = bytes(frame[i + 1 : i + 1 + frame[i]])
+                i += 1 + frame[i]
+            payload = frame[i : i + payload_len]
+        except (IndexError, ValueError, struct.error):
+            return None
+        if len(payload) != payload_len or HEADER_LEN + payload_len > MAX_FRAME_LEN:
+            return None
+        if destination is None or source is None:
+            self.unresolved += 1
+            return None
+        if struct.unpack_from("!H", frame, 2)[0] != self.checksum(checksum_data(destination, source, frame[5:])):
+            if flags & (V2_SHORT_DESTINATION | V2_SHORT_SOURCE):
+                self.unresolved += 1  # Or corrupt, there's no telling them apart
+            return None
+        self.learn(source, destination)
+        body = struct.pack(V1_STRUCTURE, frame[4], HEADER_LEN + payload_len, destination, source, port, seq_num)
+        body += payload
+        return V1_SYNCWORD + struct.pack("!H", self.checksum(body[1:])) + body, extensions
+
+    def learn(self, source: int, destination: int):
+        """Note the addresses of a received frame."""
+        self.book.learn(source)
+        if destination != self.broadcast_address:
+            self.book.learn(destination)
@@ -1,10 +1,14 @@
+from array import array
 import asyncio
 import binascii
 import collections
 import random
 import sys
+import time
 
 from net.sx1262 import SX1262, CHANNEL_FREE, LORA_DETECTED, ERR_UNKNOWN
+from net._sx126x import SX126X_CMD_GET_RSSI_INST
+from net.phy import PROFILES, DEFAULT_PROFILE, PhyProfile
 from hardware import board
 
 
@@ -23,6 +27,41 @@ from hardware import board
 # Meshtastic Short Fast Freq Slot 68 918.875 MHz, aka ~ST 34
 # Meshtastic Short Slow Freq Slot 75 920.625 MHz, aka ~ST 38
 
+MODEM_LORA = 0
+MODEM_FSK = 1
+
+
+def freq_slot_to_mhz(slot: int) -> float:
+    """Center frequency of a Short Turbo frequency slot."""
+    return 902.250 + (slot - 1) * 0.5
+
+
+class SpectrumSweep:
+    """Settings and results of spectrum sweeps, see LoraRadio.sweep().
+    Reused for every sweep so sweeping doesn't allocate. Results are in rssi, one dBm value per channel."""
+
+    def __init__(self, start_mhz: float, step_mhz: float, channels: int, dwell_ms: int = 2):
+        self.start_mhz = start_mhz
+        self.step_mhz = step_mhz
+        self.channels = channels
+        self.dwell_ms = dwell_ms  # Time in RX on each channel for the PLL to lock and RSSI to settle
+        self.rssi = array("f", [-128.0] * channels)
+        self.count = 0  # Completed sweeps
+        self.sweeps_per_s = 0.0
+        self.last_sweep_ms = 0
+
+    def frequency(self, channel: int) -> float:
+        return self.start_mhz + channel * self.step_mhz
+
+    def finished(self):
+        now = time.ticks_ms()
+        if self.count:
+            elapsed_ms = max(1, time.ticks_diff(now, self.last_sweep_ms))
+            # Smooth, since the event loop makes individual sweep times jittery
+            self.sweeps_per_s += (1000 / elapsed_ms - self.sweeps_per_s) / 4
+        self.last_sweep_ms = now
+        self.count += 1
+
 
 class LoraRadio:
     def __init__(self, tx_led=None, tx_power=9):
@@ -30,14 +69,16 @@ class LoraRadio:
         # https://meshtastic.org/docs/overview/radio-settings/
         self.freq_slot = 9
         self.frequency = 906.250  # MHz: 902 to 928, 904.125 is freq slot 9
-        self.bandwidth = 500.0  # 250000  # kHz: 31000, 125000, or 250000
+        # Modulation comes from a named PHY profile, see net/phy.py
+        self.profile: PhyProfile = PROFILES[DEFAULT_PROFILE]
+        self.bandwidth = self.profile.bw_khz  # kHz: 31000, 125000, or 250000
         self.coding_rate = (
-            5  # 4/x bit redundancy, increases reliability but decreases datarate: 5 - 8
+            self.profile.cr  # 4/x bit redundancy, increases reliability but decreases datarate: 5 - 8
         )
         self.spreading_factor = (
-            7  # 1<<x num chirps per symbol, each step doubles airtime, adds 2.5dB: 7-12
+            self.profile.sf  # 1<<x num chirps per symbol, each step doubles airtime, adds 2.5dB: 7-12
         )
-        self.preamble_length = 16
+        self.preamble_length = self.profile.preamble_len
         self.crc = True
         self.tx_power = tx_power
         self.sync_word = 0x12
@@ -46,47 +87,66 @@ class LoraRadio:
 
         self.last_snr: float = 0.0
         self.last_rssi: float = 0.0
+        self.last_rx_us: int = 0  # ticks_us() when the last frame finished arriving
         self._message_ready = asyncio.ThreadSafeFlag()  # type: ignore
         self._ready_for_tx = asyncio.ThreadSafeFlag()  # type: ignore
+        self._tx_done = asyncio.ThreadSafeFlag()  # type: ignore
         self._rx_queue: collections.deque = collections.deque([], 30)
         self.tx_led = tx_led
 
+        # Exclusive ownership, for things like bulk transfers that reconfigure the radio.
+        # While held, received frames go to the owner instead of the network stack.
+        self.lock = asyncio.Lock()
+        self.exclusive = False
+        self.modem = MODEM_LORA
+        self.implicit_len = 0  # Nonzero while in implicit header mode
+        self._owner_message_ready = asyncio.ThreadSafeFlag()  # type: ignore
+        self._owner_rx_queue: collections.deque = collections.deque([], 10)
+        self._rssi_inst_buf = bytearray(1)
+        self._rssi_inst_mv = memoryview(self._rssi_inst_buf)
+
         try:
             print("Initializing SX1262...")
             self.radio = SX1262(
                 spi_host=2, sck=8, mosi=3, miso=9, cs=17, irq=16, rst=18, gpio=15
             )
             self.rf_sw = board.RF_SW
-            self.radio.begin(
-                freq=self.frequency,
-                bw=self.bandwidth,
-                sf=self.spreading_factor,
-                cr=self.coding_rate,
-                syncWord=self.sync_word,
-                power=self.tx_power,
-                currentLimit=60,
-                preambleLength=self.preamble_length,
-                implicit=False,
-                implicitLen=0xFF,
-                crcOn=self.crc,
-                txIq=False,
-                rxIq=False,
-                tcxoVoltage=1.7,
-                useRegulatorLDO=False,
-                blocking=True,
-            )
-            self.radio.setPaConfig(
-                *self.rf_power_levels[self.power_level]
-            )  ## datasheet p. 76
-            self.radio.setBlockingCallback(False, self._handle_events)
+            self._begin_lora()
         except Exception as ex:
             print(f"Failed to configure radio: {ex}")
             sys.print_exception(ex)
             self.radio = None
             self.fake_rx_buffer = collections.deque([], 3)
 
+    def _begin_lora(self):
+        self.radio.begin(
+            freq=self.frequency,
+            bw=self.bandwidth,
+            sf=self.spreading_factor,
+            cr=self.coding_rate,
+            syncWord=self.sync_word,
+            power=self.tx_power,
+            currentLimit=60,
+            preambleLength=self.preamble_length,
+            implicit=False,
+            implicitLen=0xFF,
+            crcOn=self.crc,
+            txIq=False,
+            rxIq=False,
+            tcxoVoltage=1.7,
+            useRegulatorLDO=False,
+            blocking=True,
+        )
+        self.radio.setPaConfig(
+            *self.rf_power_levels[self.power_level]
+        )  ## datasheet p. 76
+        self.radio.setBlockingCallback(False, self._handle_events)
+        self.modem = MODEM_LORA
+        self.implicit_len = 0
+
     def _handle_events(self, events):
         if events & SX1262.RX_DONE:
+            rx_us = time.ticks_us()  # Before reading the frame, for accurate time sync
             msg, err = self.radio.recv()
             self._ready_for_tx.set()  # Done with an Rx operations, so allow Tx
             error = SX1262.STATUS[err]
@@ -94,19 +154,26 @@ class LoraRadio:
                 # print(f"Lora Error: {error}")
                 return
             self.last_rssi = self.radio.getRSSI()
-            self.last_snr = self.radio.getSNR()
-            self._rx_queue.append(msg)
+            if self.exclusive:
+                self._owner_rx_queue.append(msg)
+                self._owner_message_ready.set()
+                return
+            # Keep signal quality with each frame, so it still matches when the frame is processed
+            self._rx_queue.append((msg, self.last_rssi, self.radio.getSNR(), rx_us))
             self._message_ready.set()
         elif events & SX1262.TX_DONE:
             if self.tx_led:
                 self.tx_led.value(0)
             self._rf_sw_rx()
             self._ready_for_tx.clear()
+            self._tx_done.set()
 
     async def recv(self) -> bytes | None:
+        """Wait for the next received frame. get_rssi(), get_snr() and get_rx_ms() then describe this frame."""
         if self.radio:
-            await self._message_ready.wait()
-            data = self._rx_queue.popleft()
+            if not self._rx_queue:
+                await self._message_ready.wait()
+            data, self.last_rssi, self.last_snr, self.last_rx_us = self._rx_queue.popleft()
             # print(f"RX:<{binascii.b2a_base64(data, newline=False).decode()}>")
             return data
         return None
@@ -114,31 +181,185 @@ class LoraRadio:
     async def send(self, packet: bytes):
         # print(f"TX:<{binascii.b2a_base64(packet, newline=False).decode()}>")
         if self.radio:
-            # Detect a free RF channel before transmitting
-            channel_status = LORA_DETECTED
-            while channel_status != CHANNEL_FREE:
-                # try:
-                #     # Don't interrupt Rx
-                #     await asyncio.wait_for(self._ready_for_tx.wait(), 2)
-                # except asyncio.TimeoutError:
-                #     # Unless nothing is being received, then go ahead and Tx
-                #     pass
-                channel_status = self.radio.scanChannel()
-                if channel_status == ERR_UNKNOWN:
-                    print("SX126X error scanning channel")
-                if channel_status == LORA_DETECTED:
-                    print(".", end="")
-                else:
-                    # If busy, sleep a random 0-10ms
-                    await asyncio.sleep(random.random() / 100)
-                # channel_status = CHANNEL_FREE
+            await self._wait_channel_free()
             print(">", end="")
-            self._rf_sw_tx()
-            if self.tx_led:
-                self.tx_led.value(1)
-            self.radio.send(packet)
+            self._start_tx(packet)
+        return None
+
+    async def _wait_channel_free(self):
+        # Detect a free RF channel before transmitting
+        channel_status = LORA_DETECTED
+        while channel_status != CHANNEL_FREE:
+            # try:
+            #     # Don't interrupt Rx
+            #     await asyncio.wait_for(self._ready_for_tx.wait(), 2)
+            # except asyncio.TimeoutError:
+            #     # Unless nothing is being received, then go ahead and Tx
+            #     pass
+            channel_status = self.radio.scanChannel()
+            if channel_status == ERR_UNKNOWN:
+                print("SX126X error scanning channel")
+            if channel_status == LORA_DETECTED:
+                print(".", end="")
+            else:
+                # If busy, sleep a random 0-10ms
+                await asyncio.sleep(random.random() / 100)
+            # channel_status = CHANNEL_FREE
+
+    def _start_tx(self, packet: bytes):
+        self._tx_done.clear()
+        self._rf_sw_tx()
+        if self.tx_led:
+            self.tx_led.value(1)
+        self.radio.send(packet)
+
+    async def acquire(self):
+        """Take exclusive ownership of the radio. Blocks the network stack from transmitting,
+        and diverts received frames to recv_exclusive() until release() is called."""
+        await self.lock.acquire()
+        self._owner_rx_queue.clear()
+        self.exclusive = True
+
+    def release(self):
+        """Give up exclusive ownership of the radio. Restores LoRa mode if it was changed."""
+        if self.radio and self.modem != MODEM_LORA:
+            self.restore_lora()
+        elif self.radio and self.implicit_len:
+            self.set_explicit_header()
+        self.exclusive = False
+        self._owner_rx_queue.clear()
+        self.lock.release()
+
+    async def send_exclusive(self, packet: bytes | None, timeout_ms: int = 500, prepare=None) -> bool:
+        """Transmit while holding exclusive ownership, and wait until it is on air.
+        Channel activity detection only works for LoRa, so it is skipped in FSK mode.
+        For frames carrying a timestamp, pass prepare() instead of packet. It's called after
+        channel access, right before transmitting, and returns the packet to send."""
+        if not self.radio:
+            return False
+        if self.modem == MODEM_LORA:
+            await self._wait_channel_free()
+        if prepare is not None:
+            packet = prepare()
+        self._start_tx(packet)
+        try:
+            await asyncio.wait_for_ms(self._tx_done.wait(), timeout_ms)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def recv_exclusive(self, timeout_ms: int) -> bytes | None:
+        """Receive a frame while holding exclusive ownership. Returns None on timeout."""
+        if not self.radio:
+            return None
+        if not self._owner_rx_queue:
+            try:
+                await asyncio.wait_for_ms(self._owner_message_ready.wait(), timeout_ms)
+            except asyncio.TimeoutError:
+                return None
+        if self._owner_rx_queue:
+            return self._owner_rx_queue.popleft()
         return None
 
+    def begin_fsk(self, freq: float, bitrate: float, freq_dev: float, rx_bw: float, sync_word: list):
+        """Switch the radio to GFSK. Only use while holding exclusive ownership."""
+        self.radio.beginFSK(
+            freq=freq,
+            br=bitrate,
+            freqDev=freq_dev,
+            rxBw=rx_bw,
+            power=self.tx_power,
+            currentLimit=60,
+            preambleLength=16,
+            dataShaping=0.5,
+            syncWord=sync_word,
+            syncBitsLength=8 * len(sync_word),
+            crcLength=2,
+            tcxoVoltage=1.7,
+            useRegulatorLDO=False,
+            blocking=True,
+        )
+        self.radio.setPaConfig(*self.rf_power_levels[self.power_level])
+        self.modem = MODEM_FSK
+        self.radio.setBlockingCallback(False, self._handle_events)
+
+    async def set_profile(self, profile: PhyProfile):
+        """Change modulation to a PHY profile. Waits until the radio isn't transmitting or owned."""
+        async with self.lock:
+            self.profile = profile
+            self.spreading_factor = profile.sf
+            self.bandwidth = profile.bw_khz
+            self.coding_rate = profile.cr
+            self.preamble_length = profile.preamble_len
+            if not self.radio:
+                return
+            self.radio.standby()
+            self.radio.setSpreadingFactor(profile.sf)
+            self.radio.setBandwidth(profile.bw_khz)
+            self.radio.setCodingRate(profile.cr)
+            self.radio.setPreambleLength(profile.preamble_len)
+            self.radio.startReceive()
+        print(f"Radio now using PHY profile {profile.name}")
+
+    async def set_tx_power(self, power: int):
+        """Change transmit power in dBm, -9 to 22. Waits until the radio isn't transmitting or owned."""
+        async with self.lock:
+            self.tx_power = power
+            if not self.radio:
+                return
+            self.radio.standby()
+            self.radio.setOutputPower(power)
+            self.radio.setPaConfig(*self.rf_power_levels[self.power_level])
+            self.radio.startReceive()
+
+    async def sweep(self, sweep: SpectrumSweep) -> bool:
+        """Measure instantaneous RSSI on every channel of a sweep, into sweep.rssi.
+        Takes exclusive ownership for one sweep, so the network stack pauses while it runs, then
+        returns to the BadgeNet frequency and receive mode. Returns False if there's no radio."""
+        if not self.radio:
+            return False
+        await self.acquire()
+        try:
+            self.radio.standby()
+            # Image calibration covers the whole 902-928MHz band, so only calibrate once
+            self.radio.setFrequency(sweep.frequency(0))
+            for channel in range(sweep.channels):
+                self.radio.standby()
+                self.radio.setFrequency(sweep.frequency(channel), calibrate=False)
+                self.radio.setRx(0)
+                await asyncio.sleep_ms(sweep.dwell_ms)
+                self.radio.SPIreadCommand([SX126X_CMD_GET_RSSI_INST], 1, self._rssi_inst_mv, 1)
+                sweep.rssi[channel] = -self._rssi_inst_buf[0] / 2
+        finally:
+            self.radio.standby()
+            self.radio.setFrequency(self.frequency)
+            self.radio.startReceive()
+            self.release()
+        sweep.finished()
+        return True
+
+    def set_implicit_header(self, length: int, sync_word: int):
+        """Switch LoRa to implicit header mode with a fixed frame length and a different sync word.
+        Only use while holding exclusive ownership. Explicit header frames can't be received until
+        set_explicit_header() or release() is called."""
+        self.radio.standby()
+        self.radio.implicitHeader(length)
+        self.radio.setSyncWord(sync_word)
+        self.radio.startReceive()
+        self.implicit_len = length
+
+    def set_explicit_header(self):
+        """Return to the BadgeNet explicit header mode and sync word."""
+        self.radio.standby()
+        self.radio.explicitHeader()
+        self.radio.setSyncWord(self.sync_word)
+        self.radio.startReceive()
+        self.implicit_len = 0
+
+    def restore_lora(self):
+        """Return the radio to the BadgeNet LoRa settings."""
+        self._begin_lora()
+
     def get_rssi(self) -> float:
         if self.radio:
             return self.last_rssi
@@ -149,6 +370,11 @@ class LoraRadio:
             return self.last_snr
         return float("-inf")
 
+    def get_rx_ms(self) -> int:
+        """Local ticks_ms() when the last received frame finished arriving."""
+        age_us = time.ticks_diff(time.ticks_us(), self.last_rx_us)
+        return time.ticks_add(time.ticks_ms(), -(age_us // 1000))
+
     def _rf_sw_tx(self):
         self.rf_sw.value(0)
 
@@ -160,7 +386,7 @@ class LoraRadio:
             raise ValueError(
                 "Invalid frequency slot. Must be in [1, 52] and not [2, 7, 10, 23, 26, 34, 38, 50] (Meshtastic defaults)"
             )
-        freq_mhz = 902.250 + (slot - 1) * 0.5
+        freq_mhz = freq_slot_to_mhz(slot)
         print(f"Trying to set radio to slot {slot} at {freq_mhz} MHz")
         self.radio.setFrequency(freq_mhz)
         self.freq_slot = slot
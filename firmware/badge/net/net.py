@@ -2,6 +2,7 @@
 
 from collections import deque
 import machine  # type: ignore
+import random
 import struct
 import sys
 import time
@@ -14,12 +15,60 @@ from net.protocols import (
     MAX_FRAME_LEN,
     NULL_PROTO,
     CHECKSUM_OFFSET,
+    crc_calculator,
 )
+from net.dtn import RECENTLY_HEARD_S, StoreForwardCache
+from net.header import HeaderCodec, is_v2
+from net.netcode import CODED_HEADER_LEN, NetworkCoder
+from net.ratelimit import SourceRateLimiter
+from net.relay_policy import DELAY, DROP, RATE_LIMIT, RelayPolicy
+from net.ttl import HopTable, hops_taken
 
 # For an event the size of supercon, there's ~50% chance of address collision with a 2-byte address. 4 is virtually 0.
 MY_ADDRESS = int.from_bytes(machine.unique_id()[2:6], "big")
 BROADCAST_ADDRESS = 0xFFFFFFFF  # Broadcast address for all nodes
 RECENT_MESSAGE_EXPIRATION_S = 6000
+# Outcomes of send()
+SEND_QUEUED = 0
+SEND_TRANSMITTED = 1
+SEND_DROPPED = 2  # Rejected because the port's quota or the queue was full, or failed to send
+SEND_EXPIRED = 3  # Not sent before its expiry
+DTN_FORWARD_INTERVAL_MS = 500  # Between frames forwarded from the store-and-forward cache
+DTN_FORWARD_JITTER_MS = 2000  # Most to wait before the first, so other badges holding them can hear it and skip it
+NET_CODED = Protocol(port=25, name="NET_CODED", structdef=f"!{CODED_HEADER_LEN}s")  # Variable length, see net/netcode.py
+
+
+class SendHandle:
+    """Outcome of a frame passed to send(). Check state, or await wait() for it to be decided."""
+
+    def __init__(self, port: int, expires_ms: int | None = None):
+        self.port = port
+        self.state = SEND_QUEUED
+        self.tx_ms: int | None = None  # ticks_ms() when it went on air
+        self.deadline_ms = None if expires_ms is None else time.ticks_add(time.ticks_ms(), expires_ms)
+        self._done = aio.Event()
+
+    def done(self) -> bool:
+        return self.state != SEND_QUEUED
+
+    def expired(self, now_ms: int) -> bool:
+        return self.deadline_ms is not None and time.ticks_diff(now_ms, self.deadline_ms) >= 0
+
+    def finish(self, state: int):
+        self.state = state
+        self._done.set()
+
+    async def wait(self, timeout_ms: int | None = None) -> int:
+        """Wait until the frame is transmitted, dropped or expired, and return the state.
+        Returns SEND_QUEUED if timeout_ms passes first."""
+        if timeout_ms is None:
+            await self._done.wait()
+        else:
+            try:
+                await aio.wait_for_ms(self._done.wait(), timeout_ms)
+            except aio.TimeoutError:
+                pass
+        return self.state
 
 
 class BadgeNet:
@@ -29,6 +78,21 @@ class BadgeNet:
         self.transmit_queue_max_len = 20
         self.transmit_queue: deque[NetworkFrame] = deque([], self.transmit_queue_max_len)
         self.receive_callbacks: dict[int, list] = {}
+        self.variable_length_ports: set[int] = set()  # Payloads may run past the structdef
+        self.port_loaders: dict = {}  # port: function loading the app that receives it, see apps/registry.py
+        self.frame_observers: list = []
+        self.mac = None  # Optional medium access control that schedules transmissions, see net/tdma_manager.py
+        self.coder: NetworkCoder | None = None  # Optional XOR coding of relays, enabled with the net_coding config
+        self.hop_table = HopTable()
+        self.adaptive_ttl = True
+        self.dtn: StoreForwardCache | None = None  # Optional store-and-forward of unicast, enabled with the net_dtn config
+        self.rate_limiter = SourceRateLimiter()
+        self.relay_policy = RelayPolicy(MY_ADDRESS)
+        self.header = HeaderCodec(MY_ADDRESS, crc_calculator.checksum)  # v2 frames are always understood
+        self.header_v2 = False  # Transmit v2 frames
+        self.send_quota = 4  # Frames queued at once per port
+        self.queued_per_port: dict[int, int] = {}
+        self._send_finished = aio.Event()
         self.protocols: dict[int, Protocol] = {0: NULL_PROTO}
         self.seen_nodes: dict[int, str] = {}
         self.capture_all_packets: bool = False
@@ -46,6 +110,28 @@ class BadgeNet:
     def init(self, badge):
         self.badge = badge
         self.send_cooldown_s = self.badge.send_cooldown_ms / 1000
+        self.register_protocol(NET_CODED)
+        self.adaptive_ttl = badge.config.get("net_adaptive_ttl", b"true") == b"true"
+        try:
+            self.rate_limiter = SourceRateLimiter(
+                float(badge.config.get("net_relay_rate", b"2")), int(badge.config.get("net_relay_burst", b"10"))
+            )
+        except ValueError:
+            print("Invalid net_relay_rate or net_relay_burst, using defaults")
+        self.relay_policy = RelayPolicy(MY_ADDRESS, badge.config.get("net_relay_rules", b"").decode())
+        try:
+            self.send_quota = int(badge.config.get("net_send_quota", b"4"))
+        except ValueError:
+            pass
+        self.header_v2 = badge.config.get("net_header_v2", b"false") == b"true"
+        if badge.config.get("net_coding", b"false") == b"true":
+            self.coder = NetworkCoder(crc_calculator.checksum)
+        if badge.config.get("net_dtn", b"false") == b"true":
+            try:
+                self.dtn = StoreForwardCache(int(badge.config.get("net_dtn_frames", b"16")))
+            except ValueError:
+                print("Invalid net_dtn_frames, using default")
+                self.dtn = StoreForwardCache()
         self.lora_rx_task = aio.create_task(self.recv_all())
         self.lora_tx_task = aio.create_task(self.send_all())
         self.flush_recently_seen_cache_task = aio.create_task(
@@ -82,15 +168,28 @@ class BadgeNet:
                     f"Redefining protocol at port {port} from {self.protocols[port]} to {protocol}."
                 )
 
-    def register_receiver(self, protocol: Protocol, callback=None):
-        """Registers a function to be called when a message is received for this badge in the specified protocol."""
+    def register_receiver(self, protocol: Protocol, callback=None, variable_length: bool = False):
+        """Registers a function to be called when a message is received for this badge in the specified protocol.
+        With variable_length, the structdef is just the start of the payload, and longer payloads are passed on too."""
         port = protocol.port
+        if variable_length:
+            self.variable_length_ports.add(port)
         if callback is not None:
             if port not in self.receive_callbacks:
                 self.receive_callbacks[port] = []
             self.receive_callbacks[port].append(callback)
         self.register_protocol(protocol)
 
+    def register_loader(self, port: int, loader):
+        """Call loader() when a frame arrives on a port nothing receives yet, before passing the frame on."""
+        self.port_loaders[port] = loader
+
+    def register_observer(self, callback):
+        """Registers a function to be called with every valid frame received, before duplicates are
+        filtered out and before it is deserialized. Used by the network stack to collect link statistics.
+        badge.lora.get_rssi() and get_snr() describe the frame during the call."""
+        self.frame_observers.append(callback)
+
     async def recv_all(self):
         while True:
             try:
@@ -101,50 +200,197 @@ class BadgeNet:
                     # snr = self.badge.lora.get_snr()
                     # print("rssi: ", rssi)
                     # print("snr: ", snr)
+                    extensions = b""
+                    if is_v2(frame):
+                        expanded = self.header.expand(frame)
+                        if expanded is None:
+                            continue
+                        frame, extensions = expanded
                     try:
                         message = NetworkFrame().set_frame(frame).validate_frame()
+                        message.extensions = extensions
                         # print(f"Received frame {repr(message)}")
                     except (ValueError, IndexError) as err:
                         print(f"Failed validation {repr(frame)}: {err}")
                         continue
 
+                    for observer in self.frame_observers:
+                        observer(message)
+
+                    if message.validated_frame:
+                        self.header.learn(message.source, message.destination)
+                    hops = hops_taken(message.frame[4])
+                    if hops is not None:
+                        self.hop_table.record(message.source, hops, time.time())
+                    if self.dtn is not None and hops == 0 and message.validated_frame and self.dtn.holds_for(message.source):
+                        # Heard directly, so whatever is held for it can reach it now
+                        aio.create_task(self._forward_stored(self.dtn.take(message.source, time.time())))
+
                     if self.capture_all_packets and len(message.frame):
                         self.promiscuous_queue.append(message)
-                    # Check if messages haven't been seen before and add them to the transmit queue for repeating
-                    seen_checksum = struct.unpack(
-                        "!H", message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
-                    )[0]
-                    seen_count, seen_timestamp = self.recently_seen_messages.get(seen_checksum, (0, time.time()))
-                    self.recently_seen_messages[seen_checksum] = (seen_count + 1, seen_timestamp)
-                    # print(f"Seen {seen_checksum} @ {seen_timestamp} x {seen_count}")
-                    if seen_count == 0:
-                        # Check how many times this has been recently seen, and if not, add it to the tx queue
-                        retransmit_message = message.check_for_retransmit(MY_ADDRESS)
-                        if retransmit_message and len(self.transmit_queue) < self.transmit_queue_max_len // 2:
-                            # Decrement TTL and re-transmit if not expired (done in check_for_retransmit)
-                            self.transmit_queue.append(retransmit_message)
-                    else:
-                        # This message has been seen before, no need to reprocess it
-                        continue
-                    message.deserialize(self.protocols)
-                    # print(f"Decoded frame {repr(message)}")
-                    if message.check_for_me(MY_ADDRESS, BROADCAST_ADDRESS):
-                        if message.port in self.receive_callbacks and len(
-                            message.payload_bytes
-                        ) == struct.calcsize(message.protocol.structdef):
-                            # If multiple protocols are defined on the same port by different badges, only
-                            # send the message to the app if it matches the app's protocol definition for this port.
-                            for callback in self.receive_callbacks[message.port]:
-                                try:
-                                    callback(message)
-                                except Exception as ex:
-                                    print(f"Exception in callback for message in protocol {message.protocol.name}")
-                                    sys.print_exception(ex)
+                    decoded = []
+                    if self.coder is not None:
+                        if message.port == NET_CODED.port:
+                            decoded = self.coder.record_coded(message.frame[HEADER_LEN:], message.source)
+                        else:
+                            decoded = self.coder.record_native(message.frame)
+                    self.handle_frame(message)
+                    for frame in decoded:
+                        # Recovered from a coded frame, so it's handled like it was received on its own
+                        try:
+                            native = NetworkFrame().set_frame(frame).validate_frame()
+                        except (ValueError, IndexError) as err:
+                            print(f"Failed validation of decoded {repr(frame)}: {err}")
+                            continue
+                        if native.validated_frame:
+                            self.handle_frame(native)
             except Exception as exc:
                 print("Recv error:", exc)
                 raise
             await aio.sleep(0.001)
 
+    def handle_frame(self, message: NetworkFrame):
+        """Queue a received frame for relaying and pass it to receivers, unless it was seen before."""
+        # Check if messages haven't been seen before and add them to the transmit queue for repeating
+        seen_checksum = struct.unpack(
+            "!H", message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
+        )[0]
+        seen_count, seen_timestamp = self.recently_seen_messages.get(seen_checksum, (0, time.time()))
+        if seen_count == 0:
+            # Check how many times this has been recently seen, and if not, add it to the tx queue
+            action = self.relay_policy.evaluate(message.frame, self.protocols, self.port_loaders)
+            retransmit_message = None
+            if action != DROP:
+                retransmit_message = message.check_for_retransmit(MY_ADDRESS)
+            if retransmit_message and action == RATE_LIMIT and not self.rate_limiter.allow(message.source, time.ticks_ms()):
+                # Source is flooding, so still deliver it here but don't relay it
+                retransmit_message = None
+            if retransmit_message and action == DELAY:
+                aio.create_task(self._relay_later(retransmit_message, self.relay_policy.arg))
+            elif retransmit_message and len(self.transmit_queue) < self.transmit_queue_max_len // 2:
+                # Decrement TTL and re-transmit if not expired (done in check_for_retransmit)
+                self.transmit_queue.append(retransmit_message)
+            if (
+                self.dtn is not None
+                and message.destination not in (MY_ADDRESS, BROADCAST_ADDRESS)
+                and message.source != MY_ADDRESS
+                and not self._recently_heard(message.destination)
+            ):
+                self.dtn.store(message.destination, message.frame, time.time())
+        self.recently_seen_messages[seen_checksum] = (seen_count + 1, seen_timestamp)
+        # print(f"Seen {seen_checksum} @ {seen_timestamp} x {seen_count}")
+        if seen_count:
+            # This message has been seen before, no need to reprocess it
+            return
+        if message.port in self.port_loaders and message.port not in self.receive_callbacks:
+            # The app registers its receivers as it starts, so this frame reaches it already
+            self.port_loaders.pop(message.port)()
+        message.deserialize(self.protocols)
+        # print(f"Decoded frame {repr(message)}")
+        if message.check_for_me(MY_ADDRESS, BROADCAST_ADDRESS):
+            payload_len = len(message.payload_bytes)
+            structdef_len = struct.calcsize(message.protocol.structdef)
+            if message.port in self.receive_callbacks and (
+                payload_len == structdef_len
+                or (payload_len > structdef_len and message.port in self.variable_length_ports)
+            ):
+                # If multiple protocols are defined on the same port by different badges, only
+                # send the message to the app if it matches the app's protocol definition for this port.
+                for callback in self.receive_callbacks[message.port]:
+                    try:
+                        callback(message)
+                    except Exception as ex:
+                        print(f"Exception in callback for message in protocol {message.protocol.name}")
+                        sys.print_exception(ex)
+
+    def _send_full(self, port: int) -> bool:
+        return (
+            self.queued_per_port.get(port, 0) >= self.send_quota
+            or len(self.transmit_queue) >= self.transmit_queue_max_len
+        )
+
+    def send(self, message: NetworkFrame, expires_ms: int | None = None) -> SendHandle:
+        """Queue a frame from this badge. Rejected at once, as SEND_DROPPED, if its port already has
+        send_quota frames queued. If expires_ms is given, it's dropped as SEND_EXPIRED if it can't go out
+        within that time."""
+        handle = SendHandle(message.port, expires_ms)
+        if self._send_full(message.port):
+            handle.finish(SEND_DROPPED)
+            return handle
+        self.queued_per_port[message.port] = self.queued_per_port.get(message.port, 0) + 1
+        message.send_handle = handle
+        self.transmit_queue.append(message)
+        return handle
+
+    async def send_blocking(self, message: NetworkFrame, expires_ms: int | None = None) -> SendHandle:
+        """Like send(), but waits for room in the port's quota instead of rejecting."""
+        while self._send_full(message.port):
+            self._send_finished.clear()
+            await self._send_finished.wait()
+        return self.send(message, expires_ms)
+
+    def _finish_send(self, message: NetworkFrame, state: int):
+        handle = message.send_handle
+        if handle is None:
+            return
+        message.send_handle = None
+        self.queued_per_port[handle.port] -= 1
+        if state == SEND_TRANSMITTED:
+            handle.tx_ms = time.ticks_ms()
+        handle.finish(state)
+        self._send_finished.set()
+
+    async def _relay_later(self, message: NetworkFrame, delay_ms: int):
+        await aio.sleep_ms(delay_ms)
+        # Skipped in send_all() if others relayed it meanwhile
+        if len(self.transmit_queue) < self.transmit_queue_max_len // 2:
+            self.transmit_queue.append(message)
+
+    def _recently_heard(self, address: int) -> bool:
+        entry = self.hop_table.hops.get(address)
+        return entry is not None and time.time() - entry[1] < RECENTLY_HEARD_S
+
+    async def _forward_stored(self, frames: list[bytes]):
+        """Send frames from the store-and-forward cache to their destination, which was just heard directly.
+        They go out with TTL 0, relays already saw them and would drop them."""
+        forwards = [NetworkFrame().set_frame(frame[:4] + bytes((frame[4] & 0xF0,)) + frame[5:]) for frame in frames]
+        for forward in forwards:
+            # Seen again after this means another badge holding it forwarded it
+            checksum = struct.unpack("!H", forward.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2])[0]
+            self.recently_seen_messages[checksum] = (1, time.time())
+        await aio.sleep_ms(random.randrange(DTN_FORWARD_JITTER_MS))
+        for forward in forwards:
+            if self._seen_count(forward) > 1:
+                continue
+            while len(self.transmit_queue) >= self.transmit_queue_max_len // 2:
+                await aio.sleep_ms(DTN_FORWARD_INTERVAL_MS)
+            self.transmit_queue.append(forward)
+            await aio.sleep_ms(DTN_FORWARD_INTERVAL_MS)
+
+    def _seen_count(self, message: NetworkFrame) -> int:
+        checksum = struct.unpack("!H", message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2])[0]
+        return self.recently_seen_messages.get(checksum, (0, 0))[0]
+
+    def _code_relays(self, message: NetworkFrame) -> NetworkFrame:
+        """Combine a relay with the next queued relay into one NET_CODED frame if the coder allows it."""
+        while self.transmit_queue and self.transmit_queue[0].frame and self._seen_count(self.transmit_queue[0]) > 1:
+            self._finish_send(self.transmit_queue.popleft(), SEND_DROPPED)  # Would be dropped anyway
+        if not self.transmit_queue:
+            return message
+        partner = self.transmit_queue[0]
+        if partner.source in (0, MY_ADDRESS) or not self.coder.can_code(message.frame, partner.frame):
+            return message
+        self.transmit_queue.popleft()
+        payload = self.coder.encode(message.frame, partner.frame)
+        coded = NetworkFrame().set_fields(
+            protocol=Protocol(NET_CODED.port, NET_CODED.name, f"!{len(payload)}s"),
+            destination=BROADCAST_ADDRESS,
+            source=MY_ADDRESS,
+            payload=payload,
+        )
+        coded.serialize()
+        return coded
+
     async def send_all(self):
         while True:
             if self.transmit_queue:
@@ -153,8 +399,17 @@ class BadgeNet:
                     message = None
                     while message is None:
                         message = self.transmit_queue.popleft()
+                        if message.send_handle is not None and message.send_handle.expired(time.ticks_ms()):
+                            self._finish_send(message, SEND_EXPIRED)
+                            message = None
+                            continue
                         if message.source == 0:  # Not set yet
                             message.source = MY_ADDRESS
+                            if self.adaptive_ttl and not message.frame:
+                                # Only as far as the destination, or the farthest badge heard from
+                                message.ttl = self.hop_table.ttl_for(
+                                    message.destination, message.ttl, BROADCAST_ADDRESS, time.time()
+                                )
                         message.serialize()
                         checksum = struct.unpack(
                             "!H", message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
@@ -165,6 +420,8 @@ class BadgeNet:
                             #     f"Dropping recently repeated message with checksum {checksum:x} before transmit."
                             # )
                             # print(self.recently_seen_messages)
+                            self._finish_send(message, SEND_DROPPED)
+                            message = None
                             continue
                         # else:
                         #     print(f"New message from {message.source:x} with checksum {checksum:x}")
@@ -173,16 +430,40 @@ class BadgeNet:
                         # Check if the Tx queue is too full, and if it is, stop relaying messages in favor of local messages
                         # Throw out the relayed messages until the queue is more empty
                         if len(self.transmit_queue) > self.transmit_queue_max_len // 2 and message.source != MY_ADDRESS:
+                            self._finish_send(message, SEND_DROPPED)
                             message = None
                             continue
                     time_since_last_tx = time.time() - self.last_tx_time
                     if time_since_last_tx < self.transmit_cooldown_s:
                         await aio.sleep(self.transmit_cooldown_s - time_since_last_tx)
+                    if self.mac is not None:
+                        await self.mac.wait_for_slot(len(message.frame))
+                    if self.coder is not None and message.source != MY_ADDRESS:
+                        # More relays may have been queued, or this one heard from others, while waiting
+                        if self._seen_count(message) > 1:
+                            self._finish_send(message, SEND_DROPPED)
+                            continue
+                        message = self._code_relays(message)
+                    frame = message.frame
+                    if self.header_v2:
+                        frame = self.header.compress(frame, message.extensions, time.time())
                     try:
-                        await self.badge.lora.send(message.frame)
+                        # Wait for any exclusive radio owner (e.g. a bulk transfer) to finish
+                        async with self.badge.lora.lock:
+                            await self.badge.lora.send(frame)
                     except Exception as err:
                         print(f"Failed sending: {err}")
+                        self._finish_send(message, SEND_DROPPED)
                         continue
+                    self._finish_send(message, SEND_TRANSMITTED)
+                    if (
+                        self.dtn is not None
+                        and message.source == MY_ADDRESS
+                        and message.destination != BROADCAST_ADDRESS
+                        and not self._recently_heard(message.destination)
+                    ):
+                        # Held too, in case the destination is asleep or out of range
+                        self.dtn.store(message.destination, message.frame, time.time())
                     self.last_tx_time = time.time()
                     if self.capture_all_packets:
                         self.promiscuous_queue.append(message)
@@ -190,6 +471,10 @@ class BadgeNet:
                         2,
                         self.last_tx_time,
                     )  # type: ignore
+                    if message.port == NET_CODED.port:
+                        # Both coded frames are out now
+                        for checksum in struct.unpack_from("!HH", message.frame, HEADER_LEN):
+                            self.recently_seen_messages[checksum] = (2, self.last_tx_time)
                 except IndexError:
                     await aio.sleep(1)
                     continue
@@ -203,6 +488,8 @@ class BadgeNet:
             #     f"Badgenet: Purging messages from recently seen cache, initial len {len(self.recently_seen_messages)}"
             # )
             now = time.time()
+            if self.dtn is not None:
+                self.dtn.expire(now)
             self.recently_seen_messages = {
                 checksum: count_time_seen
                 for checksum, count_time_seen in self.recently_seen_messages.items()
@@ -215,9 +502,15 @@ class BadgeNet:
 badgenet = BadgeNet()
 
 
-def register_receiver(protocol: Protocol, callback=None):
-    """Register a callback for incoming messages on a specific port."""
-    badgenet.register_receiver(protocol, callback)
+def register_receiver(protocol: Protocol, callback=None, variable_length: bool = False):
+    """Register a callback for incoming messages on a specific port. With variable_length, payloads
+    longer than the protocol's structdef are passed on too, for protocols whose structdef is only a header."""
+    badgenet.register_receiver(protocol, callback, variable_length)
+
+
+def register_loader(port: int, loader):
+    """Load an app when the first frame arrives on a port it receives. Used by apps/registry.py."""
+    badgenet.register_loader(port, loader)
 
 
 def register_protocol(protocol: Protocol):
@@ -226,9 +519,14 @@ def register_protocol(protocol: Protocol):
     badgenet.register_protocol(protocol)
 
 
-def send(message: NetworkFrame):
-    """Send a message to the network"""
-    badgenet.transmit_queue.append(message)
+def send(message: NetworkFrame, expires_ms: int | None = None) -> SendHandle:
+    """Send a message to the network. Returns a SendHandle to check or await the outcome."""
+    return badgenet.send(message, expires_ms)
+
+
+async def send_blocking(message: NetworkFrame, expires_ms: int | None = None) -> SendHandle:
+    """Send a message to the network, waiting for room in its port's queue quota."""
+    return await badgenet.send_blocking(message, expires_ms)
 
 
 def capture_all_packets(enabled: bool):
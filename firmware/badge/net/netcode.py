@@ -0,0 +1,166 @@
+"""XOR network coding of relayed frames.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+A relay holding two frames from different origins can send them XORed together in one NET_CODED
+frame. An origin already has its own frame, so it recovers the other one from the coded frame, and
+so does any other badge that already has either of them. Badges holding neither keep the coded
+frame in a small buffer, and decode it once one of the two arrives on its own.
+
+Frames are XORed with the flags and TTL byte cleared, since copies of the same message differ only
+there, and the coded payload carries both frames' flags and TTL bytes so they can be restored.
+
+BadgeNet frames only name their origin, not the badge that relayed them, so the holders this badge
+knows about are each frame's origin and the sources of coded frames, which hold both of their
+frames. A pair is only coded when neither origin is known to already hold the other frame.
+"""
+
+import struct
+
+SYNCWORD = b"\x07\xe9"  # SYNCWORD in net/protocols.py
+HEADER_LEN = 16  # HEADER_LEN in net/protocols.py
+MAX_FRAME_LEN = 250  # MAX_FRAME_LEN in net/protocols.py
+CHECKSUM_OFFSET = 2
+TTL_OFFSET = 4
+SOURCE_OFFSET = 10
+
+CODED_STRUCT = "!HHBBBB"  # Checksum, length and flags/TTL byte of each native frame
+CODED_HEADER_LEN = struct.calcsize(CODED_STRUCT)
+MAX_NATIVE_LEN = MAX_FRAME_LEN - HEADER_LEN - CODED_HEADER_LEN
+
+
+def frame_checksum(frame: bytes) -> int:
+    return (frame[CHECKSUM_OFFSET] << 8) | frame[CHECKSUM_OFFSET + 1]
+
+
+def frame_source(frame: bytes) -> int:
+    return int.from_bytes(frame[SOURCE_OFFSET : SOURCE_OFFSET + 4], "big")
+
+
+class NetworkCoder:
+    """Codes pairs of relayed frames, and decodes received coded frames.
+
+    Memory is bounded: max_natives recent frames are kept to decode against, max_pending coded
+    frames wait for one of their frames, and holders are tracked for max_holders checksums.
+
+    checksum is the CRC16 (XModem) function that returns an int, like the one in net/protocols.py,
+    used to check recovered frames. Frames are only looked up by their 16 bit checksum, so a
+    collision or a malformed coded frame recovers garbage. With None, only the sync word and
+    length are checked.
+    """
+
+    def __init__(self, checksum=None, max_natives: int = 16, max_pending: int = 8, max_holders: int = 64):
+        self.checksum = checksum
+        self.max_natives = max_natives
+        self.max_pending = max_pending
+        self.max_holders = max_holders
+        self.natives: dict[int, bytes] = {}  # checksum: frame
+        self.pending: list[bytes] = []  # Coded payloads that can't be decoded yet
+        self.holders: dict[int, list[int]] = {}  # checksum: addresses known to hold the frame
+        self.coded_sent = 0  # Frames saved by coding
+        self.decoded = 0
+        self.corrupt = 0  # Recovered frames that failed their checks
+
+    def _add_holder(self, checksum: int, address: int):
+        holders = self.holders.get(checksum)
+        if holders is None:
+            if len(self.holders) >= self.max_holders:
+                del self.holders[next(iter(self.holders))]
+            self.holders[checksum] = [address]
+        elif address not in holders and len(holders) < 4:
+            holders.append(address)
+
+    def holds(self, address: int, checksum: int) -> bool:
+        return address in self.holders.get(checksum, ())
+
+    def record_native(self, frame: bytes) -> list[bytes]:
+        """Keep a newly seen frame to decode against. Returns frames it decodes from buffered
+        coded frames."""
+        checksum = frame_checksum(frame)
+        self._add_holder(checksum, frame_source(frame))
+        if checksum in self.natives or len(frame) > MAX_NATIVE_LEN:
+            return []
+        if len(self.natives) >= self.max_natives:
+            del self.natives[next(iter(self.natives))]
+        self.natives[checksum] = frame
+        decoded = []
+        for payload in [payload for payload in self.pending if checksum in struct.unpack_from("!HH", payload)]:
+            if payload in self.pending:  # Decoding may have used it already
+                self.pending.remove(payload)
+                decoded.extend(self.record_coded(payload, None))
+        return decoded
+
+    def record_coded(self, payload: bytes, coder: int | None) -> list[bytes]:
+        """Decode a NET_CODED payload from coder. Returns the frames it recovered, which then need to be
+        validated and handled as if they were received."""
+        if len(payload) < CODED_HEADER_LEN:
+            return []
+        first, second, first_len, second_len, first_ttl, second_ttl = struct.unpack_from(CODED_STRUCT, payload)
+        if coder is not None:
+            self._add_holder(first, coder)
+            self._add_holder(second, coder)
+        known = self.natives.get(first)
+        if known is not None:
+            length, ttl = second_len, second_ttl
+        else:
+            known = self.natives.get(second)
+            length, ttl = first_len, first_ttl
+        if known is None:
+            if len(self.pending) >= self.max_pending:
+                self.pending.pop(0)
+            self.pending.append(payload)
+            return []
+        other = frame_checksum(known) ^ first ^ second
+        if other in self.natives or length > len(payload) - CODED_HEADER_LEN or length < HEADER_LEN:
+            return []
+        recovered = bytearray(payload[CODED_HEADER_LEN : CODED_HEADER_LEN + length])
+        for i in range(min(length, len(known))):
+            recovered[i] ^= known[i]
+        recovered[TTL_OFFSET] = ttl
+        recovered = bytes(recovered)
+        if (
+            recovered[:2] != SYNCWORD
+            or recovered[5] != length
+            or frame_checksum(recovered) != other
+            or (self.checksum is not None and self.checksum(recovered[5:]) != other)
+        ):
+            self.corrupt += 1
+            return []
+        self.decoded += 1
+        return [recovered] + self.record_native(recovered)
+
+    def can_code(self, first: bytes, second: bytes) -> bool:
+        """If two pending relays should go out as one coded frame."""
+        if len(first) > MAX_NATIVE_LEN or len(second) > MAX_NATIVE_LEN:
+            return False
+        first_source = frame_source(first)
+        second_source = frame_source(second)
+        if first_source == second_source:
+            return False
+        # An origin that already has the other frame gains nothing from the coded frame
+        return not self.holds(first_source, frame_checksum(second)) and not self.holds(
+            second_source, frame_checksum(first)
+        )
+
+    def encode(self, first: bytes, second: bytes) -> bytes:
+        """NET_CODED payload combining two frames."""
+        coded = bytearray(CODED_HEADER_LEN + max(len(first), len(second)))
+        struct.pack_into(
+            CODED_STRUCT,
+            coded,
+            0,
+            frame_checksum(first),
+            frame_checksum(second),
+            len(first),
+            len(second),
+            first[TTL_OFFSET],
+            second[TTL_OFFSET],
+        )
+        body = memoryview(coded)[CODED_HEADER_LEN:]
+        for frame in (first, second):
+            for i in range(len(frame)):
+                body[i] ^= frame[i]
+        body[TTL_OFFSET] = 0
+        self.coded_sent += 1
+        return bytes(coded)
@@ -0,0 +1,149 @@
+"""LoRa physical layer settings and airtime calculations.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+from collections import namedtuple
+import math
+
+PhyProfile = namedtuple(
+    "PhyProfile", ("name", "sf", "bw_khz", "cr", "preamble_len", "min_snr", "sensitivity_dbm")
+)
+
+# Ordered fastest to most robust. min_snr and sensitivity_dbm are the SX1262 demodulation limits.
+PROFILES = (
+    PhyProfile("turbo", 6, 500.0, 5, 8, -5.0, -112.0),
+    PhyProfile("fast", 7, 500.0, 5, 16, -7.5, -117.0),
+    PhyProfile("robust", 9, 250.0, 7, 16, -12.5, -127.0),
+)
+DEFAULT_PROFILE = 1  # Every badge boots on, and falls back to, this profile
+
+EXPLICIT_HEADER_BITS = 20  # Bits the explicit LoRa header adds to the payload bit count
+LORA_CRC_BITS = 16
+
+
+def symbol_time_us(sf: int, bw_khz: float) -> float:
+    """Duration of one LoRa symbol in microseconds."""
+    return (1000 << sf) / bw_khz
+
+
+def time_on_air_us(
+    payload_len: int,
+    sf: int = 7,
+    bw_khz: float = 500.0,
+    cr: int = 5,
+    preamble_len: int = 16,
+    explicit_header: bool = True,
+    crc: bool = True,
+) -> int:
+    """Time on air of a LoRa packet in microseconds, per the SX126X datasheet section 6.1.4.
+    Matches SX126X.getTimeOnAir() but doesn't need a radio.
+    Args:
+        payload_len: Bytes handed to the radio
+        sf: Spreading factor, 5-12
+        bw_khz: Bandwidth in kHz
+        cr: Coding rate denominator, 4/x for x in 5-8
+        preamble_len: Preamble length in symbols
+        explicit_header: False for implicit header mode
+        crc: If the LoRa payload CRC is enabled
+    """
+    symbol_us = symbol_time_us(sf, bw_khz)
+    if sf in (5, 6):
+        coeff1_x4 = 25
+        coeff2 = 0
+    else:
+        coeff1_x4 = 17
+        coeff2 = 8
+    # Low data rate optimization is turned on automatically for symbols of 16ms or longer
+    divisor = 4 * (sf - 2) if symbol_us >= 16000 else 4 * sf
+    bits = 8 * payload_len + (LORA_CRC_BITS if crc else 0) - 4 * sf + coeff2
+    if explicit_header:
+        bits += EXPLICIT_HEADER_BITS
+    bits = max(0, bits)
+    coded_symbols = (bits + divisor - 1) // divisor
+    symbols_x4 = (preamble_len + 8) * 4 + coeff1_x4 + coded_symbols * cr * 4
+    return int(symbol_us * symbols_x4 / 4)
+
+
+def profile_index(name: str) -> int:
+    for index, profile in enumerate(PROFILES):
+        if profile.name == name:
+            return index
+    raise ValueError(f"Unknown PHY profile {name}")
+
+
+class RateController:
+    """Picks the fastest PHY profile that still delivers reliably.
+
+    Signal quality of recently received frames is kept in fixed size rings, and the weak end
+    (a low percentile) is compared against each profile's demodulation limits plus a margin.
+    Delivery ratios of acknowledged unicast traffic per peer push towards more robust profiles
+    when links are losing frames even though signal quality looks fine.
+    """
+
+    def __init__(self, margin_db: float = 5.0, history_len: int = 32, max_peers: int = 16):
+        self.margin_db = margin_db
+        self.history_len = history_len
+        self.max_peers = max_peers
+        self.snr_history = [0.0] * history_len
+        self.rssi_history = [0.0] * history_len
+        self.history_count = 0
+        self.history_index = 0
+        self.measured_bw_khz = PROFILES[DEFAULT_PROFILE].bw_khz
+        self.peer_acks: dict[int, list] = {}  # peer: [delivered, attempts]
+        self.min_ack_samples = 8
+        self.min_delivery_ratio = 0.7
+
+    def record_frame(self, rssi: float, snr: float, bw_khz: float):
+        """Record the signal quality of a received frame, measured at bandwidth bw_khz."""
+        if bw_khz != self.measured_bw_khz:
+            # Noise floor changes with bandwidth, so old measurements aren't comparable
+            self.history_count = 0
+            self.history_index = 0
+            self.measured_bw_khz = bw_khz
+        self.snr_history[self.history_index] = snr
+        self.rssi_history[self.history_index] = rssi
+        self.history_index = (self.history_index + 1) % self.history_len
+        self.history_count = min(self.history_count + 1, self.history_len)
+
+    def record_ack(self, peer: int, delivered: bool):
+        """Record if a unicast frame to peer was acknowledged."""
+        stats = self.peer_acks.pop(peer, None)
+        if stats is None:
+            stats = [0, 0]
+            if len(self.peer_acks) >= self.max_peers:
+                # Dicts keep insertion order, so the first peer is the least recently updated
+                del self.peer_acks[next(iter(self.peer_acks))]
+        stats[0] += 1 if delivered else 0
+        stats[1] += 1
+        if stats[1] >= 4 * self.min_ack_samples:
+            stats[0] //= 2
+            stats[1] //= 2
+        self.peer_acks[peer] = stats
+
+    def _low_percentile(self, history: list) -> float:
+        recent = sorted(history[: self.history_count])
+        return recent[len(recent) // 10]
+
+    def needed_profile(self, current: int) -> int:
+        """Index of the fastest profile the recent links can support. Returns current if unsure."""
+        if self.history_count < self.history_len // 2:
+            return current
+        snr = self._low_percentile(self.snr_history)
+        rssi = self._low_percentile(self.rssi_history)
+        needed = len(PROFILES) - 1
+        for index, profile in enumerate(PROFILES):
+            # Narrower bandwidth lets in less noise, improving SNR
+            profile_snr = snr + 10 * math.log10(self.measured_bw_khz / profile.bw_khz)
+            if (
+                profile_snr >= profile.min_snr + self.margin_db
+                and rssi >= profile.sensitivity_dbm + self.margin_db
+            ):
+                needed = index
+                break
+        for delivered, attempts in self.peer_acks.values():
+            if attempts >= self.min_ack_samples and delivered < self.min_delivery_ratio * attempts:
+                # Losing frames on a link, so don't go faster than now, and step up if possible
+                needed = max(needed, min(current + 1, len(PROFILES) - 1))
+        return needed
@@ -0,0 +1,206 @@
+"""PHY profile manager with an adaptive data rate controller.
+
+Badges can only hear each other on the same PHY profile, so profile changes are coordinated with
+PHY_SWITCH announcements, relayed across the whole mesh, that name a profile and a delay before switching.
+When several proposals overlap, the most robust one wins, so a badge at the edge of range can veto a
+switch to a faster profile just by proposing the profile it needs.
+
+Each badge feeds its RateController with the signal quality of every frame it hears, and with ACK
+statistics for unicast peers. It asks for a more robust profile as soon as links need one, and only
+proposes a faster profile after it has looked safe for several evaluation periods in a row.
+
+A badge that switches to a non-default profile expects to hear back from the badges it heard just
+before, and from the peers that acknowledged its unicast traffic. If most of them stay quiet after
+the switch, or acknowledgements stop, or it hears nothing at all for a while, it falls back to the
+default profile, which every badge boots on. So badges that missed a switch, or run firmware that
+can't switch, aren't cut off for good.
+
+Adaptive switching is off unless the phy_adaptive config is true.
+
+Transmit power is adjusted by a TxPowerController fed from the same frames, within the configured
+radio_tx_power_min and radio_tx_power_max, when radio_tx_power_auto is true. Without
+radio_tx_power_max, it never goes above radio_tx_power.
+"""
+
+import asyncio as aio  # type: ignore
+import time
+
+from net.net import BROADCAST_ADDRESS, badgenet, register_receiver, send
+from net.phy import DEFAULT_PROFILE, PROFILES, RateController
+from net.protocols import CHECKSUM_OFFSET, NetworkFrame, Protocol
+from net.ttl import MAX_TTL
+from net.txpower import TX_POWER_MIN_DBM, TxPowerController
+
+PHY_SWITCH = Protocol(port=23, name="PHY_SWITCH", structdef="!BH")  # profile index, delay ms
+
+SWITCH_DELAY_MS = 5000
+SWITCH_TTL = MAX_TTL  # Every badge on the mesh has to hear it, or the mesh splits in two
+EVALUATE_PERIOD_MS = 30000
+FASTER_VOTES_NEEDED = 3
+LOST_TIMEOUT_MS = 120000
+CONFIRM_MS = 30000  # To hear back from the badges heard before a switch
+CONFIRM_RATIO = 0.5  # Of them that have to be heard, or the switch is undone
+ACK_LOST_MS = 60000  # Without a delivered acknowledgement on a non-default profile, while some fail
+RECENT_SOURCES = 32
+TX_POWER_PERIOD_MS = 20000
+
+
+class PhyManager:
+    """Coordinates PHY profile switches between badges."""
+
+    def __init__(self):
+        self.controller = RateController()
+        self.adaptive = True
+        self.current = DEFAULT_PROFILE
+        self.pending: int | None = None
+        self.pending_deadline_ms = 0
+        self.faster_votes = 0
+        self.last_heard_ms = 0
+        self.last_evaluate_ms = 0
+        self.power_controller: TxPowerController | None = None
+        self.last_power_update_ms = 0
+        self.recent_sources: dict[int, int] = {}  # source: ticks_ms() last heard, oldest first
+        self.expected: set[int] = set()  # Sources to hear back from after the last switch
+        self.confirmed: set[int] = set()
+        self.confirm_deadline_ms = 0
+        self.last_ack_ms = 0
+        self.acks_lost = False
+        self.manager_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        self.adaptive = badge.config.get("phy_adaptive", b"false") == b"true"
+        self.last_heard_ms = self.last_evaluate_ms = self.last_power_update_ms = time.ticks_ms()
+        if badge.config.get("radio_tx_power_auto", b"false") == b"true":
+            try:
+                min_dbm = int(badge.config.get("radio_tx_power_min", b"%d" % TX_POWER_MIN_DBM))
+                max_dbm = int(badge.config.get("radio_tx_power_max", b"%d" % badge.lora.tx_power))
+            except ValueError:
+                min_dbm, max_dbm = TX_POWER_MIN_DBM, badge.lora.tx_power
+            self.power_controller = TxPowerController(badge.lora.tx_power, min_dbm, max_dbm)
+        badgenet.register_observer(self._observe_frame)
+        register_receiver(PHY_SWITCH, self._receive_switch)
+        self.manager_task = aio.create_task(self.run())
+
+    def record_ack(self, peer: int, delivered: bool):
+        """Report if a unicast message to peer was acknowledged, for apps with their own ACKs."""
+        self.controller.record_ack(peer, delivered)
+        now = time.ticks_ms()
+        if delivered:
+            self.last_ack_ms = now
+        elif self.current != DEFAULT_PROFILE and time.ticks_diff(now, self.last_ack_ms) > ACK_LOST_MS:
+            self.acks_lost = True
+
+    def _observe_frame(self, message: NetworkFrame):
+        lora = self.badge.lora
+        self.controller.record_frame(lora.get_rssi(), lora.get_snr(), lora.bandwidth)
+        self.last_heard_ms = time.ticks_ms()
+        self.recent_sources.pop(message.source, None)
+        if len(self.recent_sources) >= RECENT_SOURCES:
+            del self.recent_sources[next(iter(self.recent_sources))]
+        self.recent_sources[message.source] = self.last_heard_ms
+        if message.source in self.expected:
+            self.confirmed.add(message.source)
+        if self.power_controller is not None:
+            checksum = int.from_bytes(message.frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2], "big")
+            # Observers run before the network stack counts this copy
+            duplicate = checksum in badgenet.recently_seen_messages
+            self.power_controller.record_frame(lora.get_rssi(), duplicate)
+
+    def _schedule(self, profile: int, delay_ms: int):
+        if self.pending is None or profile > self.pending:
+            self.pending = profile
+            self.pending_deadline_ms = time.ticks_add(time.ticks_ms(), delay_ms)
+
+    def _receive_switch(self, message: NetworkFrame):
+        profile, delay_ms = message.payload
+        if profile >= len(PROFILES):
+            return
+        self._schedule(profile, min(delay_ms, SWITCH_DELAY_MS))
+        if self.adaptive:
+            needed = self.controller.needed_profile(self.current)
+            if needed > self.pending:
+                # Too fast for this badge's links, so veto with the profile it needs
+                self.announce(needed)
+
+    def announce(self, profile: int):
+        """Propose switching every badge in range to a profile."""
+        self._schedule(profile, SWITCH_DELAY_MS)
+        remaining_ms = max(0, time.ticks_diff(self.pending_deadline_ms, time.ticks_ms()))
+        send(
+            NetworkFrame().set_fields(
+                protocol=PHY_SWITCH,
+                destination=BROADCAST_ADDRESS,
+                ttl=SWITCH_TTL,
+                payload=(self.pending, remaining_ms),
+            )
+        )
+
+    async def _switch(self, profile: int):
+        now = time.ticks_ms()
+        self.expected = set()
+        if profile != DEFAULT_PROFILE:
+            # Badges heard lately should follow, and be heard again on the new profile
+            self.expected = {
+                source
+                for source, heard_ms in self.recent_sources.items()
+                if time.ticks_diff(now, heard_ms) < 2 * EVALUATE_PERIOD_MS
+            }
+        self.confirmed = set()
+        self.confirm_deadline_ms = time.ticks_add(now, CONFIRM_MS)
+        self.current = profile
+        self.faster_votes = 0
+        self.last_heard_ms = self.last_ack_ms = now
+        self.acks_lost = False
+        await self.badge.lora.set_profile(PROFILES[profile])
+
+    def _unconfirmed(self, now: int) -> bool:
+        """If too few of the badges heard before the last switch have been heard since."""
+        if not self.expected or time.ticks_diff(now, self.confirm_deadline_ms) < 0:
+            return False
+        expected, confirmed = len(self.expected), len(self.confirmed)
+        self.expected = set()
+        return confirmed < CONFIRM_RATIO * expected
+
+    def _evaluate(self):
+        needed = self.controller.needed_profile(self.current)
+        if needed > self.current:
+            self.announce(needed)
+        elif needed < self.current:
+            self.faster_votes += 1
+            if self.faster_votes >= FASTER_VOTES_NEEDED:
+                self.faster_votes = 0
+                self.announce(needed)
+        else:
+            self.faster_votes = 0
+
+    async def run(self):
+        while True:
+            await aio.sleep_ms(500)
+            now = time.ticks_ms()
+            if self.pending is not None and time.ticks_diff(now, self.pending_deadline_ms) >= 0:
+                profile = self.pending
+                self.pending = None
+                if profile != self.current:
+                    await self._switch(profile)
+            elif self.current != DEFAULT_PROFILE and time.ticks_diff(now, self.last_heard_ms) > LOST_TIMEOUT_MS:
+                print("Nothing heard on this PHY profile, falling back to the default")
+                await self._switch(DEFAULT_PROFILE)
+            elif self.current != DEFAULT_PROFILE and self._unconfirmed(now):
+                print("Most badges didn't follow the PHY profile switch, falling back to the default")
+                await self._switch(DEFAULT_PROFILE)
+            elif self.current != DEFAULT_PROFILE and self.acks_lost:
+                print("Acknowledgements stopped on this PHY profile, falling back to the default")
+                await self._switch(DEFAULT_PROFILE)
+            elif self.adaptive and self.pending is None and time.ticks_diff(now, self.last_evaluate_ms) > EVALUATE_PERIOD_MS:
+                self.last_evaluate_ms = now
+                self._evaluate()
+            elif self.power_controller is not None and time.ticks_diff(now, self.last_power_update_ms) > TX_POWER_PERIOD_MS:
+                self.last_power_update_ms = now
+                power = self.power_controller.update()
+                if power != self.badge.lora.tx_power:
+                    await self.badge.lora.set_tx_power(power)
+
+
+# PHY profile manager singleton
+phy_manager = PhyManager()
@@ -26,7 +26,7 @@ Protocol = namedtuple("Protocol", ("port", "name", "structdef"))
 #  0: 2 bytes: Header 0x07E9 (2025)
 #  2: 2 bytes: Checksum (everything in packet after TTL field)
 #  4: 1 byte: Flags and TTL
-## bits 7-4: Reserved
+## bits 7-4: TTL the frame was sent with, so receivers can tell the hops it took (0 from older badges)
 ## bits 3-0: TTL
 #  5: 1 byte: Packet length [16-250]
 #  6: 4 bytes: Destination Address
@@ -61,6 +61,8 @@ class NetworkFrame:
         self.timestamp: int = 0
         self.validated_frame: bool = False
         self.fields_set: bool = False
+        self.send_handle = None  # SendHandle from net.send(), while queued
+        self.extensions: bytes = b""  # Encoded v2 header extensions, see net/header.py
 
     def __repr__(self):
         if self.fields_set:
@@ -149,7 +151,7 @@ class NetworkFrame:
             print(
                 f"Warning: frame truncated due to being longer [{frame_actual_len}] than reported length [{frame_claimed_len}]."
             )
-        claimed_checksum = frame[2:4]
+        claimed_checksum = (frame[2] << 8) | frame[3]
         calced_checksum = crc_calculator.checksum(frame[5:])
         self.validated_frame = claimed_checksum == calced_checksum
         return self
@@ -157,7 +159,7 @@ class NetworkFrame:
     def serialize(self) -> bytes:
         if self.frame:
             return self.frame
-        flags_ttl = 0 | self.ttl
+        flags_ttl = (self.ttl << 4) | self.ttl
         if isinstance(self.payload, (tuple, list)) and self.payload:
             payload = struct.pack(self.protocol.structdef, *self.payload)
         elif isinstance(self.payload_bytes, bytes):
@@ -260,7 +262,9 @@ class NetworkFrame:
             #     "!H", new_frame[CHECKSUM_OFFSET : CHECKSUM_OFFSET + 2]
             # )[0]
             # print(f"Queueing {repr(new_frame)} for retransmit. TTL was {ttl} is {new_ttl_byte}. Checksum: {checksum:x}")
-            return NetworkFrame().set_frame(new_frame)
+            relay = NetworkFrame().set_frame(new_frame)
+            relay.extensions = self.extensions
+            return relay
         return None
 
     def check_for_me(self, my_address: int, broadcast_address: int):
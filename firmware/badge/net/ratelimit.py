@@ -0,0 +1,47 @@
+"""Per-source rate limiting of relays.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Every new frame that would be relayed takes a token from its source's bucket, which refills at
+rate_per_s up to burst. A source that runs out is throttled: its frames are still delivered to apps
+on this badge, but not relayed, so one flooding badge can't fill every relay queue in range.
+"""
+
+from net.ticks import ticks_diff
+
+
+class SourceRateLimiter:
+    """Token buckets for the max_sources most recently heard sources."""
+
+    def __init__(self, rate_per_s: float = 2.0, burst: int = 10, max_sources: int = 32):
+        self.rate_per_ms = rate_per_s / 1000
+        self.burst = burst
+        self.max_sources = max_sources
+        self.buckets: dict[int, list] = {}  # source: [tokens, last refill ms, frames throttled], oldest first
+        self.throttled_total = 0
+
+    def allow(self, source: int, now_ms: int) -> bool:
+        """Take a token for a frame from source. Returns False if it should not be relayed."""
+        bucket = self.buckets.pop(source, None)
+        if bucket is None:
+            if len(self.buckets) >= self.max_sources:
+                # Forget the least recently heard source
+                del self.buckets[next(iter(self.buckets))]
+            bucket = [self.burst, now_ms, 0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + ticks_diff(now_ms, bucket[1]) * self.rate_per_ms)
+            bucket[1] = now_ms
+        self.buckets[source] = bucket  # Most recently heard last
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        bucket[2] += 1
+        self.throttled_total += 1
+        return False
+
+    def throttled_sources(self) -> list[tuple[int, int]]:
+        """(source, frames not relayed) for tracked sources that were throttled, most throttled first."""
+        throttled = [(source, bucket[2]) for source, bucket in self.buckets.items() if bucket[2]]
+        throttled.sort(key=lambda entry: entry[1], reverse=True)
+        return throttled
@@ -0,0 +1,132 @@
+"""Relay policy rules, matched against raw frame headers.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Each received frame that could be relayed is checked against the rules in order, and the first
+rule that matches decides what happens to it. Matching only reads header bytes, and doesn't
+allocate, since it runs for every frame heard. Rules are kept in one flat array of small ints.
+
+Rules from the net_relay_rules config are checked before the defaults, separated by ';':
+    <action>[:<ms>] [port=<n>[-<n>]] [dst=broadcast|unicast|self] [ttl=<n>[-<n>]] [src=<hex>] [known=yes|no]
+where action is relay, drop, delay (by ms) or limit (per-source rate limit), and known matches if
+this badge has a protocol registered for the port, or an installed app declares it and isn't loaded
+yet. For example:
+    drop port=129 ttl=4-15; delay:300 port=6
+"""
+
+from array import array
+
+# Actions
+RELAY = 0
+DROP = 1
+DELAY = 2
+RATE_LIMIT = 3
+ACTIONS = {"relay": RELAY, "drop": DROP, "delay": DELAY, "limit": RATE_LIMIT}
+
+# Destination classes
+DST_BROADCAST = 1
+DST_UNICAST = 2
+DST_SELF = 4
+DST_ANY = DST_BROADCAST | DST_UNICAST | DST_SELF
+DESTINATIONS = {"broadcast": DST_BROADCAST, "unicast": DST_UNICAST, "self": DST_SELF}
+
+# Port known to this badge
+KNOWN_ANY = 0
+KNOWN_YES = 1
+KNOWN_NO = 2
+
+# Layout of a rule in the array
+PORT_LO, PORT_HI, DST_MASK, TTL_LO, TTL_HI, KNOWN, SRC_ANY, SRC0, SRC1, SRC2, SRC3, ACTION, ARG = range(13)
+RULE_LEN = 13
+
+DEFAULT_RULES = (
+    # App ports nobody here knows, sent to flood far, are most likely junk
+    "drop port=128-255 known=no ttl=7-15",
+    "limit",
+)
+
+
+def parse_rule(text: str) -> list[int]:
+    """Parse one rule. Raises ValueError if it's malformed."""
+    words = text.split()
+    if not words:
+        raise ValueError("Empty rule")
+    action, _, arg = words[0].partition(":")
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown relay action {action}")
+    rule = [0, 255, DST_ANY, 0, 15, KNOWN_ANY, 1, 0, 0, 0, 0, ACTIONS[action], int(arg) if arg else 0]
+    for word in words[1:]:
+        key, _, value = word.partition("=")
+        if key in ("port", "ttl"):
+            low, _, high = value.partition("-")
+            offset = PORT_LO if key == "port" else TTL_LO
+            rule[offset] = int(low)
+            rule[offset + 1] = int(high) if high else int(low)
+        elif key == "dst":
+            rule[DST_MASK] = DESTINATIONS[value]
+        elif key == "src":
+            address = int(value, 16)
+            rule[SRC_ANY] = 0
+            rule[SRC0 : SRC3 + 1] = [(address >> shift) & 0xFF for shift in (24, 16, 8, 0)]
+        elif key == "known":
+            rule[KNOWN] = KNOWN_YES if value == "yes" else KNOWN_NO
+        else:
+            raise ValueError(f"Unknown relay rule field {key}")
+    return rule
+
+
+class RelayPolicy:
+    def __init__(self, my_address: int, config_rules: str = ""):
+        self.my_address = [(my_address >> shift) & 0xFF for shift in (24, 16, 8, 0)]
+        self.rules = array("i")
+        self.arg = 0  # Argument of the last matched rule, e.g. the delay in ms
+        for text in config_rules.split(";"):
+            if text.strip():
+                try:
+                    self.rules.extend(parse_rule(text))
+                except (ValueError, KeyError) as err:
+                    print(f"Ignoring relay rule '{text}': {err}")
+        for text in DEFAULT_RULES:
+            self.rules.extend(parse_rule(text))
+
+    def _destination_class(self, frame: bytes) -> int:
+        if frame[6] == 0xFF and frame[7] == 0xFF and frame[8] == 0xFF and frame[9] == 0xFF:
+            return DST_BROADCAST
+        address = self.my_address
+        if frame[6] == address[0] and frame[7] == address[1] and frame[8] == address[2] and frame[9] == address[3]:
+            return DST_SELF
+        return DST_UNICAST
+
+    def evaluate(self, frame: bytes, known_ports: dict, declared_ports: dict = ()) -> int:
+        """Action for a received frame. known_ports holds the ports with a registered protocol, and
+        declared_ports those of apps that load when a frame arrives for them, see apps/registry.py.
+        The matched rule's argument is left in self.arg."""
+        rules = self.rules
+        port = frame[14]
+        ttl = frame[4] & 0x0F
+        destination = self._destination_class(frame)
+        known = KNOWN_YES if port in known_ports or port in declared_ports else KNOWN_NO
+        i = 0
+        end = len(rules)
+        while i < end:
+            if (
+                rules[i + PORT_LO] <= port <= rules[i + PORT_HI]
+                and rules[i + DST_MASK] & destination
+                and rules[i + TTL_LO] <= ttl <= rules[i + TTL_HI]
+                and (rules[i + KNOWN] == KNOWN_ANY or rules[i + KNOWN] == known)
+                and (
+                    rules[i + SRC_ANY]
+                    or (
+                        frame[10] == rules[i + SRC0]
+                        and frame[11] == rules[i + SRC1]
+                        and frame[12] == rules[i + SRC2]
+                        and frame[13] == rules[i + SRC3]
+                    )
+                )
+            ):
+                self.arg = rules[i + ARG]
+                return rules[i + ACTION]
+            i += RULE_LEN
+        self.arg = 0
+        return RELAY
@@ -0,0 +1,206 @@
+"""Building blocks of multiplayer game sessions.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Times are milliseconds on MicroPython's ticks_ms() clock, passed in rather than read here, see
+net/ticks.py. net/session_manager.py puts these together into sessions over BadgeNet.
+"""
+
+import struct
+
+from net.ticks import ticks_add, ticks_diff
+
+SEQ_MASK = 0xFFFF
+
+
+def seq_before(a: int, b: int) -> bool:
+    """If 16 bit sequence number a comes before b, allowing for wrap around."""
+    return a != b and ((b - a) & SEQ_MASK) < 0x8000
+
+
+class BeaconBackoff:
+    """When to send lobby beacons. Starts at min_ms, so badges nearby find a new lobby quickly,
+    and doubles up to max_ms while nothing changes. reset() when something does."""
+
+    def __init__(self, now_ms: int, min_ms: int = 500, max_ms: int = 8000):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.interval_ms = min_ms
+        self.next_ms = now_ms
+
+    def reset(self, now_ms: int):
+        self.interval_ms = self.min_ms
+        self.next_ms = now_ms
+
+    def due(self, now_ms: int) -> bool:
+        if ticks_diff(now_ms, self.next_ms) < 0:
+            return False
+        self.next_ms = ticks_add(now_ms, self.interval_ms)
+        self.interval_ms = min(self.max_ms, self.interval_ms * 2)
+        return True
+
+
+class ReliableChannel:
+    """Reliable, ordered delivery of events to and from one peer.
+
+    Events are numbered, and kept until acknowledged, at most window of them. Acknowledgements are
+    cumulative, the next sequence number expected, and ride along on events going the other way.
+    """
+
+    def __init__(self, window: int = 8, retry_ms: int = 400, max_tries: int = 8):
+        self.window = window
+        self.retry_ms = retry_ms
+        self.max_tries = max_tries
+        self.next_seq = 0
+        self.unacked: list[list] = []  # [seq, data, last sent ms or None, tries], oldest first
+        self.expected = 0  # Next sequence number to deliver
+        self.early: dict[int, bytes] = {}  # seq: data received ahead of expected
+        self.ack_pending = False  # Received something that wasn't acknowledged yet
+        self.failed = False  # An event ran out of tries, the peer is probably gone
+
+    def queue(self, data: bytes) -> int | None:
+        """Queue an event. Returns its sequence number, or None if the window is full."""
+        if len(self.unacked) >= self.window:
+            return None
+        seq = self.next_seq
+        self.next_seq = (seq + 1) & SEQ_MASK
+        self.unacked.append([seq, data, None, 0])
+        return seq
+
+    def due(self, now_ms: int) -> list[tuple[int, bytes]]:
+        """Events to send now: new ones, and ones not acknowledged in retry_ms."""
+        due = []
+        for event in self.unacked:
+            if event[2] is None or ticks_diff(now_ms, event[2]) >= self.retry_ms * event[3]:
+                if event[3] >= self.max_tries:
+                    self.failed = True
+                    continue
+                event[2] = now_ms
+                event[3] += 1
+                due.append((event[0], event[1]))
+        if due:
+            self.ack_pending = False  # Acknowledgements go along with the events
+        return due
+
+    def on_ack(self, ack: int):
+        while self.unacked and seq_before(self.unacked[0][0], ack):
+            self.unacked.pop(0)
+
+    def on_event(self, seq: int, data: bytes) -> list[bytes]:
+        """Returns the events that can be delivered now, in order."""
+        self.ack_pending = True
+        if seq != self.expected:
+            if seq_before(self.expected, seq) and len(self.early) < self.window:
+                self.early[seq] = data
+            return []  # Duplicate, or out of order
+        delivered = [data]
+        self.expected = (self.expected + 1) & SEQ_MASK
+        while self.expected in self.early:
+            delivered.append(self.early.pop(self.expected))
+            self.expected = (self.expected + 1) & SEQ_MASK
+        return delivered
+
+
+class SnapshotEncoder:
+    """Host side of game state snapshots, as deltas from the previous snapshot.
+
+    State is a dict of small field numbers to signed 32 bit values. Every keyframe_interval
+    snapshots, or when asked for one, a full snapshot is sent, for players that missed a delta.
+    """
+
+    def __init__(self, keyframe_interval: int = 10):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.last: dict[int, int] = {}
+        self.keyframe_requested = True
+
+    def encode(self, state: dict[int, int], max_len: int) -> tuple[int, int, bytes] | None:
+        """(seq, base seq, fields) for a snapshot, or None if nothing changed. The base is the
+        snapshot the fields are relative to, or seq itself for a full snapshot."""
+        full = self.keyframe_requested or self.seq % self.keyframe_interval == 0
+        if full:
+            changed = list(state.items())
+        else:
+            changed = [(field, value) for field, value in state.items() if self.last.get(field) != value]
+            if not changed:
+                return None
+        changed = changed[: (max_len - 1) // 5]
+        fields = bytearray((len(changed),))
+        for field, value in changed:
+            fields.extend(struct.pack("!Bi", field, value))
+        base = self.seq
+        self.seq = (self.seq + 1) & SEQ_MASK
+        for field, value in changed:
+            self.last[field] = value
+        self.keyframe_requested = False
+        return self.seq, self.seq if full else base, bytes(fields)
+
+
+class SnapshotDecoder:
+    """Player side of game state snapshots."""
+
+    def __init__(self):
+        self.state: dict[int, int] = {}
+        self.seq: int | None = None
+
+    def apply(self, seq: int, base: int, fields: bytes) -> bool:
+        """Apply a snapshot. Returns False if it's a delta from a snapshot this badge doesn't have,
+        and a full one is needed."""
+        if seq != base and base != self.seq:
+            return self.seq is not None and not seq_before(self.seq, seq)  # Old, not missing
+        for i in range(fields[0]):
+            field, value = struct.unpack_from("!Bi", fields, 1 + 5 * i)
+            self.state[field] = value
+        self.seq = seq
+        return True
+
+
+class ClockOffset:
+    """Estimates the offset of the host's clock from this badge's, NTP style.
+
+    Each exchange gives t0 (request sent, local), t1 (received, host), t2 (replied, host) and
+    t3 (reply received, local). Queueing and channel access add delay, mostly on one side, so
+    the offset is taken from the sample with the shortest round trip of the last few.
+    """
+
+    def __init__(self, samples: int = 8):
+        self.max_samples = samples
+        self.samples: list[tuple[int, int]] = []  # (round trip ms, offset ms)
+
+    def add(self, t0: int, t1: int, t2: int, t3: int):
+        round_trip = ticks_diff(t3, t0) - ticks_diff(t2, t1)
+        offset = (ticks_diff(t1, t0) + ticks_diff(t2, t3)) // 2
+        self.samples.append((round_trip, offset))
+        if len(self.samples) > self.max_samples:
+            self.samples.pop(0)
+
+    def synced(self) -> bool:
+        return bool(self.samples)
+
+    def offset(self) -> int:
+        return min(self.samples)[1] if self.samples else 0
+
+    def error(self) -> int | None:
+        """Worst case error of the offset, half the best round trip."""
+        return min(self.samples)[0] // 2 if self.samples else None
+
+    def to_host(self, local_ms: int) -> int:
+        return ticks_add(local_ms, self.offset())
+
+    def to_local(self, host_ms: int) -> int:
+        return ticks_add(host_ms, -self.offset())
+
+
+class TickSchedule:
+    """Host-authoritative game ticks, tick_ms apart from the host's start_ms."""
+
+    def __init__(self, start_ms: int, tick_ms: int):
+        self.start_ms = start_ms
+        self.tick_ms = tick_ms
+
+    def tick(self, host_ms: int) -> int:
+        return max(0, ticks_diff(host_ms, self.start_ms) // self.tick_ms)
+
+    def tick_start(self, tick: int) -> int:
+        return ticks_add(self.start_ms, tick * self.tick_ms)
@@ -0,0 +1,303 @@
+"""Multiplayer game sessions over BadgeNet.
+
+A game hosts a session, which badges nearby find through lobby beacons, or joins one found that
+way. The host is authoritative: players send it events, and it decides and sends out the game state.
+    session = sessions.host(GAME_ID, b"Typer", max_players=6, tick_ms=100)
+    lobbies = sessions.lobbies(GAME_ID)
+    session = sessions.join(lobbies[0])
+    session.on_event = callback  # callback(player address, event bytes)
+    session.send_event(b"...")  # To the host, or from the host to every player
+    session.set_state({1: score, 2: round})  # Host. Players read session.state()
+    session.tick()  # Current game tick, the same on every badge within session.clock.error()
+
+Everything travels on the SESSION port, and starts with the message type and the session ID:
+ - LOBBY beacons, broadcast with TTL 2 while the session is open, with backoff (see net/session.py).
+ - JOIN from a player, and WELCOME from the host with its tick schedule.
+ - EVENT, reliable and ordered for each player and the host, carrying an acknowledgement too.
+   ACK acknowledges when there is no event to carry it.
+ - SNAPSHOT of the game state from the host, as a delta from the previous one. KEYFRAME asks for
+   a full one.
+ - TIME_REQUEST and TIME_REPLY estimate the offset of the host's clock.
+ - LEAVE.
+"""
+
+import asyncio as aio  # type: ignore
+import random
+import struct
+import time
+
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, register_receiver, send
+from net.protocols import HEADER_LEN, MAX_FRAME_LEN, NetworkFrame, Protocol
+from net.session import BeaconBackoff, ClockOffset, ReliableChannel, SnapshotDecoder, SnapshotEncoder, TickSchedule
+
+SESSION_HEADER = "!BI"  # Message type, session ID
+SESSION_HEADER_LEN = struct.calcsize(SESSION_HEADER)
+SESSION = Protocol(port=28, name="SESSION", structdef=SESSION_HEADER)  # Followed by the message. Variable length
+MAX_MESSAGE_LEN = MAX_FRAME_LEN - HEADER_LEN - SESSION_HEADER_LEN
+
+# Message types
+LOBBY = 1  # game ID, players, max players, open, name
+JOIN = 2
+WELCOME = 3  # accepted, tick start (host ms), tick ms
+EVENT = 4  # seq, ack, event
+ACK = 5  # ack
+SNAPSHOT = 6  # seq, base seq, fields
+KEYFRAME = 7
+TIME_REQUEST = 8  # t0
+TIME_REPLY = 9  # t0, t1, t2
+LEAVE = 10
+
+LOBBY_TTL = 2
+SESSION_TTL = 3  # Shortened to the hops needed with adaptive TTL
+LOBBY_EXPIRATION_MS = 20000
+SNAPSHOT_INTERVAL_MS = 200
+TIME_SYNC_INTERVAL_MS = 5000
+TIME_SYNC_FAST_MS = 300  # Until a few samples are in
+TIME_SYNC_FAST_SAMPLES = 4
+JOIN_RETRY_MS = 1000
+JOIN_TRIES = 5
+UPDATE_MS = 50
+
+
+class Lobby:
+    """A session heard of through its lobby beacons."""
+
+    def __init__(self, session_id: int, host: int, game_id: int, players: int, max_players: int, name: bytes):
+        self.session_id = session_id
+        self.host = host
+        self.game_id = game_id
+        self.players = players
+        self.max_players = max_players
+        self.name = name
+        self.heard_ms = time.ticks_ms()
+
+
+class Session:
+    """A game session, as host or player."""
+
+    def __init__(self, session_id: int, host: int, game_id: int, name: bytes, max_players: int):
+        self.session_id = session_id
+        self.host = host
+        self.game_id = game_id
+        self.name = name
+        self.max_players = max_players
+        self.is_host = host == MY_ADDRESS
+        self.open = self.is_host
+        self.joined = self.is_host
+        self.channels: dict[int, ReliableChannel] = {}  # peer: channel. A player's only peer is the host
+        self.on_event = None  # callback(player address, event bytes)
+        self.on_join = None  # callback(player address), for the host
+        self.clock = ClockOffset()
+        self.schedule: TickSchedule | None = None
+        self.beacons = BeaconBackoff(time.ticks_ms())
+        self.encoder = SnapshotEncoder()
+        self.decoder = SnapshotDecoder()
+        self.game_state: dict[int, int] = {}
+        self.last_snapshot_ms = 0
+        self.last_time_sync_ms = 0
+        self.last_join_ms = time.ticks_ms()
+        self.join_tries = 1
+        if not self.is_host:
+            self.channels[host] = ReliableChannel()
+
+    def players(self) -> list[int]:
+        return list(self.channels) if self.is_host else []
+
+    def send_event(self, event: bytes, player: int | None = None) -> bool:
+        """Send an event reliably, to the host, or from the host to one player or all of them.
+        Returns False if it couldn't be queued, because too many are still unacknowledged."""
+        if len(event) > MAX_MESSAGE_LEN - 4:
+            raise ValueError("Session event too long")
+        peers = [player] if player is not None else list(self.channels)
+        queued = True
+        for peer in peers:
+            queued = self.channels[peer].queue(event) is not None and queued
+        return queued
+
+    def set_state(self, state: dict[int, int]):
+        """Host: update the game state, sent to players as snapshots."""
+        self.game_state.update(state)
+
+    def state(self) -> dict[int, int]:
+        return self.game_state if self.is_host else self.decoder.state
+
+    def host_time(self) -> int:
+        return time.ticks_ms() if self.is_host else self.clock.to_host(time.ticks_ms())
+
+    def tick(self) -> int | None:
+        """Current game tick, or None until the tick schedule is known."""
+        if self.schedule is None:
+            return None
+        return self.schedule.tick(self.host_time())
+
+    def close_lobby(self):
+        """Host: stop taking players, e.g. once the game starts."""
+        self.open = False
+
+
+class SessionManager:
+    """Runs the sessions this badge hosts or joined, on one port."""
+
+    def __init__(self):
+        self.sessions: dict[int, Session] = {}
+        self.found: dict[int, Lobby] = {}  # session ID: lobby heard of
+        self.session_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        register_receiver(SESSION, self._receive, variable_length=True)
+        self.session_task = aio.create_task(self.run())
+
+    def host(self, game_id: int, name: bytes, max_players: int = 8, tick_ms: int = 100) -> Session:
+        session = Session(random.getrandbits(32), MY_ADDRESS, game_id, name[:16], max_players)
+        session.schedule = TickSchedule(time.ticks_ms(), tick_ms)
+        self.sessions[session.session_id] = session
+        return session
+
+    def lobbies(self, game_id: int) -> list[Lobby]:
+        """Open sessions of a game heard of recently."""
+        now = time.ticks_ms()
+        self.found = {
+            session_id: lobby
+            for session_id, lobby in self.found.items()
+            if time.ticks_diff(now, lobby.heard_ms) < LOBBY_EXPIRATION_MS
+        }
+        return [lobby for lobby in self.found.values() if lobby.game_id == game_id]
+
+    def join(self, lobby: Lobby) -> Session:
+        session = Session(lobby.session_id, lobby.host, lobby.game_id, lobby.name, lobby.max_players)
+        self.sessions[session.session_id] = session
+        self._send(session, lobby.host, JOIN)
+        return session
+
+    def leave(self, session: Session):
+        for peer in session.channels:
+            self._send(session, peer, LEAVE)
+        self.sessions.pop(session.session_id, None)
+
+    def _send(self, session: Session, destination: int, message_type: int, body: bytes = b""):
+        send(
+            NetworkFrame().set_fields(
+                protocol=Protocol(SESSION.port, SESSION.name, f"{SESSION_HEADER}{len(body)}s"),
+                destination=destination,
+                ttl=LOBBY_TTL if message_type == LOBBY else SESSION_TTL,
+                payload=(message_type, session.session_id, body),
+            )
+        )
+
+    def _receive(self, message: NetworkFrame):
+        if not message.payload or message.source == MY_ADDRESS:
+            return
+        message_type, session_id = message.payload
+        body = message.payload_bytes[SESSION_HEADER_LEN:]
+        source = message.source
+        try:
+            if message_type == LOBBY:
+                game_id, players, max_players, is_open = struct.unpack_from("!BBBB", body)
+                if is_open:
+                    self.found[session_id] = Lobby(session_id, source, game_id, players, max_players, bytes(body[4:]))
+                else:
+                    self.found.pop(session_id, None)
+                return
+            session = self.sessions.get(session_id)
+            if session is None:
+                return
+            if message_type == JOIN and session.is_host:
+                accepted = session.open and (source in session.channels or len(session.channels) < session.max_players)
+                if accepted and source not in session.channels:
+                    session.channels[source] = ReliableChannel()
+                    session.beacons.reset(time.ticks_ms())
+                    session.encoder.keyframe_requested = True
+                    if session.on_join is not None:
+                        session.on_join(source)
+                body = struct.pack("!BIH", accepted, session.schedule.start_ms, session.schedule.tick_ms)
+                self._send(session, source, WELCOME, body)
+            elif message_type == WELCOME and source == session.host:
+                accepted, start_ms, tick_ms = struct.unpack_from("!BIH", body)
+                if accepted:
+                    session.joined = True
+                    session.schedule = TickSchedule(start_ms, tick_ms)
+                else:
+                    self.sessions.pop(session_id, None)
+            elif message_type == EVENT and source in session.channels:
+                seq, ack = struct.unpack_from("!HH", body)
+                channel = session.channels[source]
+                channel.on_ack(ack)
+                for event in channel.on_event(seq, bytes(body[4:])):
+                    if session.on_event is not None:
+                        session.on_event(source, event)
+            elif message_type == ACK and source in session.channels:
+                session.channels[source].on_ack(struct.unpack_from("!H", body)[0])
+            elif message_type == SNAPSHOT and source == session.host:
+                seq, base = struct.unpack_from("!HH", body)
+                if not session.decoder.apply(seq, base, body[4:]):
+                    self._send(session, source, KEYFRAME)
+            elif message_type == KEYFRAME and session.is_host:
+                session.encoder.keyframe_requested = True
+            elif message_type == TIME_REQUEST and session.is_host:
+                # Receivers are called right after the frame arrives, so receive and reply time are the same
+                now = time.ticks_ms()
+                t0 = struct.unpack_from("!I", body)[0]
+                self._send(session, source, TIME_REPLY, struct.pack("!III", t0, now, now))
+            elif message_type == TIME_REPLY and source == session.host:
+                t0, t1, t2 = struct.unpack_from("!III", body)
+                session.clock.add(t0, t1, t2, time.ticks_ms())
+            elif message_type == LEAVE:
+                if session.is_host:
+                    session.channels.pop(source, None)
+                elif source == session.host:
+                    self.sessions.pop(session_id, None)
+        except (ValueError, IndexError):
+            pass  # Malformed
+
+    def _update(self, session: Session, now: int):
+        if session.is_host and session.open and session.beacons.due(now):
+            body = struct.pack(
+                "!BBBB", session.game_id, len(session.channels) + 1, session.max_players, session.open
+            ) + session.name
+            self._send(session, BROADCAST_ADDRESS, LOBBY, body)
+        if not session.joined:
+            if time.ticks_diff(now, session.last_join_ms) >= JOIN_RETRY_MS:
+                if session.join_tries >= JOIN_TRIES:
+                    print(f"Session {session.session_id:x}: host didn't answer")
+                    self.sessions.pop(session.session_id, None)
+                    return
+                session.last_join_ms = now
+                session.join_tries += 1
+                self._send(session, session.host, JOIN)
+            return
+        for peer, channel in list(session.channels.items()):
+            if channel.failed:
+                print(f"Session {session.session_id:x}: lost {peer:x}")
+                session.channels.pop(peer)
+                if not session.is_host:
+                    self.sessions.pop(session.session_id, None)
+                continue
+            for seq, event in channel.due(now):
+                self._send(session, peer, EVENT, struct.pack("!HH", seq, channel.expected) + event)
+            if channel.ack_pending:
+                channel.ack_pending = False
+                self._send(session, peer, ACK, struct.pack("!H", channel.expected))
+        if session.is_host:
+            if session.channels and time.ticks_diff(now, session.last_snapshot_ms) >= SNAPSHOT_INTERVAL_MS:
+                session.last_snapshot_ms = now
+                snapshot = session.encoder.encode(session.game_state, MAX_MESSAGE_LEN - 4)
+                if snapshot is not None:
+                    seq, base, fields = snapshot
+                    self._send(session, BROADCAST_ADDRESS, SNAPSHOT, struct.pack("!HH", seq, base) + fields)
+        else:
+            interval = TIME_SYNC_FAST_MS if len(session.clock.samples) < TIME_SYNC_FAST_SAMPLES else TIME_SYNC_INTERVAL_MS
+            if time.ticks_diff(now, session.last_time_sync_ms) >= interval:
+                session.last_time_sync_ms = now
+                self._send(session, session.host, TIME_REQUEST, struct.pack("!I", now))
+
+    async def run(self):
+        while True:
+            await aio.sleep_ms(UPDATE_MS)
+            now = time.ticks_ms()
+            for session in list(self.sessions.values()):
+                self._update(session, now)
+
+
+# Session manager singleton
+sessions = SessionManager()
@@ -0,0 +1,110 @@
+"""Slot clock and slot schedule for the slotted TDMA MAC mode.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Time is divided into superframes of equal slots. Slot 0 is the contention slot, used for beacons and
+by badges that just synchronized, with normal CAD channel access. Every other slot belongs to the
+badges that hash into it, and a badge moves to another slot if it hears a lower address claim its
+slot in a beacon.
+
+All badges follow the network clock of the lowest address they hear of, passed along in beacons.
+Times are milliseconds on MicroPython's ticks_ms() clock, which wraps at TICKS_PERIOD, so they are
+passed in rather than read here, and compared with ticks_diff() of net/ticks.py.
+"""
+
+from net.phy import time_on_air_us
+from net.ticks import TICKS_PERIOD, ticks_add, ticks_diff
+CONTENTION_SLOT = 0
+SLOTS = 32
+GUARD_MS = 8  # Covers clock error between badges, half at each end of a slot
+CHANNEL_ACCESS_MS = 11  # CAD plus LoraRadio's random wait of up to 10ms before going on air
+SLOT_FRAME_LEN = 250  # MAX_FRAME_LEN in net/protocols.py
+SYNC_TIMEOUT_MS = 60000
+
+
+class SlotSchedule:
+    """Slot timing on the network clock."""
+
+    def __init__(self, slot_ms: int, slots: int = SLOTS, guard_ms: int = GUARD_MS):
+        self.slot_ms = slot_ms
+        self.slots = slots
+        self.guard_ms = guard_ms
+        self.superframe_ms = slot_ms * slots
+
+    @classmethod
+    def for_profile(cls, profile, slots: int = SLOTS):
+        """Schedule with slots that fit the longest BadgeNet frame on a PHY profile."""
+        airtime_us = time_on_air_us(SLOT_FRAME_LEN, profile.sf, profile.bw_khz, profile.cr, profile.preamble_len)
+        return cls(airtime_us // 1000 + 1 + CHANNEL_ACCESS_MS + GUARD_MS, slots)
+
+    def position(self, network_ms: int) -> tuple[int, int]:
+        """(slot, ms into the slot) at a network time."""
+        into_superframe = network_ms % self.superframe_ms
+        return into_superframe // self.slot_ms, into_superframe % self.slot_ms
+
+    def wait_ms(self, network_ms: int, slot: int, airtime_ms: int) -> int:
+        """Time until a frame of airtime_ms can start in slot, 0 if it can start now."""
+        current, into = self.position(network_ms)
+        half_guard = self.guard_ms // 2
+        if current == slot and half_guard <= into and into + airtime_ms <= self.slot_ms - half_guard:
+            return 0
+        slots_ahead = (slot - current) % self.slots
+        if slots_ahead == 0 and into >= half_guard:
+            slots_ahead = self.slots  # Too late in this slot, wait for the next superframe
+        return slots_ahead * self.slot_ms - into + half_guard
+
+    def hashed_slot(self, address: int, salt: int = 0) -> int:
+        """Data slot for an address. Changing the salt moves the badge to a different slot."""
+        mixed = ((address ^ (salt * 0x9E3779B1)) * 2654435761) & 0xFFFFFFFF
+        return 1 + (mixed >> 16) % (self.slots - 1)
+
+
+class SlotClock:
+    """Network clock, kept as an offset from the local clock and synchronized from beacons."""
+
+    def __init__(self, address: int, sync_timeout_ms: int = SYNC_TIMEOUT_MS):
+        self.address = address
+        self.sync_timeout_ms = sync_timeout_ms
+        self.offset_ms = 0
+        self.root = address  # Address whose clock this badge follows
+        self.hops = 0  # Beacon hops from the root
+        self.last_sync_ms: int | None = None
+
+    def network_ms(self, local_ms: int) -> int:
+        return (local_ms + self.offset_ms) % TICKS_PERIOD
+
+    def synced(self, local_ms: int) -> bool:
+        """If beacons sharing this clock have been heard recently. A root counts as synced while
+        other badges' beacons show they follow it."""
+        return self.last_sync_ms is not None and ticks_diff(local_ms, self.last_sync_ms) < self.sync_timeout_ms
+
+    def sync(self, local_rx_ms: int, beacon_ms: int, airtime_us: int, root: int, hops: int) -> bool:
+        """Synchronize from a beacon. Returns True if its clock was adopted.
+        Args:
+            local_rx_ms: Local ticks_ms() when reception finished
+            beacon_ms: Sender's network clock when it started transmitting
+            airtime_us: Time on air of the beacon frame
+            root: Address whose clock the sender follows
+            hops: Sender's hops from the root
+        """
+        if not self.synced(local_rx_ms):
+            # Lost the old clock, start over as our own root
+            self.root = self.address
+            self.hops = 0
+        if root == self.root and self.root == self.address:
+            # Another badge follows this one's clock
+            self.last_sync_ms = local_rx_ms
+            return False
+        if root > self.root or (root == self.root and hops + 1 > self.hops):
+            return False
+        network_rx_ms = ticks_add(beacon_ms, (airtime_us + 500) // 1000)
+        offset_ms = ticks_diff(network_rx_ms, local_rx_ms)
+        if root == self.root and self.last_sync_ms is not None:
+            # Same clock, so smooth out timestamp jitter
+            offset_ms = self.offset_ms + ticks_diff(offset_ms, self.offset_ms) // 2
+        self.offset_ms = offset_ms
+        self.root = root
+        self.hops = hops + 1
+        self.last_sync_ms = local_rx_ms
+        return True
@@ -0,0 +1,141 @@
+"""Optional slotted TDMA medium access, enabled with the mac_tdma config.
+
+Normally every transmission contends for the channel with CAD and a random wait, which degrades
+into collisions in a dense crowd. In TDMA mode badges share a slot clock (see net/tdma.py) and
+BadgeNet only transmits in this badge's own slot, or in the contention slot for a couple of
+superframes after synchronizing. CAD still runs inside slots, since hashed slots can be shared.
+
+The clock is spread with TDMA_BEACON frames (TTL 0), sent in the contention slot. Each carries the
+sender's network clock from right before it went on air, and the receiver adds the beacon's time on
+air to the receive timestamp. Beacons are suppressed when enough others were heard recently, like
+Trickle, so a crowd doesn't fill the contention slot with them.
+
+Without beacons for SYNC_TIMEOUT_MS the badge is unsynchronized, and BadgeNet falls back to CSMA.
+"""
+
+import asyncio as aio  # type: ignore
+import random
+import struct
+import time
+
+from net.net import BROADCAST_ADDRESS, MY_ADDRESS, badgenet, register_receiver
+from net.phy import time_on_air_us
+from net.protocols import HEADER_LEN, NetworkFrame, Protocol
+from net.tdma import CHANNEL_ACCESS_MS, CONTENTION_SLOT, SlotClock, SlotSchedule
+
+TDMA_BEACON = Protocol(port=24, name="TDMA_BEACON", structdef="!IIBB")  # network ms, root, hops, slot
+BEACON_LEN = HEADER_LEN + struct.calcsize(TDMA_BEACON.structdef)
+
+BEACON_INTERVAL_MS = 20000
+BEACON_REDUNDANCY = 2  # Skip a beacon after hearing this many that are as close to the root
+NEWCOMER_SUPERFRAMES = 2
+
+
+class TdmaManager:
+    """Keeps the slot clock synchronized and schedules BadgeNet transmissions into slots."""
+
+    def __init__(self):
+        self.clock = SlotClock(MY_ADDRESS)
+        self.schedule: SlotSchedule
+        self.profile = None
+        self.salt = 0
+        self.slot = 0
+        self.synced_since_ms = 0
+        self.beacons_heard = 0
+        self.manager_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        register_receiver(TDMA_BEACON, self._receive_beacon)
+        if badge.config.get("mac_tdma", b"false") != b"true":
+            return
+        self._update_schedule()
+        badgenet.mac = self
+        self.manager_task = aio.create_task(self.run())
+
+    def _update_schedule(self):
+        # Slot length depends on the PHY profile, which PhyManager can change
+        if self.profile is not self.badge.lora.profile:
+            self.profile = self.badge.lora.profile
+            self.schedule = SlotSchedule.for_profile(self.profile)
+            self.slot = self.schedule.hashed_slot(MY_ADDRESS, self.salt)
+
+    def synced(self) -> bool:
+        return self.clock.synced(time.ticks_ms())
+
+    def _airtime_ms(self, frame_len: int) -> int:
+        """Slot time needed to get a frame on air, including channel access."""
+        profile = self.profile
+        airtime_us = time_on_air_us(frame_len, profile.sf, profile.bw_khz, profile.cr, profile.preamble_len)
+        return airtime_us // 1000 + 1 + CHANNEL_ACCESS_MS
+
+    def _receive_beacon(self, message: NetworkFrame):
+        if badgenet.mac is None:
+            return
+        self._update_schedule()
+        beacon_ms, root, hops, slot = message.payload
+        was_synced = self.synced()
+        airtime_us = time_on_air_us(
+            len(message.frame), self.profile.sf, self.profile.bw_khz, self.profile.cr, self.profile.preamble_len
+        )
+        self.clock.sync(self.badge.lora.get_rx_ms(), beacon_ms, airtime_us, root, hops)
+        if root == self.clock.root and hops <= self.clock.hops:
+            self.beacons_heard += 1
+        if not was_synced and self.synced():
+            self.synced_since_ms = time.ticks_ms()
+        if slot == self.slot and message.source < MY_ADDRESS:
+            # Lower address claimed this slot, so move
+            self.salt += 1
+            self.slot = self.schedule.hashed_slot(MY_ADDRESS, self.salt)
+
+    def _tx_slot(self) -> int:
+        if time.ticks_diff(time.ticks_ms(), self.synced_since_ms) < NEWCOMER_SUPERFRAMES * self.schedule.superframe_ms:
+            return CONTENTION_SLOT
+        return self.slot
+
+    async def wait_for_slot(self, frame_len: int):
+        """Wait until a frame can go on air in this badge's slot. Returns at once when not synced."""
+        airtime_ms = self._airtime_ms(frame_len)
+        while self.synced():
+            self._update_schedule()
+            network_ms = self.clock.network_ms(time.ticks_ms())
+            wait_ms = self.schedule.wait_ms(network_ms, self._tx_slot(), airtime_ms)
+            if wait_ms == 0:
+                return
+            await aio.sleep_ms(wait_ms)
+
+    def _beacon_frame(self) -> bytes:
+        beacon = NetworkFrame().set_fields(
+            protocol=TDMA_BEACON,
+            destination=BROADCAST_ADDRESS,
+            source=MY_ADDRESS,
+            ttl=0,
+            payload=(self.clock.network_ms(time.ticks_ms()), self.clock.root, self.clock.hops, self.slot),
+        )
+        beacon.serialize()
+        return beacon.frame
+
+    async def send_beacon(self):
+        lora = self.badge.lora
+        self._update_schedule()
+        if self.synced():
+            network_ms = self.clock.network_ms(time.ticks_ms())
+            await aio.sleep_ms(self.schedule.wait_ms(network_ms, CONTENTION_SLOT, self._airtime_ms(BEACON_LEN)))
+        await lora.acquire()
+        try:
+            # Timestamp after channel access, as close to going on air as possible
+            await lora.send_exclusive(None, prepare=self._beacon_frame)
+        finally:
+            lora.release()
+
+    async def run(self):
+        while True:
+            self.beacons_heard = 0
+            # Random phase so badges' beacons don't line up
+            await aio.sleep_ms(BEACON_INTERVAL_MS // 2 + random.randrange(BEACON_INTERVAL_MS // 2))
+            if self.clock.root == MY_ADDRESS or self.beacons_heard < BEACON_REDUNDANCY:
+                await self.send_beacon()
+
+
+# TDMA MAC singleton
+tdma_manager = TdmaManager()
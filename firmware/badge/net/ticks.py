@@ -0,0 +1,20 @@
+"""MicroPython ticks_ms() arithmetic.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+ticks_ms() wraps at TICKS_PERIOD, so times from it are compared with ticks_diff() and moved with
+ticks_add(). The time module only has those on MicroPython, so pure modules that take times from
+ticks_ms() use these instead.
+"""
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks_ms() wraps here
+
+
+def ticks_diff(a: int, b: int) -> int:
+    """time.ticks_diff() for ticks_ms() values, usable in CPython."""
+    return ((a - b + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+
+
+def ticks_add(a: int, delta: int) -> int:
+    return (a + delta) % TICKS_PERIOD
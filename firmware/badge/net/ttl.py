@@ -0,0 +1,79 @@
+"""Adaptive TTL selection from learned hop distances.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+
+Frames carry the TTL they were sent with in the high nibble of the flags and TTL byte, so every
+copy received tells how many hops it took from its source. Badges that predate this leave the
+nibble at 0, also when they relay a frame, so copies with the nibble at 0 don't count, nor do copies
+where it's below the TTL left. That leaves out frames sent with TTL 0, which can't be told apart.
+"""
+
+MAX_TTL = 14  # NetworkFrame.set_fields() only allows up to 14
+HOP_EXPIRATION_S = 300
+
+
+def hops_taken(flags_ttl: int) -> int | None:
+    """Hops a frame took, from its flags and TTL byte, or None if the sender or a relay didn't record
+    its TTL."""
+    initial_ttl = flags_ttl >> 4
+    ttl = flags_ttl & 0x0F
+    if initial_ttl == 0 or initial_ttl < ttl:
+        return None
+    return initial_ttl - ttl
+
+
+class HopTable:
+    """Fewest hops recently seen from each source, and the TTL needed to reach them.
+
+    Unicast gets the hops to its destination plus unicast_margin, even above what the app asked for,
+    since the app's guess may fall short. Broadcasts are capped to the farthest source heard plus
+    margin, which is about what it takes to reach everyone this badge can hear from.
+    """
+
+    def __init__(
+        self, max_entries: int = 64, margin: int = 1, unicast_margin: int = 2, expiration_s: int = HOP_EXPIRATION_S
+    ):
+        self.max_entries = max_entries
+        self.margin = margin
+        self.unicast_margin = unicast_margin  # A single destination has less redundancy than a flood
+        self.expiration_s = expiration_s
+        self.hops: dict[int, tuple[int, float]] = {}  # source: (hops, time seen)
+
+    def record(self, source: int, hops: int, now_s: float):
+        entry = self.hops.get(source)
+        if entry is not None and entry[0] < hops and now_s - entry[1] < self.expiration_s:
+            return  # Farther copy of a recent, closer path
+        if entry is None and len(self.hops) >= self.max_entries:
+            self.expire(now_s)
+            if len(self.hops) >= self.max_entries:
+                # Forget the farthest source, it's the least useful for picking TTLs
+                farthest = max(self.hops, key=lambda address: self.hops[address][0])
+                if self.hops[farthest][0] <= hops:
+                    return
+                del self.hops[farthest]
+        self.hops[source] = (hops, now_s)
+
+    def expire(self, now_s: float):
+        self.hops = {
+            source: entry for source, entry in self.hops.items() if now_s - entry[1] < self.expiration_s
+        }
+
+    def diameter(self, now_s: float) -> int | None:
+        """Most hops to any source heard recently, or None if none were."""
+        recent = [entry[0] for entry in self.hops.values() if now_s - entry[1] < self.expiration_s]
+        return max(recent) if recent else None
+
+    def ttl_for(self, destination: int, requested_ttl: int, broadcast_address: int, now_s: float) -> int:
+        """TTL to send with, given the TTL the sender asked for."""
+        if requested_ttl == 0:
+            return 0  # Meant for neighbors only
+        if destination == broadcast_address:
+            diameter = self.diameter(now_s)
+            if diameter is None:
+                return requested_ttl
+            return min(requested_ttl, diameter + self.margin)
+        entry = self.hops.get(destination)
+        if entry is None or now_s - entry[1] >= self.expiration_s:
+            return requested_ttl
+        return min(MAX_TTL, entry[0] + self.unicast_margin)
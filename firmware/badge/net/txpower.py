@@ -0,0 +1,67 @@
+"""Density aware transmit power control.
+
+Important Note: Everything in this file needs to be usable by both micropython (on the badge)
+and CPython (for testing on a host computer). Only import libraries that exist in both Pythons.
+"""
+
+TX_POWER_MIN_DBM = -9  # SX1262 limits
+TX_POWER_MAX_DBM = 22
+
+
+class TxPowerController:
+    """Lowers transmit power when neighbors are plentiful and loud, and raises it when isolated.
+
+    Every frame heard is recorded with its RSSI and whether it was a copy of a message already
+    seen. Relays mean each message is heard once per neighbor that repeated it, so copies heard per
+    unique message estimates how many neighbors are covering this badge's area. Copies heard loud
+    enough to survive a power step (links are roughly symmetric) are neighbors that would still
+    hear this badge after turning down. When there are plenty of those, the badge turns down, which
+    shrinks the area each transmission blocks and leaves more airtime for everyone else.
+    """
+
+    def __init__(
+        self,
+        power_dbm: int,
+        min_dbm: int = TX_POWER_MIN_DBM,
+        max_dbm: int = TX_POWER_MAX_DBM,
+        step_db: int = 2,
+    ):
+        self.min_dbm = max(TX_POWER_MIN_DBM, min_dbm)
+        self.max_dbm = min(TX_POWER_MAX_DBM, max(self.min_dbm, max_dbm))
+        self.power_dbm = min(self.max_dbm, max(self.min_dbm, power_dbm))
+        self.step_db = step_db
+        self.strong_rssi_dbm = -100.0  # Still well above sensitivity after a step down
+        self.weak_rssi_dbm = -110.0
+        self.min_redundancy = 1.3  # Copies heard per unique message before turning down
+        self.min_frames = 5
+        self.reset_period()
+
+    def reset_period(self):
+        self.frames = 0
+        self.unique_frames = 0
+        self.strong_frames = 0
+        self.weak_frames = 0
+
+    def record_frame(self, rssi: float, duplicate: bool):
+        """Record a received frame. duplicate is True if the message was already seen."""
+        self.frames += 1
+        if not duplicate:
+            self.unique_frames += 1
+        if rssi >= self.strong_rssi_dbm + self.step_db:
+            self.strong_frames += 1
+        elif rssi < self.weak_rssi_dbm:
+            self.weak_frames += 1
+
+    def update(self) -> int:
+        """Decide the transmit power for the next period, and start a new period."""
+        if self.frames < self.min_frames:
+            # Isolated, or the room is very quiet, so be heard
+            self.power_dbm = min(self.max_dbm, self.power_dbm + self.step_db)
+        elif 2 * self.weak_frames > self.frames:
+            # Most neighbors are barely heard, so they barely hear this badge either
+            self.power_dbm = min(self.max_dbm, self.power_dbm + self.step_db)
+        elif 2 * self.strong_frames >= self.frames and self.frames >= self.min_redundancy * self.unique_frames:
+            # Most neighbors are loud and relaying the same messages, so they'd still hear a step down
+            self.power_dbm = max(self.min_dbm, self.power_dbm - self.step_db)
+        self.reset_period()
+        return self.power_dbm
@@ -0,0 +1,110 @@
+"""Signature checks off the receive path, each done at most once.
+
+Verifying an RSA signature takes long enough to hold up the radio receive loop, and the same signed
+message can come in more than once, relayed along several paths or sent again later. Receivers hand
+signatures to the verifier singleton instead of calling badge.crypto.verify() themselves:
+    status = verifier.verify(message, signature, callback)
+A result already known is returned right away. Otherwise it's PENDING, the check is queued for the
+verifier task, and callback(status) is called with VERIFIED or REJECTED once it's done.
+
+Results of the last max_entries checks are kept, keyed on a hash of the message and signature, and
+the least recently used is forgotten first. When max_queue checks are waiting, new ones aren't queued,
+so a flood of signed frames can't use up RAM. They get UNVERIFIED, not REJECTED, since the signature
+may well be good: callers that act on a message, like config overrides, treat it like REJECTED, and
+chat shows the message marked as unverified.
+"""
+
+import asyncio as aio  # type: ignore
+from collections import deque
+import hashlib
+import sys
+
+PENDING = 0
+VERIFIED = 1
+REJECTED = 2
+UNVERIFIED = 3  # Not checked, too many checks were waiting
+
+KEY_LEN = 8  # Bytes of SHA256 kept as the key, plenty to tell a few dozen entries apart
+
+
+def cache_key(message: bytes, signature: bytes) -> bytes:
+    digest = hashlib.sha256(message)
+    digest.update(signature)
+    return digest.digest()[:KEY_LEN]
+
+
+class SignatureVerifier:
+    """Cache of signature check results, and a task doing the checks."""
+
+    def __init__(self, max_entries: int = 64, max_queue: int = 16):
+        self.max_entries = max_entries
+        self.max_queue = max_queue
+        self.results: dict[bytes, bool] = {}  # key: verified, least recently used first
+        self.queue: deque = deque([], max_queue)  # (key, message, signature)
+        self.callbacks: dict[bytes, list] = {}  # key: callbacks waiting for a queued check
+        self.hits = 0
+        self.checks = 0
+        self.overflows = 0
+        self._queued = aio.Event()
+        self.verify_task: aio.Task
+
+    def init(self, badge):
+        self.badge = badge
+        self.verify_task = aio.create_task(self.run())
+
+    def lookup(self, message: bytes, signature: bytes, key: bytes | None = None) -> int:
+        """Result of an earlier check, or PENDING if there wasn't one."""
+        key = key or cache_key(message, signature)
+        verified = self.results.pop(key, None)
+        if verified is None:
+            return PENDING
+        self.results[key] = verified  # Most recently used again
+        self.hits += 1
+        return VERIFIED if verified else REJECTED
+
+    def _remember(self, key: bytes, verified: bool):
+        if key not in self.results and len(self.results) >= self.max_entries:
+            del self.results[next(iter(self.results))]
+        self.results[key] = verified
+
+    def verify(self, message: bytes, signature: bytes, callback=None) -> int:
+        """VERIFIED or REJECTED if known, or PENDING, with callback(status) called once checked.
+        UNVERIFIED if it can't be checked because the queue is full."""
+        key = cache_key(message, signature)
+        status = self.lookup(message, signature, key)
+        if status != PENDING:
+            return status
+        waiting = self.callbacks.get(key)
+        if waiting is None:
+            if len(self.queue) >= self.max_queue:
+                self.overflows += 1
+                return UNVERIFIED
+            waiting = self.callbacks[key] = []
+            self.queue.append((key, message, signature))
+            self._queued.set()
+        if callback is not None:
+            waiting.append(callback)
+        return PENDING
+
+    async def run(self):
+        while True:
+            await self._queued.wait()
+            self._queued.clear()
+            while self.queue:
+                key, message, signature = self.queue.popleft()
+                verified = self.badge.crypto.verify(message, signature)
+                self.checks += 1
+                self._remember(key, verified)
+                status = VERIFIED if verified else REJECTED
+                for callback in self.callbacks.pop(key, ()):
+                    try:
+                        callback(status)
+                    except Exception as ex:
+                        print("Exception in signature verification callback")
+                        sys.print_exception(ex)
+                # Let the radio and UI run between checks
+                await aio.sleep_ms(0)
+
+
+# Signature verifier singleton
+verifier = SignatureVerifier()
@@ -0,0 +1,159 @@
+#!/bin/env python3
+"""Compare LoRa time on air of BadgeNet protocols.
+
+This runs on your computer, not the badge:
+python scripts/airtime.py
+"""
+
+import argparse
+import binascii
+import pathlib
+import struct
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "badge"))
+
+from net.control_window import CONTROL_FRAME_LEN  # noqa: E402
+from net.header import HeaderCodec  # noqa: E402
+from net.phy import PROFILES, profile_index, time_on_air_us  # noqa: E402
+
+BADGENET_HEADER_LEN = 16
+
+# name: structdef, copied from the apps defining them
+PROTOCOLS = {
+    "PING": "!IB",
+    "PONG": "!IBBff",
+    "CONFIG_OVERRIDE": "!128s20s80s",
+    "TEXT_CHAT": "!H10s100s",
+    "SIGNED_TEXT_CHAT": "!H10s128s90s",
+    "LEAN_TEXT_CHAT": "!H100s",
+    "SHORT_SIGNED_TEXT_CHAT": "!H65s100s",
+    "MAC_TEXT_CHAT": "!HBI8s100s",
+    "NODE_ALIAS": "!16s",
+    "CHAT_SYNC_REQUEST": "!H64s",
+    "BULK_OFFER": "!IIB20s",
+    "BULK_REPLY": "!IB",
+    "CONTROL_WINDOW": "!H",
+    "PHY_SWITCH": "!BH",
+    "TDMA_BEACON": "!IIBB",
+}
+# name: TTL it's sent with by default, copied from the apps sending them. Chat uses the chat_ttl config.
+PROTOCOL_TTLS = {
+    "PING": 7,
+    "PONG": 7,
+    "CONFIG_OVERRIDE": 15,
+    "TEXT_CHAT": 3,
+    "SIGNED_TEXT_CHAT": 3,
+    "LEAN_TEXT_CHAT": 3,
+    "SHORT_SIGNED_TEXT_CHAT": 3,
+    "MAC_TEXT_CHAT": 3,
+    "NODE_ALIAS": 2,
+    "CHAT_SYNC_REQUEST": 0,
+    "BULK_OFFER": 0,
+    "BULK_REPLY": 0,
+    "CONTROL_WINDOW": 0,
+    "PHY_SWITCH": 14,
+    "TDMA_BEACON": 0,
+}
+UNICAST_PROTOCOLS = ("PONG", "BULK_OFFER", "BULK_REPLY")
+BROADCAST_ADDRESS = 0xFFFFFFFF
+
+
+def v1_frame(destination: int, source: int, payload_len: int, flags_ttl: int = 0x77) -> bytes:
+    body = struct.pack("!BBIIBB", flags_ttl, BADGENET_HEADER_LEN + payload_len, destination, source, 1, 0)
+    body += bytes(payload_len)
+    return b"\x07\xe9" + struct.pack("!H", binascii.crc_hqx(body[1:], 0)) + body
+
+
+def v2_frame_lens(destination: int, payload_len: int, ttl: int) -> tuple[int, int]:
+    """Length of the v2 frame with full addresses, and once neighbors learned the short ones, which
+    only TTL 0 frames use."""
+    source = 0x12345678
+    codec = HeaderCodec(source, lambda data: binascii.crc_hqx(bytes(data), 0))
+    codec.learn(destination, BROADCAST_ADDRESS)
+    frame = v1_frame(destination, source, payload_len, flags_ttl=(ttl << 4) | ttl)
+    return len(codec.compress(frame, now_s=0)), len(codec.compress(frame, now_s=1))
+
+
+def print_table(rows: list[tuple], headers: tuple):
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", default="fast", help="PHY profile to start from, see net/phy.py")
+    parser.add_argument("--sf", type=int)
+    parser.add_argument("--bw", type=float, help="Bandwidth in kHz")
+    parser.add_argument("--cr", type=int, help="Coding rate denominator, 4/x")
+    parser.add_argument("--preamble", type=int)
+    args = parser.parse_args()
+    profile = PROFILES[profile_index(args.profile)]
+    args.sf = args.sf or profile.sf
+    args.bw = args.bw or profile.bw_khz
+    args.cr = args.cr or profile.cr
+    args.preamble = args.preamble or profile.preamble_len
+    phy = dict(sf=args.sf, bw_khz=args.bw, cr=args.cr, preamble_len=args.preamble)
+    print(f"SF{args.sf} BW{args.bw:g}kHz CR4/{args.cr} preamble {args.preamble}\n")
+
+    rows = []
+    for name, structdef in PROTOCOLS.items():
+        frame_len = BADGENET_HEADER_LEN + struct.calcsize(structdef)
+        airtime = time_on_air_us(frame_len, **phy)
+        rows.append((name, frame_len, f"{airtime / 1000:.2f}"))
+    print_table(rows, ("Protocol", "Bytes", "Explicit ms"))
+
+    rows = []
+    for name, structdef in PROTOCOLS.items():
+        payload_len = struct.calcsize(structdef)
+        destination = 0x9ABCDEF0 if name in UNICAST_PROTOCOLS else BROADCAST_ADDRESS
+        v1_len = BADGENET_HEADER_LEN + payload_len
+        ttl = PROTOCOL_TTLS[name]
+        v2_full_len, v2_short_len = v2_frame_lens(destination, payload_len, ttl)
+        v1_airtime = time_on_air_us(v1_len, **phy)
+        v2_airtime = time_on_air_us(v2_short_len, **phy)
+        rows.append(
+            (
+                name,
+                "unicast" if name in UNICAST_PROTOCOLS else "broadcast",
+                ttl,
+                v1_len,
+                v2_full_len,
+                v2_short_len if v2_short_len != v2_full_len else "-",
+                f"{v1_airtime / 1000:.2f}",
+                f"{v2_airtime / 1000:.2f}",
+                f"{100 * (v1_airtime - v2_airtime) / v1_airtime:.0f}%",
+            )
+        )
+    print("Header v2 at each protocol's TTL, with short addresses once neighbors learned them (TTL 0 only):")
+    print_table(rows, ("Protocol", "To", "TTL", "v1 bytes", "v2 bytes", "v2 short", "v1 ms", "v2 ms", "Saved"))
+
+    explicit = time_on_air_us(BADGENET_HEADER_LEN + struct.calcsize(PROTOCOLS["PING"]), **phy)
+    implicit = time_on_air_us(CONTROL_FRAME_LEN, explicit_header=False, **phy)
+    rows = [
+        ("BadgeNet PING, explicit", BADGENET_HEADER_LEN + struct.calcsize(PROTOCOLS["PING"]), f"{explicit / 1000:.2f}"),
+        ("Control PING, implicit", CONTROL_FRAME_LEN, f"{implicit / 1000:.2f}"),
+    ]
+    print_table(rows, ("Frame", "Bytes", "ms"))
+    print(f"Implicit control frames use {100 * implicit / explicit:.0f}% of the airtime.\n")
+
+    rows = []
+    for profile in PROFILES:
+        phy = dict(sf=profile.sf, bw_khz=profile.bw_khz, cr=profile.cr, preamble_len=profile.preamble_len)
+        rows.append(
+            (
+                profile.name,
+                f"SF{profile.sf} BW{profile.bw_khz:g} CR4/{profile.cr} P{profile.preamble_len}",
+                f"{time_on_air_us(BADGENET_HEADER_LEN + struct.calcsize(PROTOCOLS['PING']), **phy) / 1000:.2f}",
+                f"{time_on_air_us(BADGENET_HEADER_LEN + struct.calcsize(PROTOCOLS['TEXT_CHAT']), **phy) / 1000:.2f}",
+                f"{profile.min_snr:g}",
+            )
+        )
+    print_table(rows, ("Profile", "Settings", "PING ms", "TEXT_CHAT ms", "Min SNR dB"))
+
+
+if __name__ == "__main__":
+    main()
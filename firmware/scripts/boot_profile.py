@@ -0,0 +1,113 @@
+#!/bin/env python3
+"""Summarize boot profiles recorded by hardware/profiler.py on the badge.
+
+This runs on your computer, not the badge:
+mpremote cp :/data/boot_profile.txt .
+python scripts/boot_profile.py boot_profile.txt
+
+Prints a table of every span, longest first, with the mean, min and max over the boots in the
+files, and its self time (without the spans inside it), then a flame-style tree of mean times.
+--folded prints folded stacks instead, for flamegraph.pl or speedscope.
+"""
+
+import argparse
+
+BAR_WIDTH = 40
+
+
+def read_boots(paths: list[str]) -> list[list[tuple[int, int, int, str]]]:
+    """Boots, each a list of (depth, start us, duration us, name) in start order."""
+    boots = []
+    for path in paths:
+        with open(path) as report:
+            for line in report:
+                line = line.rstrip("\n")
+                if line.startswith("boot "):
+                    boots.append([])
+                elif line and boots:
+                    depth, start_us, duration_us, name = line.split(" ", 3)
+                    boots[-1].append((int(depth), int(start_us), int(duration_us), name))
+    return boots
+
+
+def stacks(boot: list[tuple[int, int, int, str]]) -> dict[tuple[str, ...], tuple[int, int, int]]:
+    """stack of names: (start us, duration us, self us) for one boot."""
+    result: dict[tuple[str, ...], list[int]] = {}
+    path: list[tuple[int, str]] = []  # (depth, name) of the spans around the current one
+    for depth, start_us, duration_us, name in sorted(boot, key=lambda span: (span[1], span[0])):
+        while path and path[-1][0] >= depth:
+            path.pop()
+        parent = tuple(name for _, name in path)
+        key = parent + (name,)
+        entry = result.setdefault(key, [start_us, 0, 0])
+        entry[1] += duration_us
+        entry[2] += duration_us
+        if parent in result:
+            result[parent][2] -= duration_us
+        path.append((depth, name))
+    return {key: (start_us, duration_us, max(0, self_us)) for key, (start_us, duration_us, self_us) in result.items()}
+
+
+def print_table(rows: list[tuple], headers: tuple):
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("reports", nargs="+", help="boot_profile.txt files copied from badges")
+    parser.add_argument("--folded", action="store_true", help="Print folded stacks of mean self time")
+    parser.add_argument("--top", type=int, default=30, help="Rows in the table")
+    args = parser.parse_args()
+
+    boots = read_boots(args.reports)
+    if not boots:
+        print("No boots in the reports")
+        return
+    per_boot = [stacks(boot) for boot in boots]
+    keys = {key for boot_stacks in per_boot for key in boot_stacks}
+    starts = {}  # stack: mean start us
+    summary = {}  # stack: (mean us, min us, max us, mean self us, boots seen)
+    for key in keys:
+        entries = [boot_stacks[key] for boot_stacks in per_boot if key in boot_stacks]
+        durations = [duration_us for _, duration_us, _ in entries]
+        starts[key] = sum(start_us for start_us, _, _ in entries) / len(entries)
+        summary[key] = (
+            sum(durations) / len(durations),
+            min(durations),
+            max(durations),
+            sum(self_us for _, _, self_us in entries) / len(entries),
+            len(entries),
+        )
+    # In start order, children right after their parent
+    keys = sorted(keys, key=lambda key: tuple(starts[key[: i + 1]] for i in range(len(key))))
+
+    if args.folded:
+        for key in keys:
+            self_us = summary[key][3]
+            if self_us >= 1:
+                print(f"{';'.join(key)} {round(self_us)}")
+        return
+
+    print(f"{len(boots)} boots\n")
+    rows = [
+        (key[-1], len(key) - 1, seen, f"{mean / 1000:.1f}", f"{low / 1000:.1f}", f"{high / 1000:.1f}", f"{self_us / 1000:.1f}")
+        for key, (mean, low, high, self_us, seen) in sorted(summary.items(), key=lambda item: -item[1][0])[: args.top]
+    ]
+    print_table(rows, ("Span", "Depth", "Boots", "Mean ms", "Min ms", "Max ms", "Self ms"))
+
+    total = max(mean for key, (mean, _, _, _, _) in summary.items() if len(key) == 1)
+    print("Mean time, nested:")
+    for key in keys:
+        mean = summary[key][0]
+        if mean < total / 200:
+            continue  # Hide spans under half a percent
+        bar = "#" * max(1, round(BAR_WIDTH * mean / total))
+        print(f"{mean / 1000:8.1f} ms  {'  ' * (len(key) - 1)}{bar} {key[-1]}")
+
+
+if __name__ == "__main__":
+    main()
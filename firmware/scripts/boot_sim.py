@@ -0,0 +1,89 @@
+#!/bin/env python3
+"""Run the boot stages of main.py with fake hardware, to see when each stage starts and ends.
+
+This runs on your computer, not the badge:
+python scripts/boot_sim.py --radio-ms 450
+
+The fakes take as long as the --*-ms arguments say, blocking like the badge drivers do today.
+With --await-radio, radio calibration waits are awaited instead, as they could be with a
+non-blocking SX1262 driver, so the keyboard and apps come up while the radio calibrates.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "badge"))
+
+from hardware.boot import BootSequence  # noqa: E402
+
+
+def clock_ms() -> int:
+    return int(time.monotonic() * 1000)
+
+
+class FakeBadge:
+    """Badge with the init_*() stages of hardware/badge.py, taking the given times."""
+
+    def __init__(self, args):
+        self.args = args
+        self.screen_ms = None
+
+    def init_display(self):
+        time.sleep(self.args.display_ms / 1000)
+        self.screen_ms = clock_ms()  # Splash shown
+
+    def init_keyboard(self):
+        time.sleep(self.args.keyboard_ms / 1000)
+
+    def init_sao(self):
+        time.sleep(1 / 1000)
+
+    def init_radio(self):
+        if self.args.await_radio:
+            return self._init_radio_awaiting()
+        time.sleep(self.args.radio_ms / 1000)
+
+    async def _init_radio_awaiting(self):
+        time.sleep(self.args.radio_ms / 10000)  # SPI commands
+        await asyncio.sleep(self.args.radio_ms * 9 / 10000)  # TCXO start and calibration
+
+
+async def boot(args):
+    badge = FakeBadge(args)
+    start_ms = clock_ms()
+    sequence = BootSequence(clock_ms)
+    sequence.add("display", badge.init_display)
+    sequence.add("keyboard", badge.init_keyboard)
+    sequence.add("sao", badge.init_sao)
+    sequence.add("radio", badge.init_radio)
+    sequence.add("network", lambda: time.sleep(args.network_ms / 1000), after=("radio",))
+    sequence.add("apps", lambda: time.sleep(args.apps_ms / 1000), after=("display", "keyboard"))
+    sequence.add("start", lambda: time.sleep(args.start_ms / 1000), after=("apps", "network"))
+    if args.fail:
+        sequence.stages[args.fail].function = lambda: 1 / 0
+    await sequence.run()
+    if badge.screen_ms is not None:
+        print(f"Splash after {badge.screen_ms - start_ms} ms")
+    if sequence.stages["start"].ok:
+        print(f"Main screen after {clock_ms() - start_ms} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--display-ms", type=int, default=250)
+    parser.add_argument("--keyboard-ms", type=int, default=5)
+    parser.add_argument("--radio-ms", type=int, default=450)
+    parser.add_argument("--network-ms", type=int, default=60)
+    parser.add_argument("--apps-ms", type=int, default=300)
+    parser.add_argument("--start-ms", type=int, default=150)
+    parser.add_argument("--await-radio", action="store_true", help="Radio calibration is awaited, not blocking")
+    parser.add_argument("--fail", help="Make this stage raise, to see the stages after it skipped")
+    args = parser.parse_args()
+    asyncio.run(boot(args))
+
+
+if __name__ == "__main__":
+    main()
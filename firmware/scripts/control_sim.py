@@ -0,0 +1,294 @@
+#!/bin/env python3
+"""Run control windows of net/control_window.py on emulated radios, to check decode and fallback.
+
+This runs on your computer, not the badge:
+python scripts/control_sim.py
+
+Each badge gets an EmulatedRadio on a shared medium. Like the SX1262, a radio only picks up a frame
+sent with its own sync word and header mode, and in implicit header mode it reads its configured
+length, so a frame of any other length fails the CRC. Frames take their LoRa time on air on the
+fast profile. The checks:
+ - implicit decode: PING/PONG inside a window, every frame decoded as sent,
+ - explicit fallback: mesh frames sent during a window only reach badges outside it, and every
+   radio is back on the BadgeNet sync word and explicit header mode afterwards,
+ - opt-out: a badge without control_windows hears the announcement but stays on the mesh,
+ - wrong length: implicit frames that aren't CONTROL_FRAME_LEN are dropped,
+ - idle timeout: a badge that joined a silent window leaves it early.
+Exits with 1 if any check fails.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import struct
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "badge"))
+
+from net.control_window import (  # noqa: E402
+    CONTROL_FRAME_LEN,
+    IDLE_TIMEOUT_MS,
+    MAX_WINDOW_MS,
+    ControlWindow,
+)
+from net.phy import DEFAULT_PROFILE, PROFILES, time_on_air_us  # noqa: E402
+
+BADGENET_SYNC_WORD = 0x12  # LoraRadio.sync_word
+ANNOUNCE = "!4sH"  # Stands in for the CONTROL_WINDOW BadgeNet frame: marker, duration ms
+ANNOUNCE_MARKER = b"CWIN"
+RSSI_DBM = -60
+
+
+def clock_ms() -> int:
+    return int(time.monotonic() * 1000)
+
+
+class Medium:
+    """Delivers each frame to the radios that would decode it."""
+
+    def __init__(self):
+        self.radios: list["EmulatedRadio"] = []
+        self.profile = PROFILES[DEFAULT_PROFILE]
+
+    async def transmit(self, sender: "EmulatedRadio", frame: bytes):
+        implicit_len, sync_word = sender.implicit_len, sender.sync_word
+        airtime_us = time_on_air_us(
+            len(frame),
+            sf=self.profile.sf,
+            bw_khz=self.profile.bw_khz,
+            cr=self.profile.cr,
+            preamble_len=self.profile.preamble_len,
+            explicit_header=not implicit_len,
+        )
+        await asyncio.sleep(airtime_us / 1e6)
+        for radio in self.radios:
+            if radio is not sender:
+                radio.hear(frame, implicit_len, sync_word)
+
+
+class EmulatedRadio:
+    """The parts of LoraRadio the network stack and control windows use."""
+
+    def __init__(self, name: str, medium: Medium):
+        self.name = name
+        self.medium = medium
+        medium.radios.append(self)
+        self.sync_word = BADGENET_SYNC_WORD
+        self.implicit_len = 0  # Nonzero while in implicit header mode
+        self.lock = asyncio.Lock()
+        self.exclusive = False
+        self.rx_queue: list[bytes] = []  # Explicit frames for the network stack
+        self.owner_rx_queue: list[bytes] = []
+        self.dropped_crc = 0
+        self.tx_implicit = 0
+
+    def hear(self, frame: bytes, implicit_len: int, sync_word: int):
+        if sync_word != self.sync_word or bool(implicit_len) != bool(self.implicit_len):
+            return  # Not detected at all
+        if self.implicit_len and len(frame) != self.implicit_len:
+            self.dropped_crc += 1  # Read as implicit_len bytes, so the CRC fails
+            return
+        (self.owner_rx_queue if self.exclusive else self.rx_queue).append(frame)
+
+    async def send(self, frame: bytes):
+        async with self.lock:
+            await self.medium.transmit(self, frame)
+
+    async def acquire(self):
+        await self.lock.acquire()
+        self.owner_rx_queue.clear()
+        self.exclusive = True
+
+    def release(self):
+        if self.implicit_len:
+            self.set_explicit_header()
+        self.exclusive = False
+        self.owner_rx_queue.clear()
+        self.lock.release()
+
+    async def send_exclusive(self, frame: bytes) -> bool:
+        if self.implicit_len:
+            self.tx_implicit += 1
+        await self.medium.transmit(self, frame)
+        return True
+
+    async def recv_exclusive(self, timeout_ms: int) -> bytes | None:
+        deadline = clock_ms() + timeout_ms
+        while not self.owner_rx_queue and clock_ms() < deadline:
+            await asyncio.sleep(0.001)
+        return self.owner_rx_queue.pop(0) if self.owner_rx_queue else None
+
+    def set_implicit_header(self, length: int, sync_word: int):
+        self.implicit_len = length
+        self.sync_word = sync_word
+
+    def set_explicit_header(self):
+        self.implicit_len = 0
+        self.sync_word = BADGENET_SYNC_WORD
+
+    def get_rssi(self) -> float:
+        return RSSI_DBM
+
+
+class SimControl(ControlWindow):
+    """ControlChannel of net/control.py, with the announcement as a raw explicit frame."""
+
+    def __init__(self, address: int, radio: EmulatedRadio, enabled: bool):
+        super().__init__(address, clock_ms, self._open_window)
+        self.radio = radio
+        self.enabled = enabled
+        self.mesh_frames: list[bytes] = []  # Explicit frames that reached the network stack
+        self.windows_joined = 0
+
+    async def _open_window(self, duration_ms: int):
+        if not self.enabled:
+            return
+        duration_ms = min(duration_ms, MAX_WINDOW_MS)
+        await self.radio.acquire()
+        await self.run_window(self.radio, duration_ms, struct.pack(ANNOUNCE, ANNOUNCE_MARKER, duration_ms), 0)
+
+    async def listen(self):
+        """Network stack receive loop, joining windows like ControlChannel._receive_window()."""
+        while True:
+            await asyncio.sleep(0.001)
+            while self.radio.rx_queue:
+                frame = self.radio.rx_queue.pop(0)
+                self.mesh_frames.append(frame)
+                if frame.startswith(ANNOUNCE_MARKER) and self.enabled and not self.in_window:
+                    duration_ms = min(struct.unpack(ANNOUNCE, frame)[1], MAX_WINDOW_MS)
+                    self.windows_joined += 1
+                    await self.radio.acquire()
+                    await self.run_window(self.radio, duration_ms, None, IDLE_TIMEOUT_MS)
+
+
+class Results:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, name: str, ok: bool, detail: str = ""):
+        print(f"  {'PASS' if ok else 'FAIL'}  {name}{f'  ({detail})' if detail else ''}")
+        if not ok:
+            self.failed += 1
+
+
+def make_badges(medium: Medium, enabled: dict[str, bool]) -> dict[str, SimControl]:
+    badges = {}
+    for index, (name, allowed) in enumerate(enabled.items()):
+        badges[name] = SimControl(0xBAD6E000 + index, EmulatedRadio(name, medium), allowed)
+    return badges
+
+
+async def check_ping(results: Results, pings: int):
+    print("Implicit decode, explicit fallback and opt-out:")
+    medium = Medium()
+    badges = make_badges(medium, {"A": True, "B": True, "C": True, "D": False})
+    listeners = [asyncio.create_task(badge.listen()) for badge in badges.values()]
+    a, b, c, d = badges.values()
+
+    async def mesh_chatter():
+        # D stays on the mesh and keeps sending explicit frames during the window
+        await asyncio.sleep(0.1)
+        for counter in range(3):
+            await d.radio.send(b"MESH" + bytes([counter]) + bytes(20))
+            await asyncio.sleep(0.05)
+
+    chatter = asyncio.create_task(mesh_chatter())
+    pongs = await a.ping(count=pings, interval_ms=50)
+    await chatter
+    await asyncio.sleep(IDLE_TIMEOUT_MS / 1000 + 0.1)  # Joiners leave the window once it goes quiet
+
+    results.check(
+        "PONGs from every badge in the window",
+        set(pongs) == {b.address, c.address},
+        ", ".join(f"{address:x}: {count}" for address, (count, _) in pongs.items()),
+    )
+    results.check("Every PING answered", all(count == pings for count, _ in pongs.values()))
+    results.check("RSSI decoded from the PONG payload", all(rssi == RSSI_DBM for _, rssi in pongs.values()))
+    results.check("Implicit frames sent", a.radio.tx_implicit == pings, f"{a.radio.tx_implicit} PINGs")
+    results.check("Opted out badge didn't join", d.windows_joined == 0 and d.address not in pongs)
+    results.check(
+        "Opted out badge heard no implicit frames",
+        all(len(frame) != CONTROL_FRAME_LEN for frame in d.mesh_frames),
+        f"{len(d.mesh_frames)} explicit frames",
+    )
+    results.check(
+        "Badges in the window missed the mesh frames",
+        not any(frame.startswith(b"MESH") for badge in (a, b, c) for frame in badge.mesh_frames),
+    )
+    results.check(
+        "Every radio back on explicit header mode",
+        all(badge.radio.implicit_len == 0 and badge.radio.sync_word == BADGENET_SYNC_WORD for badge in badges.values()),
+    )
+
+    await d.radio.send(b"MESH-AFTER" + bytes(20))
+    await a.radio.send(b"MESH-FROM-A" + bytes(20))
+    await asyncio.sleep(0.05)
+    results.check(
+        "Mesh frames decode again after the window",
+        all(any(frame.startswith(b"MESH-AFTER") for frame in badge.mesh_frames) for badge in (a, b, c))
+        and any(frame.startswith(b"MESH-FROM-A") for frame in d.mesh_frames),
+    )
+    for listener in listeners:
+        listener.cancel()
+
+
+async def check_wrong_length(results: Results):
+    print("Wrong length:")
+    medium = Medium()
+    badges = make_badges(medium, {"A": True, "B": True})
+    a, b = badges.values()
+    listener = asyncio.create_task(b.listen())
+    received = []
+    b.register_receiver(0x7F, lambda source, seq_num, payload: received.append(payload))
+    window = asyncio.create_task(a.open_window(600))
+    await asyncio.sleep(0.1)
+    # A writes raw frames on the implicit header sync word, one byte long and one byte short
+    for frame in (bytes([0x7F]) + bytes(CONTROL_FRAME_LEN), bytes([0x7F]) + bytes(CONTROL_FRAME_LEN - 2)):
+        await a.radio.send_exclusive(frame)
+    a.send(0x7F, b"right!")
+    await window
+    results.check("Frames of the wrong length failed the CRC", b.radio.dropped_crc == 2, f"{b.radio.dropped_crc} dropped")
+    results.check("Frame of the right length decoded", received == [b"right!"], repr(received))
+    listener.cancel()
+
+
+async def check_idle(results: Results):
+    print("Idle timeout:")
+    medium = Medium()
+    badges = make_badges(medium, {"A": True, "B": True})
+    a, b = badges.values()
+    listener = asyncio.create_task(b.listen())
+    window = asyncio.create_task(a.open_window(MAX_WINDOW_MS))
+    await asyncio.sleep(0.05)
+    start = clock_ms()
+    while b.windows_joined == 0 or b.in_window:
+        await asyncio.sleep(0.005)
+    left_ms = clock_ms() - start
+    results.check(
+        "Joined badge left the silent window early",
+        b.windows_joined == 1 and left_ms < MAX_WINDOW_MS // 2,
+        f"after {left_ms} ms",
+    )
+    await window
+    listener.cancel()
+
+
+async def run(args) -> int:
+    results = Results()
+    await check_ping(results, args.pings)
+    await check_wrong_length(results)
+    await check_idle(results)
+    print(f"{results.failed} checks failed" if results.failed else "All checks passed")
+    return 1 if results.failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pings", type=int, default=8)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
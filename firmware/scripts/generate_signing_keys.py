@@ -0,0 +1,54 @@
+"""Generate Ed25519 keys for authenticated messaging, 64 byte signatures instead of RSA's 128
+
+This must be run on the badge!
+mpremote run scripts/generate_signing_keys.py
+
+Keys are written raw, 32 bytes each, the way net/crypto.py loads them. Rename them to
+/data/supercon_ed25519_*.bin and set crypto_scheme to ed25519 on badges that should sign with them.
+"""
+
+
+from cryptography import ed25519, serialization
+
+
+# Generate Keys
+print("Generating Ed25519 Key")
+private_key = ed25519.Ed25519PrivateKey.generate()
+public_key = private_key.public_key()
+
+private_key_raw = private_key.private_bytes(
+    encoding=serialization.Encoding.Raw,
+    format=serialization.PrivateFormat.Raw,
+    encryption_algorithm=serialization.NoEncryption(),
+)
+public_key_raw = public_key.public_bytes(
+    encoding=serialization.Encoding.Raw,
+    format=serialization.PublicFormat.Raw,
+)
+
+print("private_key raw", private_key_raw)
+
+print("public_key raw", public_key_raw)
+
+with open("/data/new_ed25519_private.bin", "wb") as private_file:
+    private_file.write(private_key_raw)
+
+with open("/data/new_ed25519_public.bin", "wb") as public_file:
+    public_file.write(public_key_raw)
+
+# Test the keys
+
+with open("/data/new_ed25519_private.bin", "rb") as privf:
+    priv = ed25519.Ed25519PrivateKey.from_private_bytes(privf.read())
+
+with open("/data/new_ed25519_public.bin", "rb") as pubf:
+    pub = ed25519.Ed25519PublicKey.from_public_bytes(pubf.read())
+
+plaintext = b"Supercon will be so much fun!"
+signature = priv.sign(plaintext)
+print(f"Sig: {signature}, len: {len(signature)}")
+try:
+    pub.verify(signature, plaintext)
+    print("Verified: True")
+except:
+    print("Verified: False")
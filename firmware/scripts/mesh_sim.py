@@ -0,0 +1,1023 @@
+#!/bin/env python3
+"""Simulate a crowd of badges running BadgeNet, to compare network stack changes.
+
+This runs on your computer, not the badge:
+python scripts/mesh_sim.py txpower --nodes 100
+
+The model is deliberately simple but follows the firmware where it matters:
+ - Log-distance path loss with fixed per-link shadowing, SX1262 sensitivity of the PHY profile.
+ - Half duplex radios, and a frame survives an overlap only if it is CAPTURE_DB stronger.
+ - Channel access like LoraRadio._wait_channel_free(): CAD until free, then a random 0-10ms wait.
+ - Relays and duplicate suppression like BadgeNet.recv_all() and send_all(): relay the first copy
+   if TTL remains, drop queued frames seen more than once, keep half the queue for local frames,
+   and wait transmit_cooldown_s between transmissions.
+"""
+
+import argparse
+from collections import deque
+import heapq
+import io
+import itertools
+import math
+import pathlib
+import random
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "badge"))
+
+from net.dtn import RECENTLY_HEARD_S, StoreForwardCache  # noqa: E402
+from net.fountain import SYMBOL_HEADER_LEN, SYMBOL_SIZE, LtDecoder, LtEncoder, block_count  # noqa: E402
+from net.netcode import NetworkCoder  # noqa: E402
+from net.phy import DEFAULT_PROFILE, PROFILES, symbol_time_us, time_on_air_us  # noqa: E402
+from net.tdma import CHANNEL_ACCESS_MS, CONTENTION_SLOT, SLOTS, SlotClock, SlotSchedule  # noqa: E402
+from net.ticks import TICKS_PERIOD  # noqa: E402
+from net.ttl import HopTable  # noqa: E402
+from net.txpower import TxPowerController  # noqa: E402
+
+BROADCAST = -1
+HEADER_LEN = 16
+CHAT_PAYLOAD_LEN = 112  # TEXT_CHAT
+QUEUE_LEN = 20
+TRANSMIT_COOLDOWN_US = 100_000
+CAD_BACKOFF_MAX_US = 10_000
+PATH_LOSS_1M_DB = 40.0
+PATH_LOSS_EXPONENT = 4.0  # Crowded hall, bodies absorb a lot
+SHADOWING_DB = 4.0
+CAPTURE_DB = 6.0
+
+
+class Frame:
+    """A BadgeNet frame in flight. Relays share msg_id, like frames share a checksum."""
+
+    __slots__ = ("msg_id", "origin", "destination", "ttl", "initial_ttl", "length", "port", "data")
+
+    def __init__(self, msg_id, origin, destination, ttl, length, port=0, data=None, initial_ttl=None):
+        self.msg_id = msg_id
+        self.origin = origin
+        self.destination = destination
+        self.ttl = ttl
+        self.initial_ttl = ttl if initial_ttl is None else initial_ttl
+        self.length = length
+        self.port = port
+        self.data = data
+
+    def relay(self):
+        return Frame(
+            self.msg_id, self.origin, self.destination, self.ttl - 1, self.length, self.port, self.data, self.initial_ttl
+        )
+
+
+class Transmission:
+    __slots__ = ("sender", "frame", "start", "end", "rssi", "heard", "overlaps")
+
+    def __init__(self, sender, frame, start, end, rssi, sensitivity_dbm):
+        self.sender = sender
+        self.frame = frame
+        self.start = start
+        self.end = end
+        self.rssi = rssi  # At each node
+        self.heard = [index for index, value in enumerate(rssi) if value >= sensitivity_dbm and index != sender.index]
+        self.overlaps = []  # Other transmissions on air at the same time
+
+    def received(self):
+        """Nodes that received this transmission. Overlapping transmissions stop it wherever they were
+        transmitting themselves (half duplex) or it wasn't CAPTURE_DB louder than them."""
+        if not self.overlaps:
+            return set(self.heard)
+        senders = {other.sender.index for other in self.overlaps}
+        rssi = self.rssi
+        survivors = [index for index in self.heard if index not in senders]
+        for other in self.overlaps:
+            if not survivors:
+                break
+            theirs = other.rssi
+            survivors = [index for index in survivors if rssi[index] >= theirs[index] + CAPTURE_DB]
+        return set(survivors)
+
+
+class Node:
+    """One badge. Subclass and override the hooks to try changes to the network stack."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        self.sim = sim
+        self.index = index
+        self.x = x
+        self.y = y
+        self.tx_power = tx_power
+        self.queue = deque([], QUEUE_LEN)
+        self.seen = {}  # msg_id: count
+        self.sending = False
+        self.transmitting = None
+        self.last_tx_end = -TRANSMIT_COOLDOWN_US
+        self.heard_airtime_us = 0  # Airtime of every transmission that reached here, overlaps included
+        self.busy_us = 0  # Time the channel was busy here
+        self.busy_until = 0
+
+    # Hooks
+    def observe(self, frame, rssi, duplicate):
+        """Called for every frame heard, before duplicate suppression, like BadgeNet observers."""
+
+    def deliver(self, frame):
+        self.sim.record_delivery(self, frame)
+
+    def should_relay(self, frame):
+        return frame.destination != self.index and frame.ttl > 0
+
+    # BadgeNet
+    def send(self, frame):
+        self.queue.append(frame)
+        self.kick()
+
+    def receive(self, frame, rssi):
+        count = self.seen.get(frame.msg_id, 0)
+        self.observe(frame, rssi, count > 0)
+        self.seen[frame.msg_id] = count + 1
+        if count:
+            return
+        if self.should_relay(frame) and len(self.queue) < QUEUE_LEN // 2:
+            self.queue.append(frame.relay())
+            self.kick()
+        if frame.destination in (self.index, BROADCAST) and frame.origin != self.index:
+            self.deliver(frame)
+
+    def next_frame(self):
+        while self.queue:
+            frame = self.queue.popleft()
+            if self.seen.get(frame.msg_id, 0) > 1:
+                continue
+            if len(self.queue) > QUEUE_LEN // 2 and frame.origin != self.index:
+                continue
+            return frame
+        return None
+
+    def kick(self):
+        if self.sending or not self.queue:
+            return
+        self.sending = True
+        start = max(self.sim.now, self.last_tx_end + TRANSMIT_COOLDOWN_US)
+        self.sim.schedule(start, self._start_send)
+
+    def _start_send(self):
+        frame = self.next_frame()
+        if frame is None:
+            self.sending = False
+            return
+        self._cad(frame)
+
+    def _cad(self, frame):
+        self.sim.schedule(self.sim.now + self.sim.cad_us, self._cad_done, frame)
+
+    def _cad_done(self, frame):
+        busy_until = self.sim.channel_busy_until(self)
+        if busy_until is not None:
+            # Every CAD would find the channel busy until that transmission ends, so skip ahead
+            cads = -(-(busy_until - self.sim.now) // self.sim.cad_us)
+            self.sim.schedule(self.sim.now + cads * self.sim.cad_us, self._cad_done, frame)
+        else:
+            self.sim.schedule(self.sim.now + random.randrange(CAD_BACKOFF_MAX_US), self._transmit, frame)
+
+    def _transmit(self, frame):
+        self.sim.transmit(self, frame)
+
+    def transmit_done(self, frame):
+        self.seen[frame.msg_id] = 2
+        self.last_tx_end = self.sim.now
+        self.sending = False
+        self.kick()
+
+
+class Simulator:
+    def __init__(self, node_count, width_m, height_m, node_factory=Node, tx_power=9, profile=DEFAULT_PROFILE, seed=1):
+        random.seed(seed)
+        self.traffic_random = random.Random(seed)  # Same traffic whatever the nodes do with random
+        self.profile = PROFILES[profile]
+        self.cad_us = int(2 * symbol_time_us(self.profile.sf, self.profile.bw_khz))
+        self.now = 0
+        self.events = []
+        self.event_count = 0
+        self.nodes = [
+            node_factory(self, index, random.uniform(0, width_m), random.uniform(0, height_m), tx_power)
+            for index in range(node_count)
+        ]
+        self.path_loss = [[0.0] * node_count for _ in range(node_count)]
+        for a in range(node_count):
+            for b in range(a + 1, node_count):
+                na, nb = self.nodes[a], self.nodes[b]
+                distance = max(1.0, math.hypot(na.x - nb.x, na.y - nb.y))
+                loss = PATH_LOSS_1M_DB + 10 * PATH_LOSS_EXPONENT * math.log10(distance)
+                loss += random.gauss(0, SHADOWING_DB)
+                self.path_loss[a][b] = self.path_loss[b][a] = loss
+        self.active = []
+        self.next_msg_id = 0
+        self.stats = {"transmissions": 0, "relays": 0, "airtime_us": 0, "collisions": 0, "latency_us": 0}
+        self.messages = {}  # msg_id: [origin, destination, created, delivered count]
+        self.measure_from_us = 0
+
+    def schedule(self, time_us, callback, *args):
+        self.event_count += 1
+        heapq.heappush(self.events, (time_us, self.event_count, callback, args))
+
+    def run(self, until_us):
+        while self.events and self.events[0][0] <= until_us:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+        self.now = until_us
+
+    def rssi(self, sender, receiver):
+        return sender.tx_power - self.path_loss[sender.index][receiver.index]
+
+    def channel_busy_until(self, node):
+        """When the first transmission the node can hear ends, or None if the channel is free."""
+        sensitivity_dbm = self.profile.sensitivity_dbm
+        index = node.index
+        return min(
+            (tx.end for tx in self.active if tx.sender is not node and tx.rssi[index] >= sensitivity_dbm),
+            default=None,
+        )
+
+    def new_message(self, origin, destination, ttl, length=HEADER_LEN + CHAT_PAYLOAD_LEN, port=0, data=None):
+        frame = Frame(self.next_msg_id, origin.index, destination, ttl, length, port, data)
+        self.next_msg_id += 1
+        if self.now >= self.measure_from_us:
+            self.messages[frame.msg_id] = [origin.index, destination, self.now, 0]
+        return frame
+
+    def record_delivery(self, node, frame):
+        record = self.messages.get(frame.msg_id)
+        if record is not None:
+            record[3] += 1
+            self.stats["latency_us"] += self.now - record[2]
+
+    def transmit(self, sender, frame):
+        airtime = time_on_air_us(
+            frame.length, self.profile.sf, self.profile.bw_khz, self.profile.cr, self.profile.preamble_len
+        )
+        rssi = [sender.tx_power - loss for loss in self.path_loss[sender.index]]
+        tx = Transmission(sender, frame, self.now, self.now + airtime, rssi, self.profile.sensitivity_dbm)
+        tx.overlaps = list(self.active)
+        for other in self.active:
+            other.overlaps.append(tx)
+        if self.now >= self.measure_from_us:
+            self.stats["transmissions"] += 1
+            self.stats["relays"] += frame.origin != sender.index
+            self.stats["airtime_us"] += airtime
+            for index in tx.heard:
+                node = self.nodes[index]
+                node.heard_airtime_us += airtime
+                if tx.end > node.busy_until:
+                    node.busy_us += tx.end - max(self.now, node.busy_until)
+                    node.busy_until = tx.end
+        sender.transmitting = tx
+        self.active.append(tx)
+        self.schedule(tx.end, self._transmission_end, tx)
+
+    def _transmission_end(self, tx):
+        self.active.remove(tx)
+        tx.sender.transmitting = None
+        received = tx.received()
+        tx.overlaps = []
+        for index in tx.heard:
+            node = self.nodes[index]
+            if index not in received:
+                if node.transmitting is None and self.now >= self.measure_from_us:
+                    self.stats["collisions"] += 1
+                continue
+            node.receive(tx.frame, tx.rssi[index])
+        tx.sender.transmit_done(tx.frame)
+
+    def chat_traffic(self, interval_s, ttl, until_us):
+        """Every badge broadcasts a chat message every interval_s on average."""
+        for node in self.nodes:
+            self.schedule(int(self.traffic_random.expovariate(1 / interval_s) * 1e6), self._chat, node, interval_s, ttl, until_us)
+
+    def _chat(self, node, interval_s, ttl, until_us):
+        if self.now >= until_us:
+            return
+        node.send(self.new_message(node, BROADCAST, ttl))
+        self.schedule(self.now + int(self.traffic_random.expovariate(1 / interval_s) * 1e6), self._chat, node, interval_s, ttl, until_us)
+
+    def unicast_traffic(self, interval_s, ttl, until_us):
+        """Every badge sends a unicast message to a random other badge every interval_s on average."""
+        for node in self.nodes:
+            self.schedule(int(self.traffic_random.expovariate(1 / interval_s) * 1e6), self._unicast, node, interval_s, ttl, until_us)
+
+    def _unicast(self, node, interval_s, ttl, until_us):
+        if self.now >= until_us:
+            return
+        destination = self.traffic_random.randrange(len(self.nodes) - 1)
+        if destination >= node.index:
+            destination += 1
+        node.send(self.new_message(node, destination, ttl))
+        self.schedule(self.now + int(self.traffic_random.expovariate(1 / interval_s) * 1e6), self._unicast, node, interval_s, ttl, until_us)
+
+    def report(self, duration_us):
+        """Summary statistics for the measured part of the run."""
+        others = len(self.nodes) - 1
+        broadcasts = [record for record in self.messages.values() if record[1] == BROADCAST]
+        delivery = sum(record[3] for record in broadcasts) / max(1, len(broadcasts) * others)
+        unicasts = [record for record in self.messages.values() if record[1] != BROADCAST]
+        node_us = len(self.nodes) * duration_us
+        return {
+            "messages": len(self.messages),
+            "transmissions": self.stats["transmissions"],
+            "tx per message": self.stats["transmissions"] / max(1, len(self.messages)),
+            "relays": self.stats["relays"],
+            "channel load": sum(node.heard_airtime_us for node in self.nodes) / node_us,
+            "channel busy": sum(node.busy_us for node in self.nodes) / node_us,
+            "broadcast delivery": delivery,
+            "unicast delivery": sum(record[3] > 0 for record in unicasts) / max(1, len(unicasts)),
+            "mean latency s": self.stats["latency_us"] / max(1, sum(record[3] for record in self.messages.values())) / 1e6,
+            "collided receptions": self.stats["collisions"],
+            "mean tx power dBm": sum(node.tx_power for node in self.nodes) / len(self.nodes),
+        }
+
+
+def print_table(rows: list[tuple], headers: tuple):
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+    print()
+
+
+def print_reports(reports: dict):
+    names = list(reports)
+    rows = []
+    for key in reports[names[0]]:
+        cells = [reports[name][key] for name in names]
+        rows.append((key, *(f"{cell:.3f}" if isinstance(cell, float) else cell for cell in cells)))
+    print_table(rows, ("", *names))
+
+
+class AutoPowerNode(Node):
+    """Node running TxPowerController from net/txpower.py, updated like PhyManager does."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        super().__init__(sim, index, x, y, tx_power)
+        self.controller = TxPowerController(tx_power, min_dbm=-9, max_dbm=14)
+
+    def observe(self, frame, rssi, duplicate):
+        self.controller.record_frame(rssi, duplicate)
+
+    def update_power(self):
+        self.tx_power = self.controller.update()
+
+
+def txpower(args):
+    duration_us = int(args.duration * 1e6)
+    warmup_us = int(args.warmup * 1e6)
+    reports = {}
+    for name, factory in (("fixed", Node), ("auto", AutoPowerNode)):
+        sim = Simulator(args.nodes, args.width, args.height, factory, args.power, seed=args.seed)
+        sim.measure_from_us = warmup_us
+        sim.chat_traffic(args.interval, args.ttl, warmup_us + duration_us)
+        if factory is AutoPowerNode:
+            period_us = args.period * 1_000_000
+            for time_us in range(period_us, warmup_us + duration_us, period_us):
+                for node in sim.nodes:
+                    # Badges boot at different times, so don't update in lockstep
+                    sim.schedule(time_us + random.randrange(period_us), node.update_power)
+        sim.run(warmup_us + duration_us)
+        reports[name] = sim.report(duration_us)
+    print(f"{args.nodes} badges in {args.width:g}x{args.height:g}m, chat every {args.interval:g}s, TTL {args.ttl}\n")
+    print_reports(reports)
+
+
+TDMA_BEACON_PORT = 24
+TDMA_BEACON_LEN = 26
+BEACON_INTERVAL_US = 20_000_000
+
+
+class TdmaNode(Node):
+    """Node using the slotted TDMA MAC from net/tdma_manager.py, with a drifting local clock."""
+
+    def __init__(self, sim, index, x, y, tx_power, slots=SLOTS):
+        super().__init__(sim, index, x, y, tx_power)
+        self.clock_offset_ms = random.randrange(TICKS_PERIOD)
+        self.clock_drift = random.uniform(-20e-6, 20e-6)  # Crystal tolerance
+        self.clock = SlotClock(index)
+        self.schedule = SlotSchedule.for_profile(sim.profile, slots)
+        self.salt = 0
+        self.slot = self.schedule.hashed_slot(index)
+        self.synced_since_ms = 0
+        self.beacons_heard = 0
+        sim.schedule(random.randrange(BEACON_INTERVAL_US), self._beacon_timer)
+
+    def local_ms(self):
+        return (int(self.sim.now * (1 + self.clock_drift)) // 1000 + self.clock_offset_ms) % TICKS_PERIOD
+
+    def synced(self):
+        return self.clock.synced(self.local_ms())
+
+    def airtime_ms(self, frame):
+        profile = self.sim.profile
+        airtime_us = time_on_air_us(frame.length, profile.sf, profile.bw_khz, profile.cr, profile.preamble_len)
+        return airtime_us // 1000 + 1 + CHANNEL_ACCESS_MS
+
+    def slot_wait_us(self, frame, slot):
+        if not self.synced():
+            return 0
+        network_ms = self.clock.network_ms(self.local_ms())
+        return self.schedule.wait_ms(network_ms, slot, self.airtime_ms(frame)) * 1000
+
+    def tx_slot(self):
+        newcomer_ms = 2 * self.schedule.superframe_ms
+        if (self.local_ms() - self.synced_since_ms) % TICKS_PERIOD < newcomer_ms:
+            return CONTENTION_SLOT
+        return self.slot
+
+    def receive(self, frame, rssi):
+        if frame.port != TDMA_BEACON_PORT:
+            super().receive(frame, rssi)
+            return
+        beacon_ms, root, hops, slot = frame.data
+        was_synced = self.synced()
+        profile = self.sim.profile
+        airtime_us = time_on_air_us(frame.length, profile.sf, profile.bw_khz, profile.cr, profile.preamble_len)
+        self.clock.sync(self.local_ms(), beacon_ms, airtime_us, root, hops)
+        if root == self.clock.root and hops <= self.clock.hops:
+            self.beacons_heard += 1
+        if not was_synced and self.synced():
+            self.synced_since_ms = self.local_ms()
+        if slot == self.slot and frame.origin < self.index:
+            self.salt += 1
+            self.slot = self.schedule.hashed_slot(self.index, self.salt)
+
+    def _beacon_timer(self):
+        if self.clock.root == self.index or self.beacons_heard < 2:
+            self.queue.appendleft(Frame(-1, self.index, BROADCAST, 0, TDMA_BEACON_LEN, TDMA_BEACON_PORT))
+            self.kick()
+        self.beacons_heard = 0
+        self.sim.schedule(
+            self.sim.now + BEACON_INTERVAL_US // 2 + random.randrange(BEACON_INTERVAL_US // 2), self._beacon_timer
+        )
+
+    def next_frame(self):
+        if self.queue and self.queue[0].port == TDMA_BEACON_PORT:
+            return self.queue.popleft()
+        return super().next_frame()
+
+    def _start_send(self):
+        frame = self.next_frame()
+        if frame is None:
+            self.sending = False
+            return
+        slot = CONTENTION_SLOT if frame.port == TDMA_BEACON_PORT else self.tx_slot()
+        self.sim.schedule(self.sim.now + self.slot_wait_us(frame, slot), self._cad, frame)
+
+    def _transmit(self, frame):
+        if frame.port == TDMA_BEACON_PORT:
+            # Timestamped right before going on air
+            network_ms = self.clock.network_ms(self.local_ms())
+            frame.data = (network_ms, self.clock.root, self.clock.hops, self.slot)
+        self.sim.transmit(self, frame)
+
+    def transmit_done(self, frame):
+        if frame.port == TDMA_BEACON_PORT:
+            self.last_tx_end = self.sim.now
+            self.sending = False
+            self.kick()
+            return
+        super().transmit_done(frame)
+
+
+def tdma(args):
+    duration_us = int(args.duration * 1e6)
+    warmup_us = int(args.warmup * 1e6)
+    rows = []
+    for node_count in args.nodes:
+        reports = {}
+        tdma_factory = lambda *node_args: TdmaNode(*node_args, slots=args.slots)  # noqa: E731
+        for name, factory in (("csma", Node), ("tdma", tdma_factory)):
+            sim = Simulator(node_count, args.width, args.height, factory, seed=args.seed)
+            sim.measure_from_us = warmup_us
+            sim.chat_traffic(args.interval, args.ttl, warmup_us + duration_us)
+            sim.run(warmup_us + duration_us)
+            reports[name] = report = sim.report(duration_us)
+            if factory is tdma_factory:
+                synced = sum(node.synced() for node in sim.nodes) / node_count
+                roots = len({node.clock.root for node in sim.nodes})
+                report["synced"] = f"{100 * synced:.0f}%, {roots} clocks"
+            else:
+                report["synced"] = "-"
+        for name, report in reports.items():
+            rows.append(
+                (
+                    node_count,
+                    name,
+                    report["messages"],
+                    report["transmissions"],
+                    f"{report['broadcast delivery']:.3f}",
+                    f"{report['mean latency s']:.2f}",
+                    report["collided receptions"],
+                    f"{report['channel load']:.3f}",
+                    report["synced"],
+                )
+            )
+        print(f"{node_count} badges done", file=sys.stderr)
+    print(f"{args.width:g}x{args.height:g}m, chat every {args.interval:g}s per badge, TTL {args.ttl}\n")
+    print_table(
+        rows,
+        ("Badges", "MAC", "Messages", "Transmissions", "Delivery", "Latency s", "Collided rx", "Load", "Synced"),
+    )
+
+
+NET_CODED_PORT = 25
+coded_ids = itertools.count(-2, -1)  # Coded frames aren't messages, -1 is for beacons
+
+
+def frame_bytes(frame):
+    """BadgeNet header for a simulated frame, with the msg_id as checksum, padded to its length."""
+    destination = 0xFFFFFFFF if frame.destination == BROADCAST else frame.destination
+    header = (
+        b"\x07\xe9"
+        + (frame.msg_id & 0xFFFF).to_bytes(2, "big")
+        + bytes((frame.ttl, frame.length))
+        + destination.to_bytes(4, "big")
+        + frame.origin.to_bytes(4, "big")
+        + bytes((frame.port, 0))
+    )
+    return header + bytes(frame.length - HEADER_LEN)
+
+
+def frame_from_bytes(data):
+    destination = int.from_bytes(data[6:10], "big")
+    return Frame(
+        int.from_bytes(data[2:4], "big"),
+        int.from_bytes(data[10:14], "big"),
+        BROADCAST if destination == 0xFFFFFFFF else destination,
+        data[4] & 0x0F,
+        len(data),
+        data[14],
+    )
+
+
+class CodingNode(Node):
+    """Node relaying with XOR network coding from net/netcode.py, like BadgeNet with net_coding on."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        super().__init__(sim, index, x, y, tx_power)
+        self.coder = NetworkCoder()
+        self.late_drops = 0  # Relays heard from others while waiting for the channel
+
+    def receive(self, frame, rssi):
+        if frame.port == NET_CODED_PORT:
+            decoded = self.coder.record_coded(frame.data, frame.origin)
+        else:
+            decoded = self.coder.record_native(frame_bytes(frame))
+        super().receive(frame, rssi)
+        for data in decoded:
+            super().receive(frame_from_bytes(data), rssi)
+
+    def code_relays(self, frame):
+        while self.queue and self.seen.get(self.queue[0].msg_id, 0) > 1:
+            self.queue.popleft()  # Would be dropped anyway
+        if not self.queue or self.queue[0].origin == self.index:
+            return frame
+        partner = self.queue[0]
+        first, second = frame_bytes(frame), frame_bytes(partner)
+        if not self.coder.can_code(first, second):
+            return frame
+        self.queue.popleft()
+        payload = self.coder.encode(first, second)
+        return Frame(next(coded_ids), self.index, BROADCAST, 0, HEADER_LEN + len(payload), NET_CODED_PORT, payload)
+
+    def _transmit(self, frame):
+        if frame.origin != self.index:
+            # Decided right before going on air, like BadgeNet.send_all() after its waits
+            if self.seen.get(frame.msg_id, 0) > 1:
+                self.late_drops += 1
+                self.sending = False
+                self.kick()
+                return
+            frame = self.code_relays(frame)
+        super()._transmit(frame)
+
+    def transmit_done(self, frame):
+        if frame.port == NET_CODED_PORT:
+            self.seen[frame.msg_id] = 2
+            for msg_id in (int.from_bytes(frame.data[0:2], "big"), int.from_bytes(frame.data[2:4], "big")):
+                self.seen[msg_id] = 2
+        super().transmit_done(frame)
+
+
+def netcode(args):
+    duration_us = int(args.duration * 1e6)
+    warmup_us = int(args.warmup * 1e6)
+    rows = []
+    for node_count in args.nodes:
+        for name, factory in (("plain", Node), ("coded", CodingNode)):
+            sim = Simulator(node_count, args.width, args.height, factory, seed=args.seed)
+            sim.measure_from_us = warmup_us
+            sim.chat_traffic(args.interval, args.ttl, warmup_us + duration_us)
+            sim.run(warmup_us)
+            for node in sim.nodes:
+                if factory is CodingNode:
+                    node.coder.coded_sent = node.coder.decoded = node.late_drops = 0
+            sim.run(warmup_us + duration_us)
+            assert sim.next_msg_id < 0x10000, "msg_id doubles as the 16 bit checksum"
+            report = sim.report(duration_us)
+            coded = decoded = late_drops = 0
+            if factory is CodingNode:
+                coded = sum(node.coder.coded_sent for node in sim.nodes)
+                decoded = sum(node.coder.decoded for node in sim.nodes)
+                late_drops = sum(node.late_drops for node in sim.nodes)
+            rows.append(
+                (
+                    node_count,
+                    name,
+                    report["messages"],
+                    report["transmissions"],
+                    coded,
+                    decoded,
+                    late_drops,
+                    f"{report['broadcast delivery']:.3f}",
+                    f"{report['mean latency s']:.2f}",
+                    f"{report['channel load']:.3f}",
+                )
+            )
+        print(f"{node_count} badges done", file=sys.stderr)
+    print(f"{args.width:g}x{args.height:g}m, chat every {args.interval:g}s per badge, TTL {args.ttl}\n")
+    print_table(
+        rows,
+        ("Badges", "Relays", "Messages", "Transmissions", "Coded", "Decoded", "Late drops", "Delivery", "Latency s", "Load"),
+    )
+    print("Each coded frame replaces two relays. Late drops are relays already heard twice by the time the channel")
+    print("was free, which the coded relays check for again right before going on air.")
+
+
+class AdaptiveTtlNode(Node):
+    """Node learning hop distances and picking TTLs with HopTable from net/ttl.py, like BadgeNet with
+    net_adaptive_ttl on."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        super().__init__(sim, index, x, y, tx_power)
+        self.hop_table = HopTable()
+
+    def send(self, frame):
+        frame.ttl = frame.initial_ttl = self.hop_table.ttl_for(frame.destination, frame.ttl, BROADCAST, self.sim.now / 1e6)
+        super().send(frame)
+
+    def receive(self, frame, rssi):
+        if frame.initial_ttl:  # Like hops_taken()
+            self.hop_table.record(frame.origin, frame.initial_ttl - frame.ttl, self.sim.now / 1e6)
+        super().receive(frame, rssi)
+
+
+def ttl(args):
+    duration_us = int(args.duration * 1e6)
+    warmup_us = int(args.warmup * 1e6)
+    rows = []
+    for size in args.sizes:
+        width, height = (float(meters) for meters in size.split("x"))
+        for name, factory in (("fixed", Node), ("adaptive", AdaptiveTtlNode)):
+            sim = Simulator(args.nodes, width, height, factory, seed=args.seed)
+            sim.measure_from_us = warmup_us
+            sim.chat_traffic(args.interval, args.ttl, warmup_us + duration_us)
+            sim.unicast_traffic(args.unicast_interval, args.unicast_ttl, warmup_us + duration_us)
+            sim.run(warmup_us + duration_us)
+            report = sim.report(duration_us)
+            rows.append(
+                (
+                    size,
+                    name,
+                    report["messages"],
+                    report["relays"],
+                    report["transmissions"],
+                    f"{report['broadcast delivery']:.3f}",
+                    f"{report['unicast delivery']:.3f}",
+                    f"{report['channel load']:.3f}",
+                )
+            )
+        print(f"{size} done", file=sys.stderr)
+    print(
+        f"{args.nodes} badges, chat every {args.interval:g}s with TTL {args.ttl}, "
+        f"unicast every {args.unicast_interval:g}s with TTL {args.unicast_ttl}\n"
+    )
+    print_table(rows, ("Area m", "TTL", "Messages", "Relays", "Transmissions", "Broadcast dlv", "Unicast dlv", "Load"))
+
+
+class SleepyNode(Node):
+    """Node whose badge goes to sleep, radio off, for stretches of time, like a badge in a bag. What it
+    sends while asleep waits until it wakes up."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        super().__init__(sim, index, x, y, tx_power)
+        self.awake = True
+        self.sleep_random = random.Random(index)  # Same sleep pattern whatever the node does with random
+
+    def start_sleeping(self, awake_s, asleep_s):
+        self.awake = self.sleep_random.random() < awake_s / (awake_s + asleep_s)
+        self._toggle_later(awake_s, asleep_s)
+
+    def _toggle_later(self, awake_s, asleep_s):
+        mean_s = awake_s if self.awake else asleep_s
+        self.sim.schedule(self.sim.now + int(self.sleep_random.expovariate(1 / mean_s) * 1e6), self._toggle, awake_s, asleep_s)
+
+    def _toggle(self, awake_s, asleep_s):
+        self.awake = not self.awake
+        self._toggle_later(awake_s, asleep_s)
+        self.kick()
+
+    def receive(self, frame, rssi):
+        if self.awake:
+            super().receive(frame, rssi)
+
+    def kick(self):
+        if self.awake:
+            super().kick()
+
+
+class DtnNode(SleepyNode):
+    """Sleepy node with the store-and-forward cache from net/dtn.py, like BadgeNet with net_dtn on."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        super().__init__(sim, index, x, y, tx_power)
+        self.hop_table = HopTable()
+        self.cache = StoreForwardCache()
+
+    def recently_heard(self, address):
+        entry = self.hop_table.hops.get(address)
+        return entry is not None and self.sim.now / 1e6 - entry[1] < RECENTLY_HEARD_S
+
+    def send(self, frame):
+        if frame.destination != BROADCAST and not self.recently_heard(frame.destination):
+            self.cache.store(frame.destination, frame_bytes(frame), self.sim.now / 1e6)
+        super().send(frame)
+
+    def receive(self, frame, rssi):
+        if not self.awake:
+            return
+        now_s = self.sim.now / 1e6
+        hops = None if frame.initial_ttl == 0 else frame.initial_ttl - frame.ttl  # Like hops_taken()
+        if hops is not None:
+            self.hop_table.record(frame.origin, hops, now_s)
+        if hops == 0 and self.cache.holds_for(frame.origin):
+            # Random start, so other badges holding the same frames hear the first one go out and skip it
+            start_us = self.sim.now + random.randrange(DTN_FORWARD_JITTER_US)
+            for i, data in enumerate(self.cache.take(frame.origin, now_s)):
+                forward = frame_from_bytes(data)  # TTL 0, just to the destination
+                self.seen[forward.msg_id] = 1  # Seen again means another badge forwarded it
+                self.sim.schedule(start_us + i * DTN_FORWARD_INTERVAL_US, self._forward, forward)
+        if (
+            frame.msg_id not in self.seen
+            and frame.destination not in (BROADCAST, self.index)
+            and frame.origin != self.index
+            and not self.recently_heard(frame.destination)
+        ):
+            self.cache.store(frame.destination, frame_bytes(frame), now_s)
+        super().receive(frame, rssi)
+
+    def _forward(self, frame):
+        if self.seen[frame.msg_id] > 1 or len(self.queue) >= QUEUE_LEN // 2:
+            return
+        self.queue.append(frame)
+        self.kick()
+
+
+DTN_FORWARD_INTERVAL_US = 500_000  # DTN_FORWARD_INTERVAL_MS in net/net.py
+DTN_FORWARD_JITTER_US = 2_000_000  # DTN_FORWARD_JITTER_MS
+
+
+def dtn(args):
+    duration_us = int(args.duration * 1e6)
+    warmup_us = int(args.warmup * 1e6)
+    until_us = warmup_us + duration_us
+    rows = []
+    for asleep_s in args.asleep:
+        for name, factory in (("plain", SleepyNode), ("dtn", DtnNode)):
+            sim = Simulator(args.nodes, args.width, args.height, factory, seed=args.seed)
+            sim.measure_from_us = warmup_us
+            for node in sim.nodes:
+                if asleep_s:
+                    node.start_sleeping(args.awake, asleep_s)
+            sim.chat_traffic(args.interval, args.ttl, until_us)
+            sim.unicast_traffic(args.unicast_interval, args.unicast_ttl, until_us)
+            # Measured messages get time to be delivered after traffic stops
+            sim.run(until_us + int(args.drain * 1e6))
+            report = sim.report(duration_us)
+            stored = sum(node.cache.stored for node in sim.nodes) if factory is DtnNode else 0
+            forwarded = sum(node.cache.flushed for node in sim.nodes) if factory is DtnNode else 0
+            rows.append(
+                (
+                    f"{asleep_s:g}",
+                    name,
+                    report["messages"],
+                    report["transmissions"],
+                    stored,
+                    forwarded,
+                    f"{report['unicast delivery']:.3f}",
+                    f"{report['broadcast delivery']:.3f}",
+                    f"{report['mean latency s']:.1f}",
+                )
+            )
+        print(f"asleep {asleep_s:g}s done", file=sys.stderr)
+    print(
+        f"{args.nodes} badges in {args.width:g}x{args.height:g}m, awake {args.awake:g}s at a time on average, "
+        f"chat every {args.interval:g}s with TTL {args.ttl}, unicast every {args.unicast_interval:g}s with TTL {args.unicast_ttl}\n"
+    )
+    print_table(
+        rows, ("Asleep s", "Variant", "Messages", "Transmissions", "Stored", "Forwarded", "Unicast dlv", "Broadcast dlv", "Latency s")
+    )
+    print("Unicast covers direct messages and game invites (session JOINs). Latency is the mean over all deliveries.")
+
+
+FOUNTAIN_SYMBOL_PORT = 30
+FOUNTAIN_FILE_ID = 0x5C2025
+SEED_INTERVAL_US = 500_000  # SEED_INTERVAL_MS in net/fountain_manager.py
+SEED_SYMBOLS_PER_BLOCK = 3
+RESEED_SYMBOLS_PER_BLOCK = 1
+
+
+class FountainNode(Node):
+    """Node collecting a fountain coded file with LtDecoder from net/fountain.py, like FileDistribution in
+    net/fountain_manager.py. Every node knows the manifest, which the real thing sends every 20 symbols."""
+
+    def __init__(self, sim, index, x, y, tx_power):
+        super().__init__(sim, index, x, y, tx_power)
+        self.decoder = None
+        self.encoder = None
+        self.completed_us = None
+
+    def start(self, file, symbol_ttl, reseed_interval_us):
+        self.file = file
+        self.symbol_ttl = symbol_ttl
+        self.reseed_interval_us = reseed_interval_us
+        k = block_count(len(file))
+        output = io.BytesIO(bytes(k * SYMBOL_SIZE))
+        self.decoder = LtDecoder(FOUNTAIN_FILE_ID, k, SYMBOL_SIZE, output, io.BytesIO())
+
+    def seed(self, interval_us, symbols_per_block):
+        self.completed_us = self.sim.now
+        self.encoder = LtEncoder(FOUNTAIN_FILE_ID, self.decoder.k, SYMBOL_SIZE, io.BytesIO(self.file))
+        self._stream(interval_us, self.decoder.k * symbols_per_block)
+
+    def _stream(self, interval_us, symbols_left):
+        if symbols_left <= 0:
+            return
+        if len(self.queue) < QUEUE_LEN // 2:
+            symbol_id = self.sim.traffic_random.getrandbits(16)
+            frame = Frame(
+                self.sim.next_msg_id,
+                self.index,
+                BROADCAST,
+                self.symbol_ttl,
+                HEADER_LEN + SYMBOL_HEADER_LEN + SYMBOL_SIZE,
+                FOUNTAIN_SYMBOL_PORT,
+                (symbol_id, self.encoder.symbol(symbol_id)),
+            )
+            self.sim.next_msg_id += 1
+            self.sim.stats["fountain"] += 1
+            self.send(frame)
+        self.sim.schedule(self.sim.now + interval_us, self._stream, interval_us, symbols_left - 1)
+
+    def _transmit(self, frame):
+        if frame.port == FOUNTAIN_SYMBOL_PORT and frame.origin != self.index:
+            self.sim.stats["fountain"] += 1
+        super()._transmit(frame)
+
+    def deliver(self, frame):
+        if frame.port != FOUNTAIN_SYMBOL_PORT:
+            super().deliver(frame)
+            return
+        if self.decoder is None or self.decoder.complete():
+            return
+        self.decoder.add(*frame.data)
+        if self.decoder.complete():
+            self.decoder.output.seek(0)
+            assert self.decoder.output.read(len(self.file)) == self.file, "Decoded wrong"
+            self.completed_us = self.sim.now
+            if self.reseed_interval_us:
+                self.seed(self.reseed_interval_us, RESEED_SYMBOLS_PER_BLOCK)
+
+
+def fountain(args):
+    warmup_us = int(args.warmup * 1e6)
+    until_us = warmup_us + int(args.duration * 1e6)
+    file = random.Random(args.seed).randbytes(args.size)
+    k = block_count(args.size)
+    variants = [("seed only", 0, 0), (f"flood TTL {args.flood_ttl}", args.flood_ttl, 0)]
+    variants += [(f"re-seed {interval:g}s", 0, interval) for interval in args.reseed]
+    rows = []
+    for name, symbol_ttl, reseed_s in variants:
+        sim = Simulator(args.nodes, args.width, args.height, FountainNode, seed=args.seed)
+        sim.stats["fountain"] = 0
+        sim.chat_traffic(args.interval, args.ttl, until_us)
+        for node in sim.nodes:
+            node.start(file, symbol_ttl, int(reseed_s * 1e6))
+        seed_node = min(sim.nodes, key=lambda node: math.hypot(node.x - args.width / 2, node.y - args.height / 2))
+        sim.schedule(warmup_us, seed_node.seed, SEED_INTERVAL_US, SEED_SYMBOLS_PER_BLOCK)
+        sim.run(until_us)
+        others = [node for node in sim.nodes if node is not seed_node]
+        times = sorted(node.completed_us - warmup_us for node in others if node.completed_us is not None)
+        covered = len(times) / len(others)
+
+        def time_to(fraction):
+            needed = math.ceil(fraction * len(others))
+            return f"{times[needed - 1] / 1e6:.0f}" if len(times) >= needed else "-"
+
+        received = [node.decoder.received / k for node in others if node.completed_us is not None]
+        rows.append(
+            (
+                name,
+                f"{covered:.2f}",
+                time_to(0.5),
+                time_to(0.9),
+                time_to(1.0),
+                sim.stats["fountain"],
+                f"{sum(received) / max(1, len(received)):.2f}",
+            )
+        )
+        print(f"{name} done", file=sys.stderr)
+    print(
+        f"{args.nodes} badges in {args.width:g}x{args.height:g}m, {args.size} byte file in {k} blocks, seeded from the "
+        f"middle for {SEED_SYMBOLS_PER_BLOCK * k * SEED_INTERVAL_US / 1e6:g}s, chat every {args.interval:g}s\n"
+    )
+    print_table(rows, ("Variant", "Covered", "50% s", "90% s", "100% s", "Symbol tx", "Received/k"))
+    print("Times are from the start of seeding, - if not reached. Symbol tx counts relays too. Received/k is symbols")
+    print("a badge took in to decode.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=1)
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    parser_txpower = subparsers.add_parser("txpower", help="Fixed vs density aware transmit power")
+    parser_txpower.add_argument("--nodes", type=int, default=100)
+    parser_txpower.add_argument("--width", type=float, default=120.0, help="Meters")
+    parser_txpower.add_argument("--height", type=float, default=80.0, help="Meters")
+    parser_txpower.add_argument("--power", type=int, default=9, help="Starting transmit power, dBm")
+    parser_txpower.add_argument("--interval", type=float, default=60.0, help="Mean seconds between chats per badge")
+    parser_txpower.add_argument("--ttl", type=int, default=3)
+    parser_txpower.add_argument("--period", type=int, default=20, help="Seconds between power updates")
+    parser_txpower.add_argument("--warmup", type=float, default=200.0, help="Seconds before measuring")
+    parser_txpower.add_argument("--duration", type=float, default=60.0, help="Seconds measured")
+    parser_txpower.set_defaults(func=txpower)
+
+    parser_tdma = subparsers.add_parser("tdma", help="CSMA (send_all today) vs slotted TDMA")
+    parser_tdma.add_argument("--nodes", type=int, nargs="+", default=[50, 200, 500])
+    parser_tdma.add_argument("--width", type=float, default=120.0, help="Meters")
+    parser_tdma.add_argument("--height", type=float, default=80.0, help="Meters")
+    parser_tdma.add_argument("--interval", type=float, default=120.0, help="Mean seconds between chats per badge")
+    parser_tdma.add_argument("--ttl", type=int, default=3)
+    parser_tdma.add_argument("--slots", type=int, default=SLOTS, help="Slots per superframe")
+    parser_tdma.add_argument("--warmup", type=float, default=120.0, help="Seconds for clocks to sync")
+    parser_tdma.add_argument("--duration", type=float, default=60.0, help="Seconds measured")
+    parser_tdma.set_defaults(func=tdma)
+
+    parser_netcode = subparsers.add_parser("netcode", help="Plain relays vs XOR network coded relays")
+    parser_netcode.add_argument("--nodes", type=int, nargs="+", default=[50, 100, 200])
+    parser_netcode.add_argument("--width", type=float, default=300.0, help="Meters")
+    parser_netcode.add_argument("--height", type=float, default=200.0, help="Meters")
+    parser_netcode.add_argument("--interval", type=float, default=60.0, help="Mean seconds between chats per badge")
+    parser_netcode.add_argument("--ttl", type=int, default=3)
+    parser_netcode.add_argument("--warmup", type=float, default=60.0, help="Seconds before measuring")
+    parser_netcode.add_argument("--duration", type=float, default=120.0, help="Seconds measured")
+    parser_netcode.set_defaults(func=netcode)
+
+    parser_ttl = subparsers.add_parser("ttl", help="Fixed TTLs vs TTLs from learned hop distances")
+    parser_ttl.add_argument("--nodes", type=int, default=100)
+    parser_ttl.add_argument("--sizes", nargs="+", default=["120x80", "300x200", "600x400"], help="Areas, WxH meters")
+    parser_ttl.add_argument("--interval", type=float, default=60.0, help="Mean seconds between chats per badge")
+    parser_ttl.add_argument("--ttl", type=int, default=3, help="Chat TTL")
+    parser_ttl.add_argument("--unicast-interval", type=float, default=120.0, help="Mean seconds between unicasts per badge")
+    parser_ttl.add_argument("--unicast-ttl", type=int, default=7, help="Like PONG")
+    parser_ttl.add_argument("--warmup", type=float, default=120.0, help="Seconds to learn hop distances")
+    parser_ttl.add_argument("--duration", type=float, default=400.0, help="Seconds measured")
+    parser_ttl.set_defaults(func=ttl)
+
+    parser_dtn = subparsers.add_parser("dtn", help="Plain relays vs store-and-forward for badges that sleep")
+    parser_dtn.add_argument("--nodes", type=int, default=100)
+    parser_dtn.add_argument("--width", type=float, default=300.0, help="Meters")
+    parser_dtn.add_argument("--height", type=float, default=200.0, help="Meters")
+    parser_dtn.add_argument("--awake", type=float, default=300.0, help="Mean seconds a badge stays awake")
+    parser_dtn.add_argument("--asleep", type=float, nargs="+", default=[0, 60, 180], help="Mean seconds asleep")
+    parser_dtn.add_argument("--interval", type=float, default=60.0, help="Mean seconds between chats per badge")
+    parser_dtn.add_argument("--ttl", type=int, default=3, help="Chat TTL")
+    parser_dtn.add_argument("--unicast-interval", type=float, default=120.0, help="Mean seconds between unicasts per badge")
+    parser_dtn.add_argument("--unicast-ttl", type=int, default=7, help="Like PONG")
+    parser_dtn.add_argument("--warmup", type=float, default=120.0, help="Seconds before measuring")
+    parser_dtn.add_argument("--duration", type=float, default=600.0, help="Seconds of measured traffic")
+    parser_dtn.add_argument("--drain", type=float, default=300.0, help="Seconds run after traffic stops")
+    parser_dtn.set_defaults(func=dtn)
+
+    parser_fountain = subparsers.add_parser("fountain", help="Time for a fountain coded file to reach every badge")
+    parser_fountain.add_argument("--nodes", type=int, default=100)
+    parser_fountain.add_argument("--width", type=float, default=300.0, help="Meters")
+    parser_fountain.add_argument("--height", type=float, default=200.0, help="Meters")
+    parser_fountain.add_argument("--size", type=int, default=20000, help="File bytes")
+    parser_fountain.add_argument("--reseed", type=float, nargs="+", default=[2.0, 5.0], help="Seconds between symbols")
+    parser_fountain.add_argument("--flood-ttl", type=int, default=3, help="TTL of the seed's symbols, relayed")
+    parser_fountain.add_argument("--interval", type=float, default=60.0, help="Mean seconds between chats per badge")
+    parser_fountain.add_argument("--ttl", type=int, default=3, help="Chat TTL")
+    parser_fountain.add_argument("--warmup", type=float, default=30.0, help="Seconds before seeding starts")
+    parser_fountain.add_argument("--duration", type=float, default=1800.0, help="Seconds run after seeding starts")
+    parser_fountain.set_defaults(func=fountain)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/bin/env python3
+"""Compare signature schemes and the group MAC: sign and verify time, and time on air of the frames.
+
+This runs on your computer, not the badge:
+python scripts/signature_bench.py
+Sign and verify are timed with the cryptography package (pip install cryptography), whose API the
+badge's ucryptography follows. They're far faster on a computer, compare the ratios. Without the
+package only the group MAC is timed, with the reference in net/group_mac.py.
+"""
+
+import argparse
+import pathlib
+import struct
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "badge"))
+
+from net.fountain import MANIFEST_STRUCT  # noqa: E402
+from net.group_mac import GroupKeyring  # noqa: E402
+from net.phy import PROFILES, time_on_air_us  # noqa: E402
+
+BADGENET_HEADER_LEN = 16
+
+# name: signature bytes, as sent, see net/crypto.py
+SCHEMES = {
+    "rsa": 128,
+    "ed25519": 65,
+}
+
+# (name, scheme, structdef) as sent, copied from the apps defining them. Fixed fields sized for RSA
+# carry Ed25519 signatures padded, only frames sized to the signature get shorter
+SIGNED_FRAMES = (
+    ("CONFIG_OVERRIDE", "rsa", "!128s20s80s"),
+    ("CONFIG_OVERRIDE", "ed25519", "!128s20s80s"),
+    ("SIGNED_TEXT_CHAT", "rsa", "!H10s128s90s"),
+    ("SIGNED_TEXT_CHAT", "ed25519", "!H10s128s90s"),
+    ("SHORT_SIGNED_TEXT_CHAT", "ed25519", "!H65s100s"),
+    ("FOUNTAIN_MANIFEST", "rsa", MANIFEST_STRUCT + "128s"),
+    ("FOUNTAIN_MANIFEST", "ed25519", MANIFEST_STRUCT + "65s"),
+    ("MAC_TEXT_CHAT", "group mac", "!HBI8s100s"),
+)
+
+
+def signers():
+    """name: (sign, verify) with throwaway keys, or empty without the cryptography package."""
+    try:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+    except ImportError:
+        return {}
+
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+    pss = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=hashes.SHA256().digest_size)
+    ed25519_key = ed25519.Ed25519PrivateKey.generate()
+    return {
+        "rsa": (
+            lambda message: rsa_key.sign(message, pss, hashes.SHA256()),
+            lambda message, signature: rsa_key.public_key().verify(signature, message, pss, hashes.SHA256()),
+        ),
+        "ed25519": (
+            ed25519_key.sign,
+            lambda message, signature: ed25519_key.public_key().verify(signature, message),
+        ),
+    }
+
+
+def time_us(function, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return (time.perf_counter() - start) * 1e6 / count
+
+
+def print_table(rows: list[tuple], headers: tuple):
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="Signatures to time per scheme")
+    args = parser.parse_args()
+
+    message = bytes(100)
+    rows = []
+    timers = signers()
+    for name, (sign, verify) in timers.items():
+        signature = sign(message)
+        rows.append(
+            (
+                name,
+                SCHEMES[name],
+                f"{time_us(lambda: sign(message), args.count):.0f}",
+                f"{time_us(lambda: verify(message, signature), args.count):.0f}",
+            )
+        )
+    keyring = GroupKeyring()
+    keyring.set_key(1, bytes(16))
+    key_id, counter, tag = keyring.seal(0x12345678, 12, message)
+    rows.append(
+        (
+            "group mac",
+            13,  # Key ID, counter and tag
+            f"{time_us(lambda: keyring.seal(0x12345678, 12, message), args.count):.0f}",
+            f"{time_us(lambda: keyring.current.tag(0x12345678, counter, 12, message), args.count):.0f}",
+        )
+    )
+    if not timers:
+        print("Install the cryptography package to time sign and verify.\n")
+    print_table(rows, ("Scheme", "Bytes", "Sign us", "Verify us"))
+
+    rows = []
+    for protocol, scheme, structdef in SIGNED_FRAMES:
+        frame_len = BADGENET_HEADER_LEN + struct.calcsize(structdef)
+        row = [protocol, scheme, frame_len]
+        for profile in PROFILES:
+            phy = dict(sf=profile.sf, bw_khz=profile.bw_khz, cr=profile.cr, preamble_len=profile.preamble_len)
+            row.append(f"{time_on_air_us(frame_len, **phy) / 1000:.1f}")
+        rows.append(tuple(row))
+    print("Signed frames, time on air:")
+    print_table(rows, ("Protocol", "Scheme", "Bytes") + tuple(f"{profile.name} ms" for profile in PROFILES))
+
+
+if __name__ == "__main__":
+    main()
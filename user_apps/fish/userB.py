@@ -10,6 +10,8 @@ import ui.styles as styles
 import lvgl
 import random
 
+APP_NAME = "Fish"
+
 """
 All protocols must be defined in their apps with unique ports. Ports must fit in uint8.
 Try to pick a protocol ID that isn't in use yet; good luck.
@@ -9,6 +9,8 @@ from ui.page import Page
 from machine import Pin
 from hardware import board
 
+APP_NAME = "Life"
+
 SCREEN_WIDTH = 428
 SCREEN_HEIGHT = 142
 
@@ -8,6 +8,8 @@ import sys
 from apps.base_app import BaseApp
 from ui import styles
 
+APP_NAME = "HW Monitor"
+
 try:
     import esp32
     HAS_ESP32 = True
@@ -2,9 +2,12 @@
 
 import lvgl
 import gc
+import uasyncio as aio  # type: ignore
 from apps.base_app import BaseApp
 from ui import styles
-from net._sx126x import SX126X_CMD_GET_RSSI_INST
+from net.lora import SpectrumSweep
+
+APP_NAME = "Spectrum"
 
 
 class SpectrumAnalyzer(BaseApp):
@@ -12,7 +15,7 @@ class SpectrumAnalyzer(BaseApp):
 
     def __init__(self, name: str, badge):
         super().__init__(name, badge)
-        self.foreground_sleep_ms = 1  # Minimal sleep - each channel scan takes ~4ms anyway
+        self.foreground_sleep_ms = 20  # Sweeps run in their own task, this just redraws
 
         # Spectrum settings for 915 MHz ISM band
         self.start_freq = 902.0  # MHz
@@ -28,7 +31,6 @@ class SpectrumAnalyzer(BaseApp):
 
         # RSSI history for each channel (for averaging/smoothing)
         self.rssi_history = [[-120.0] * 3 for _ in range(self.num_channels)]
-        self.current_channel = 0
 
         # Adaptive baseline tracking
         self.baseline_rssi = -120.0  # Noise floor
@@ -49,8 +51,10 @@ class SpectrumAnalyzer(BaseApp):
         self.grid_lines = []
         self.spectrum_bars = []
 
-        # Radio state
-        self.original_freq = None
+        # Radio state. The radio sweeps into self.sweep.rssi, see LoraRadio.sweep()
+        self.sweep = SpectrumSweep(self.start_freq, self.channel_width, self.num_channels)
+        self.sweep_task = None
+        self.drawn_sweeps = 0
         self.scanning_active = False
 
         # Display mode (spectrum or waterfall)
@@ -108,12 +112,21 @@ class SpectrumAnalyzer(BaseApp):
             bar.set_style_border_width(0, 0)
             self.spectrum_bars.append(bar)
 
-        # Save original radio frequency
+        # Start sweeping in the background of the event loop
+        self.scanning_active = True
+        if self.sweep_task is None:
+            self.sweep_task = aio.create_task(self.sweep_loop())
+
+    async def sweep_loop(self):
+        """Sweep the band while the app is in the foreground. The radio goes back to the mesh between sweeps."""
         try:
-            self.original_freq = self.badge.lora.frequency
-            self.scanning_active = True
-        except:
-            pass
+            while self.active_foreground:
+                if self.scanning_active:
+                    if not await self.badge.lora.sweep(self.sweep):
+                        break
+                await aio.sleep_ms(self.foreground_sleep_ms)
+        finally:
+            self.sweep_task = None
 
     def update_title(self):
         """Update title based on current display mode."""
@@ -172,8 +185,8 @@ class SpectrumAnalyzer(BaseApp):
             ]
         else:
             # Draw time scale for waterfall mode
-            # Approximate scan rate: ~1-2 scans/sec, 40 rows total
-            total_time = self.waterfall_rows  # Rough seconds estimate
+            # One row per sweep, at the measured sweep rate
+            total_time = int(self.waterfall_rows / max(0.5, self.sweep.sweeps_per_s))
             scale_values = [
                 ("Now", self.graph_y_offset + self.graph_height - 10),  # Bottom (newest)
                 (f"{total_time//2}s", self.graph_y_offset + self.graph_height // 2),  # Middle
@@ -371,104 +384,71 @@ class SpectrumAnalyzer(BaseApp):
         self.waterfall_pixels = []
         self.waterfall_next_row = 0  # Reset circular buffer index
 
-    def get_instantaneous_rssi(self):
-        """Get instantaneous RSSI from the radio."""
-        try:
-            # Call the low-level command to get instantaneous RSSI
-            rssi_buf = bytearray(1)
-            rssi_buf_mv = memoryview(rssi_buf)
+    def update_channel(self, channel, rssi):
+        """Add one channel of a sweep to the history and update its bar."""
+        # Add to history and average
+        self.rssi_history[channel].pop(0)
+        self.rssi_history[channel].append(rssi)
+        avg_rssi = sum(self.rssi_history[channel]) / len(self.rssi_history[channel])
+
+        # Auto-calibrate baseline during first few scans
+        if self.baseline_samples < 200:  # Calibrate over ~4 full scans
+            if self.baseline_samples == 0:
+                self.baseline_rssi = avg_rssi
+                self.max_rssi = avg_rssi
+            else:
+                # Track minimum (noise floor) and maximum
+                self.baseline_rssi = min(self.baseline_rssi, avg_rssi)
+                self.max_rssi = max(self.max_rssi, avg_rssi)
+            self.baseline_samples += 1
+
+            if self.baseline_samples == 200:
+                self.baseline_calibrated = True
+                # Add some margin to the range
+                range_db = self.max_rssi - self.baseline_rssi
+                if range_db < 20:  # Ensure minimum 20dB dynamic range
+                    self.max_rssi = self.baseline_rssi + 20
+        else:
+            # Update max if we see something stronger
+            self.max_rssi = max(self.max_rssi, avg_rssi)
 
-            # Send GET_RSSI_INST command
-            self.badge.lora.radio.SPIreadCommand([SX126X_CMD_GET_RSSI_INST], 1, rssi_buf_mv, 1)
+        # Scale relative to adaptive baseline
+        # Map from baseline to max_rssi across the full height
+        dynamic_range = max(20, self.max_rssi - self.baseline_rssi)  # At least 20dB range
+        rssi_clamped = max(self.baseline_rssi, min(self.max_rssi, avg_rssi))
+        bar_height = int((rssi_clamped - self.baseline_rssi) * self.graph_height / dynamic_range)
+        bar_height = max(2, min(self.graph_height, bar_height))
 
-            # Convert to dBm (same formula as packet RSSI)
-            rssi_raw = rssi_buf[0]
-            rssi_dbm = -1.0 * rssi_raw / 2.0
+        # Get color for this RSSI value
+        color = self.get_color_for_rssi(avg_rssi)
 
-            return rssi_dbm
-        except Exception as e:
-            # If we can't get RSSI, return a very low value
-            return -120.0
+        # Update bar
+        bar = self.spectrum_bars[channel]
+        try:
+            bar.set_size(self.bar_width - 1, bar_height)
+            bar.set_pos(self.graph_x_offset + channel * self.bar_width,
+                       self.graph_y_offset + self.graph_height - bar_height)
+            bar.set_style_bg_color(lvgl.color_hex(color), 0)
+        except:
+            pass
+
+        # Track peak RSSI
+        if avg_rssi > self.peak_rssi:
+            self.peak_rssi = avg_rssi
+            self.peak_channel = channel
 
     def scan_spectrum(self):
-        """Scan one channel and update the display."""
-        if not self.scanning_active:
+        """Draw the latest completed sweep, if there's a new one."""
+        if not self.scanning_active or self.sweep.count == self.drawn_sweeps:
             return
+        self.drawn_sweeps = self.sweep.count
 
         try:
-            import time
-
-            # Calculate frequency for current channel
-            freq = self.start_freq + (self.current_channel * self.channel_width)
-
-            # Set radio to this frequency and let it settle
-            self.badge.lora.radio.setFrequency(freq)
-            self.badge.lora.radio.standby()
-            time.sleep_ms(3)  # Let frequency settle (reduced from 5ms)
-
-            # Put radio in RX mode briefly to measure RSSI
-            self.badge.lora.radio.setRx(0)  # Continuous RX
-            time.sleep_ms(1)  # Brief delay to start receiving (reduced from 2ms)
-
-            # Get instantaneous RSSI
-            rssi = self.get_instantaneous_rssi()
-
-            # Return to standby
-            self.badge.lora.radio.standby()
-
-            # Add to history and average
-            self.rssi_history[self.current_channel].pop(0)
-            self.rssi_history[self.current_channel].append(rssi)
-            avg_rssi = sum(self.rssi_history[self.current_channel]) / len(self.rssi_history[self.current_channel])
-
-            # Auto-calibrate baseline during first few scans
-            if self.baseline_samples < 200:  # Calibrate over ~4 full scans
-                if self.baseline_samples == 0:
-                    self.baseline_rssi = avg_rssi
-                    self.max_rssi = avg_rssi
-                else:
-                    # Track minimum (noise floor) and maximum
-                    self.baseline_rssi = min(self.baseline_rssi, avg_rssi)
-                    self.max_rssi = max(self.max_rssi, avg_rssi)
-                self.baseline_samples += 1
-
-                if self.baseline_samples == 200:
-                    self.baseline_calibrated = True
-                    # Add some margin to the range
-                    range_db = self.max_rssi - self.baseline_rssi
-                    if range_db < 20:  # Ensure minimum 20dB dynamic range
-                        self.max_rssi = self.baseline_rssi + 20
-            else:
-                # Update max if we see something stronger
-                self.max_rssi = max(self.max_rssi, avg_rssi)
-
-            # Scale relative to adaptive baseline
-            # Map from baseline to max_rssi across the full height
-            dynamic_range = max(20, self.max_rssi - self.baseline_rssi)  # At least 20dB range
-            rssi_clamped = max(self.baseline_rssi, min(self.max_rssi, avg_rssi))
-            bar_height = int((rssi_clamped - self.baseline_rssi) * self.graph_height / dynamic_range)
-            bar_height = max(2, min(self.graph_height, bar_height))
+            for channel in range(self.num_channels):
+                self.update_channel(channel, self.sweep.rssi[channel])
 
-            # Get color for this RSSI value
-            color = self.get_color_for_rssi(avg_rssi)
-
-            # Update bar
-            bar = self.spectrum_bars[self.current_channel]
-            try:
-                bar.set_size(self.bar_width - 1, bar_height)
-                bar.set_pos(self.graph_x_offset + self.current_channel * self.bar_width,
-                           self.graph_y_offset + self.graph_height - bar_height)
-                bar.set_style_bg_color(lvgl.color_hex(color), 0)
-            except:
-                pass
-
-            # Track peak RSSI
-            if avg_rssi > self.peak_rssi:
-                self.peak_rssi = avg_rssi
-                self.peak_channel = self.current_channel
-
-            # Update info label every full scan (when returning to channel 0)
-            if self.current_channel == 0 and self.info_label:
+            # Update info label every full scan
+            if self.info_label:
                 try:
                     if not self.baseline_calibrated:
                         # Show calibration progress
@@ -482,49 +462,33 @@ class SpectrumAnalyzer(BaseApp):
                         self.draw_scale_labels()
                 except:
                     pass
+            if self.status_label:
+                try:
+                    self.status_label.set_text(f"{self.sweep.sweeps_per_s:.1f}/s")
+                except:
+                    pass
 
-            # Move to next channel
-            self.current_channel = (self.current_channel + 1) % self.num_channels
-
-            # Check buttons every 10 channels for responsiveness
-            if self.current_channel % 10 == 0:
-                if self.check_buttons():
-                    return
-
-            # If we just completed a full scan (wrapped to 0), update waterfall data
-            if self.current_channel == 0:
-                import time
-                scan_complete_time = time.ticks_ms()
-                print(f"\n[SCAN] Complete scan at {scan_complete_time}, mode: {self.display_mode}")
-
-                # Get average RSSI for each channel for this scan
-                scan_rssi = [sum(self.rssi_history[i]) / len(self.rssi_history[i])
-                            for i in range(self.num_channels)]
-
-                # Always add to waterfall data (collected in both modes)
-                self.waterfall_data.append(scan_rssi)
-
-                # Limit to waterfall_rows
-                if len(self.waterfall_data) > self.waterfall_rows:
-                    self.waterfall_data.pop(0)
+            # Get average RSSI for each channel for this scan
+            scan_rssi = [sum(self.rssi_history[i]) / len(self.rssi_history[i])
+                        for i in range(self.num_channels)]
 
-                print(f"[SCAN] Waterfall data: {len(self.waterfall_data)} scans stored")
+            # Always add to waterfall data (collected in both modes)
+            self.waterfall_data.append(scan_rssi)
 
-                # Check buttons before waterfall drawing (it can be slow)
-                if self.check_buttons():
-                    return
+            # Limit to waterfall_rows
+            if len(self.waterfall_data) > self.waterfall_rows:
+                self.waterfall_data.pop(0)
 
-                # Only draw new row if actively in waterfall mode
-                if self.display_mode == "waterfall":
-                    print(f"[SCAN] Drawing waterfall row...")
-                    self.add_waterfall_row(scan_rssi)
+            # Check buttons before waterfall drawing (it can be slow)
+            if self.check_buttons():
+                return
 
-                # Check buttons after waterfall drawing
-                if self.check_buttons():
-                    return
+            # Only draw new row if actively in waterfall mode
+            if self.display_mode == "waterfall":
+                self.add_waterfall_row(scan_rssi)
 
         except Exception as e:
-            # If scanning fails, just continue
+            # If drawing fails, just continue
             pass
 
     def check_buttons(self):
@@ -577,17 +541,9 @@ class SpectrumAnalyzer(BaseApp):
         """Clean up when going to background."""
         super().switch_to_background()
 
-        # Stop scanning
+        # Stop scanning. The sweep task ends after its current sweep, which restores the radio.
         self.scanning_active = False
 
-        # Restore original radio frequency
-        if self.original_freq:
-            try:
-                self.badge.lora.radio.setFrequency(self.original_freq)
-                self.badge.lora.radio.standby()
-            except:
-                pass
-
         # Clear all bars
         for bar in self.spectrum_bars:
             try:
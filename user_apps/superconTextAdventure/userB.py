@@ -9,6 +9,8 @@ from ui.page import Page
 import ui.styles as styles
 import lvgl
 
+APP_NAME = "Adventure"
+
 """
 All protocols must be defined in their apps with unique ports. Ports must fit in uint8.
 Try to pick a protocol ID that isn't in use yet; good luck.
@@ -56,6 +56,7 @@ class App(BaseApp):
         self.choice_time = 0
         self.send_retry_time = 0
         self.send_retry_count = 0
+        self.send_handle = None
         self.game_over = True
         self.my_alias = self.badge.config.get("alias").decode()
 
@@ -116,7 +117,8 @@ class App(BaseApp):
             payload=(ord(self.user_choice), self.my_alias[:10]),
             ttl=2,
         )
-        send(tx_frame)
+        # A retry that can't go out before the next one is due is useless
+        self.send_handle = send(tx_frame, expires_ms=int(RETRY_PERIOD * 1000 * 2**self.send_retry_count))
         current_time = time.time()
         print(f"Sent message #{self.send_retry_count} @ {current_time - self.choice_time}s: {tx_frame}")
         self.send_retry_time = current_time + RETRY_PERIOD * (2**self.send_retry_count)
@@ -178,7 +180,8 @@ class App(BaseApp):
                     self.receive_message(message)
                 else:
                     self.update_status(f"{time_left}s remaining")
-                    if self.send_retry_time - current_time <= 0:
+                    # Don't queue another retry while the last one is still waiting for the radio
+                    if self.send_retry_time - current_time <= 0 and self.send_handle.done():
                         self.send_message()
             else:
                 self.play(self.user_choice, self.remote_choice)
@@ -235,4 +238,5 @@ class App(BaseApp):
         super().switch_to_background()
 
 APP_NAME="RPS"
-APP_CLASS=App
\ No newline at end of file
+APP_CLASS=App
+APP_PORTS=(129,)
\ No newline at end of file